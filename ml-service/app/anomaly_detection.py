@@ -1,21 +1,23 @@
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import IsolationForest
-from typing import List, Dict, Any, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 import logging
 import traceback
 from datetime import datetime, timedelta
 import json
 import os
 
-# Configure logger for anomaly detection
+from .category_stats import CategoryStats, category_key
+from .logging_setup import SAMPLED
+from .metrics import MODEL_CACHE_LOOKUPS, StageTimer
+from .model_cache import model_cache
+
+if TYPE_CHECKING:
+    from .ingest import TransactionColumns
+
+# Handlers and levels are set up by logging_setup.configure_logging()
 logger = logging.getLogger('anomaly-detection')
-if not logger.handlers:
-    logger.setLevel(logging.INFO)
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
 
 def preprocess_transactions(transactions: List[Dict[str, Any]]) -> np.ndarray:
     """Extract and prepare features for machine learning."""
@@ -46,103 +48,155 @@ def preprocess_transactions(transactions: List[Dict[str, Any]]) -> np.ndarray:
             # Simple feature vector
             features.append([amount, days_since])
         except Exception as e:
-            logger.warning(f"Error processing transaction: {str(e)}")
+            logger.warning("Error processing transaction: %s", e)
     
     if not features:
         return np.array([])
     
     return np.array(features)
 
+# Feature columns fed to the Isolation Forest, in matrix column order
+ISOLATION_FOREST_FEATURES = ('amount', 'days_since', 'recency_weight', 'day_of_week', 'day_of_month')
+
+NS_PER_DAY = 86400 * 10**9
+
+# Severity labels, indexed by the codes the decision masks produce
+SEVERITY_LEVELS = ('High', 'Medium', 'Low')
+
+# Currency codes with their own symbol; anything else is shown in yen
+CURRENCY_SYMBOLS = {'USD': '$', 'EUR': '€', 'GBP': '£'}
+
+def currency_symbol_for(currencies: Iterable[Any]) -> str:
+    """Symbol of the first recognised currency code, defaulting to yen"""
+    for currency in currencies:
+        if currency in CURRENCY_SYMBOLS:
+            return CURRENCY_SYMBOLS[currency]
+    return "¥"
+
+def _parse_date_fallback(date_str: Any) -> Optional[datetime]:
+    """Parse a date the fast ISO path couldn't handle, returning an offset-naive datetime or None."""
+    try:
+        parsed = pd.to_datetime(date_str)
+        if pd.isna(parsed):
+            return None
+        return parsed.replace(tzinfo=None).to_pydatetime()
+    except Exception:
+        return None
+
+def parse_amounts(raw_amounts: Sequence[Any]) -> np.ndarray:
+    """Absolute float64 amounts; anything float() would reject becomes NaN"""
+    amounts = pd.to_numeric(pd.Series(raw_amounts, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    return np.abs(amounts)
+
+def parse_dates(raw_dates: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse date values into a datetime64[ns] array (NaT where unparseable) and a has-date mask"""
+    has_date = np.array([bool(d) for d in raw_dates], dtype=bool)
+    
+    # Batch-parse the YYYY-MM-DD prefix, which covers ISO dates and timestamps
+    date_part = [d.split('T', 1)[0] if isinstance(d, str) else None for d in raw_dates]
+    parsed = pd.to_datetime(pd.Series(date_part, dtype=object), format='%Y-%m-%d', errors='coerce')
+    
+    # Anything the fast path missed (other formats, explicit offsets) goes through pandas' parser
+    missed = np.flatnonzero(has_date & parsed.isna().to_numpy())
+    if len(missed):
+        parsed = parsed.astype(object)
+        for i in missed:
+            fallback = _parse_date_fallback(raw_dates[i]) if isinstance(raw_dates[i], str) else None
+            parsed.iat[i] = fallback if fallback is not None else pd.NaT
+        parsed = pd.to_datetime(parsed)
+    
+    return parsed.to_numpy(dtype='datetime64[ns]'), has_date
+
+def feature_columns_from_parsed(amounts: np.ndarray, dates: np.ndarray, has_date: np.ndarray,
+                                now: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+    """Feature columns from the output of parse_amounts and parse_dates (see extract_feature_columns)"""
+    n = len(amounts)
+    if now is None:
+        now = datetime.now()
+    
+    valid = ~np.isnan(amounts)
+    date_ok = ~np.isnat(dates)
+    valid &= date_ok | ~has_date
+    
+    # Missing dates default to "recent": 1 day ago, Monday, the 1st
+    days_since = np.ones(n, dtype=np.float64)
+    day_of_week = np.zeros(n, dtype=np.float64)
+    day_of_month = np.ones(n, dtype=np.float64)
+    if date_ok.any():
+        dated = pd.DatetimeIndex(dates[date_ok])
+        delta_ns = np.datetime64(now, 'ns').astype(np.int64) - dates[date_ok].astype(np.int64)
+        days_since[date_ok] = np.floor_divide(delta_ns, NS_PER_DAY)
+        day_of_week[date_ok] = dated.weekday.to_numpy()
+        day_of_month[date_ok] = dated.day.to_numpy()
+    
+    # Transactions from the last 60 days get a linearly decaying recency weight
+    recency_weight = np.maximum(0, 1 - days_since / 60)
+    
+    columns = {
+        'amount': amounts,
+        'days_since': days_since,
+        'recency_weight': recency_weight,
+        'day_of_week': day_of_week,
+        'day_of_month': day_of_month,
+    }
+    columns = {name: col.astype(np.float32) for name, col in columns.items()}
+    columns['valid'] = valid
+    return columns
+
+def extract_feature_columns(transactions: List[Dict[str, Any]], now: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+    """Turn a list of transactions into float32 feature columns in a single pass.
+    
+    Returns a dict with one array per name in ISOLATION_FOREST_FEATURES plus a boolean
+    'valid' mask. Rows with an unparseable amount or date are marked invalid rather than
+    dropped, so every column stays aligned with the input list.
+    """
+    amounts = parse_amounts([tx.get('amount', 0) for tx in transactions])
+    dates, has_date = parse_dates([tx.get('date') for tx in transactions])
+    return feature_columns_from_parsed(amounts, dates, has_date, now)
+
+def feature_matrix(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Stack the valid rows of extract_feature_columns output into an (n, features) matrix."""
+    valid = columns['valid']
+    if not valid.any():
+        return np.array([])
+    return np.column_stack([columns[name][valid] for name in ISOLATION_FOREST_FEATURES])
+
 def preprocess_transactions_for_isolation_forest(transactions: List[Dict[str, Any]]) -> np.ndarray:
     """Extract and prepare features for isolation forest."""
     if not transactions:
         return np.array([])
     
-    features = []
+    columns = extract_feature_columns(transactions)
     
-    # Get current date for recency calculation (without timezone info)
-    now = datetime.now()
+    skipped = len(transactions) - int(columns['valid'].sum())
+    if skipped:
+        logger.error("Skipped %s transactions with invalid amount or date for ML", skipped)
     
-    for tx in transactions:
-        try:
-            # Extract amount (make sure it's a float)
-            amount = abs(float(tx.get('amount', 0)))
-            
-            # Extract date if available
-            date_str = tx.get('date')
-            if date_str:
-                try:
-                    # Make sure we create an offset-naive datetime for consistency
-                    # Try different formats but ensure the result is offset-naive
-                    if 'T' in date_str:
-                        # Remove timezone info if present
-                        date_str = date_str.split('T')[0]
-                        tx_date = datetime.strptime(date_str, '%Y-%m-%d')
-                    else:
-                        # Simple date format
-                        tx_date = datetime.strptime(date_str, '%Y-%m-%d')
-                except ValueError:
-                    # Final fallback - use pandas to parse the date and convert to naive datetime
-                    tx_date = pd.to_datetime(date_str).replace(tzinfo=None).to_pydatetime()
-                
-                # Calculate days since the transaction
-                days_since = (now - tx_date).days
-                # Get day of the week (0-6)
-                day_of_week = tx_date.weekday()
-                # Get day of month (1-31)
-                day_of_month = tx_date.day
-            else:
-                # Default to recent if no date
-                days_since = 1
-                day_of_week = 0
-                day_of_month = 1
-            
-            # Calculate recency weight (more recent = higher weight)
-            # Transactions from the last 30 days have higher weights
-            recency_weight = max(0, 1 - (days_since / 60))
-            
-            # Create feature vector with more features for better detection
-            feature_vector = [
-                amount,              # Transaction amount
-                days_since,          # How recent the transaction is
-                recency_weight,      # Weight based on recency
-                day_of_week,         # Day of week pattern
-                day_of_month         # Day of month pattern
-            ]
-            features.append(feature_vector)
-            
-        except Exception as e:
-            logger.error(f"Error processing transaction for ML: {str(e)}")
-    
-    if not features:
-        return np.array([])
-    
-    return np.array(features)
+    return feature_matrix(columns)
 
-def generate_anomaly_reason(anomaly: Dict[str, Any], all_transactions: List[Dict[str, Any]]) -> str:
-    """Generate an explanation for why a transaction is anomalous"""
+def generate_anomaly_reason(anomaly: Dict[str, Any], all_transactions: List[Dict[str, Any]],
+                            category_stats: Optional[CategoryStats] = None) -> str:
+    """Generate an explanation for why a transaction is anomalous.
+    
+    Pass the request's category_stats to avoid rescanning all_transactions per anomaly.
+    """
     try:
         amount = float(anomaly.get('amount', 0))
         category_name = anomaly.get('categoryName', 'this category')
         
         # Determine currency symbol
-        currency_symbol = "¥"  # Default to yen
-        if anomaly.get('currency') == 'USD':
-            currency_symbol = "$"
-        elif anomaly.get('currency') == 'EUR':
-            currency_symbol = "€"
-        elif anomaly.get('currency') == 'GBP':
-            currency_symbol = "£"
-        
-        # Calculate average spending in this category
-        category_amounts = [float(tx.get('amount', 0)) for tx in all_transactions 
-                           if tx.get('category') == anomaly.get('category')]
-        
-        if not category_amounts:
+        currency_symbol = currency_symbol_for([anomaly.get('currency')])
+        
+        # Look up average spending in this category
+        if category_stats is None:
+            category_stats = CategoryStats.from_transactions(all_transactions)
+        stats = category_stats.summary(category_key(anomaly))
+        
+        if stats is None:
             return f"This expense of {currency_symbol}{amount:.2f} is unusual for your spending patterns."
             
-        mean = np.mean(category_amounts)
-        std_dev = np.std(category_amounts)
+        mean = stats['mean']
+        std_dev = stats['std']
         
         # Calculate z-score (how many standard deviations from mean)
         if std_dev > 0:
@@ -159,12 +213,14 @@ def generate_anomaly_reason(anomaly: Dict[str, Any], all_transactions: List[Dict
             return f"This {category_name} expense is higher than your typical spending pattern."
             
     except Exception as e:
-        logger.error(f"Error generating anomaly reason: {str(e)}")
+        logger.error("Error generating anomaly reason: %s", e)
         return "This transaction appears to be unusual based on your spending patterns."
 
 def detect_anomalies_isolation_forest(transactions: List[Dict[str, Any]], user_id: str = None, 
                                      user_accepted_ranges: Dict[str, bool] = None, 
-                                     user_alert_thresholds: Dict[str, float] = None) -> List[Dict[str, Any]]:
+                                     user_alert_thresholds: Dict[str, float] = None,
+                                     category_id: str = None,
+                                     category_stats: CategoryStats = None) -> List[Dict[str, Any]]:
     """Detect anomalies using scikit-learn's Isolation Forest algorithm.
     
     Parameters:
@@ -172,6 +228,8 @@ def detect_anomalies_isolation_forest(transactions: List[Dict[str, Any]], user_i
     - user_id: Optional user ID to retrieve user feedback
     - user_accepted_ranges: Optional dictionary of amount ranges the user has accepted as normal
     - user_alert_thresholds: Optional dictionary of alert thresholds by category
+    - category_id: Optional category the transactions belong to, used to key the model cache
+    - category_stats: Optional statistics index already built for these transactions
     """
     # Initialize empty dictionaries if None were provided
     if user_accepted_ranges is None:
@@ -183,86 +241,142 @@ def detect_anomalies_isolation_forest(transactions: List[Dict[str, Any]], user_i
         logger.warning("Not enough transactions for Isolation Forest")
         return []
     
+    timer = StageTimer()
+    
     # Sort transactions by date (newest first)
     sorted_transactions = sorted(transactions, key=lambda x: x.get('date', ''), reverse=True)
     
     # Determine currency symbol from transactions
-    currency_symbol = "¥"  # Default to yen
-    for tx in sorted_transactions[:5]:
-        if tx.get('currency') == 'USD':
-            currency_symbol = "$"
-            break
-        elif tx.get('currency') == 'EUR':
-            currency_symbol = "€"
-            break
-        elif tx.get('currency') == 'GBP':
-            currency_symbol = "£"
-            break
+    currency_symbol = currency_symbol_for(tx.get('currency') for tx in sorted_transactions[:5])
+    
+    timer.mark("parse")
+    
+    # Process transaction data for ML, dropping rows without a usable amount or date
+    columns = extract_feature_columns(sorted_transactions)
+    valid = columns['valid']
+    if not valid.all():
+        logger.error("Skipped %s transactions with invalid amount or date for ML", len(valid) - int(valid.sum()))
+        sorted_transactions = [tx for tx, ok in zip(sorted_transactions, valid) if ok]
     
     # Log sample transactions
-    for i in range(min(5, len(sorted_transactions))):
-        tx = sorted_transactions[i]
-        amount = abs(float(tx.get('amount', 0)))
-        logger.info(f"Transaction {i}: {currency_symbol}{amount:.2f} - {tx.get('description', 'Unknown')} (ID: {tx.get('id', 'unknown')})")
+    if logger.isEnabledFor(logging.DEBUG):
+        for i in range(min(5, len(sorted_transactions))):
+            tx = sorted_transactions[i]
+            amount = abs(float(tx.get('amount', 0)))
+            logger.debug("Transaction %s: %s%.2f - %s (ID: %s)", i, currency_symbol, amount, tx.get('description', 'Unknown'), tx.get('id', 'unknown'), extra=SAMPLED)
+    
+    features = feature_matrix(columns)
+    
+    if len(features) == 0 or features.shape[0] < 5:
+        logger.warning("Not enough valid features extracted for Isolation Forest: %s", len(features))
+        return []
+    
+    logger.info("Extracted %s features for %s transactions", features.shape[1], features.shape[0])
+    
+    # Extract categories and amounts, and look up each row's category statistics
+    categories = [category_key(tx) for tx in sorted_transactions]
+    amounts = np.array([abs(float(tx.get('amount', 0))) for tx in sorted_transactions])
+    
+    if category_stats is None:
+        category_stats = CategoryStats.from_transactions(sorted_transactions)
+    codes = category_stats.codes_for(categories)
+    timer.mark("features")
+    
+    return _detect_with_isolation_forest(
+        features, amounts, codes, category_stats, currency_symbol, sorted_transactions.__getitem__,
+        user_id, user_accepted_ranges, user_alert_thresholds, category_id, timer
+    )
+
+def detect_anomalies_isolation_forest_columns(data: "TransactionColumns", user_id: str = None,
+                                              user_accepted_ranges: Dict[str, bool] = None,
+                                              user_alert_thresholds: Dict[str, float] = None,
+                                              category_id: str = None,
+                                              category_stats: CategoryStats = None) -> List[Dict[str, Any]]:
+    """detect_anomalies_isolation_forest for transactions ingested into columns (see ingest.py).
+    
+    Only the rows that end up flagged are read back as dicts. Rows are ordered newest
+    first by parsed day, where the list version sorts by the raw date string; the two
+    agree for YYYY-MM-DD dates, but may order same-day timestamps differently.
+    """
+    if user_accepted_ranges is None:
+        user_accepted_ranges = {}
+    if user_alert_thresholds is None:
+        user_alert_thresholds = {}
+    
+    if len(data) < 5:
+        logger.warning("Not enough transactions for Isolation Forest")
+        return []
     
-    # Process transaction data for ML
-    features = preprocess_transactions_for_isolation_forest(sorted_transactions)
+    timer = StageTimer()
+    
+    # Newest first, stable, with undated rows last (as an empty date string would sort)
+    sort_keys = np.where(np.isnat(data.dates), np.iinfo(np.int64).min, data.dates.astype(np.int64))
+    order = len(data) - 1 - np.argsort(sort_keys[::-1], kind='stable')[::-1]
+    
+    currency_symbol = currency_symbol_for(data.currency(i) for i in order[:5])
+    timer.mark("parse")
+    
+    columns = feature_columns_from_parsed(data.amounts[order], data.dates[order], data.has_date[order])
+    valid = columns['valid']
+    if not valid.all():
+        logger.error("Skipped %s transactions with invalid amount or date for ML", len(valid) - int(valid.sum()))
+    rows = order[valid]
+    
+    features = feature_matrix(columns)
     
     if len(features) == 0 or features.shape[0] < 5:
-        logger.warning(f"Not enough valid features extracted for Isolation Forest: {len(features)}")
+        logger.warning("Not enough valid features extracted for Isolation Forest: %s", len(features))
         return []
     
-    logger.info(f"Extracted {features.shape[1]} features for {features.shape[0]} transactions")
-    
-    # Extract categories and amounts for statistics
-    categories = []
-    amounts = []
-    for tx in sorted_transactions:
-        cat = tx.get('category', tx.get('categoryName', 'Unknown'))
-        amount = abs(float(tx.get('amount', 0)))
-        categories.append(cat)
-        amounts.append(amount)
-    
-    # Calculate category-specific statistics
-    category_stats = {}
-    for category in set(categories):
-        cat_amounts = []
-        for i, tx in enumerate(sorted_transactions):
-            if categories[i] == category:
-                try:
-                    amount = abs(float(tx.get('amount', 0)))
-                    cat_amounts.append(amount)
-                except:
-                    pass
-        
-        if cat_amounts:
-            mean = np.mean(cat_amounts)
-            std = np.std(cat_amounts) if len(cat_amounts) > 1 else mean * 0.2
-            category_stats[category] = {
-                'mean': mean,
-                'std': std,
-                'min': np.min(cat_amounts),
-                'max': np.max(cat_amounts),
-                'median': np.median(cat_amounts),
-                # For simple outlier detection, calculate threshold as mean + 2*std
-                'threshold': mean + 2 * std
-            }
+    logger.info("Extracted %s features for %s transactions", features.shape[1], features.shape[0])
+    
+    if category_stats is None:
+        category_stats = CategoryStats.from_codes(data.category_codes, data.categories, data.amounts)
+    codes = category_stats.codes[rows]
+    amounts = data.amounts[rows]
+    timer.mark("features")
     
+    return _detect_with_isolation_forest(
+        features, amounts, codes, category_stats, currency_symbol, lambda i: data.record(rows[i]),
+        user_id, user_accepted_ranges, user_alert_thresholds, category_id, timer
+    )
+
+def _detect_with_isolation_forest(features: np.ndarray, amounts: np.ndarray, codes: np.ndarray,
+                                  category_stats: CategoryStats, currency_symbol: str,
+                                  record: Callable[[int], Dict[str, Any]], user_id: Optional[str],
+                                  user_accepted_ranges: Dict[str, bool], user_alert_thresholds: Dict[str, float],
+                                  category_id: Optional[str], timer: StageTimer) -> List[Dict[str, Any]]:
+    """Fit (or reuse) the model on prepared features and turn flagged rows into anomalies.
+    
+    amounts and codes are aligned with the feature rows; record(i) returns row i's
+    transaction dict and is only called for rows that get flagged.
+    """
     try:
         # Configure and train Isolation Forest model
         # Using higher contamination to detect more potential anomalies
         contamination = min(0.2, max(0.05, 3 / len(features)))
         
-        model = IsolationForest(
-            n_estimators=100,       # Number of trees
-            max_samples='auto',     # Subsample size
-            contamination=contamination,  # Expected proportion of outliers
-            random_state=42,        # For reproducibility
-            n_jobs=-1               # Use all CPU cores
-        )
+        # Reuse a model already fitted on identical features for this user and category
+        cache_key = model_cache.make_key(user_id, category_id, features)
+        model = model_cache.get(cache_key)
         
-        logger.info(f"Training Isolation Forest with contamination={contamination:.4f}")
-        model.fit(features)
+        if model is None:
+            model = IsolationForest(
+                n_estimators=100,       # Number of trees
+                max_samples='auto',     # Subsample size
+                contamination=contamination,  # Expected proportion of outliers
+                random_state=42,        # For reproducibility
+                n_jobs=1                # Detection jobs already run in parallel on the detection pool
+            )
+            
+            logger.info("Training Isolation Forest with contamination=%.4f", contamination)
+            model.fit(features)
+            model_cache.put(cache_key, model)
+            MODEL_CACHE_LOOKUPS.inc(result="miss")
+        else:
+            logger.info("Using cached Isolation Forest model (cache stats: %s)", model_cache.stats())
+            MODEL_CACHE_LOOKUPS.inc(result="hit")
+        timer.mark("fit")
         
         # Get anomaly scores (-1 to 1, lower is more anomalous)
         # Convert to 0-1 range for easier interpretation (higher = more anomalous)
@@ -276,183 +390,114 @@ def detect_anomalies_isolation_forest(transactions: List[Dict[str, Any]], user_i
         else:
             normalized_scores = 1 - ((raw_scores - min_score) / (max_score - min_score))
         
-        logger.info(f"Score range: {np.min(normalized_scores):.4f} to {np.max(normalized_scores):.4f}")
+        logger.info("Score range: %.4f to %.4f", np.min(normalized_scores), np.max(normalized_scores))
         
         # Get binary predictions (-1 for anomalies, 1 for normal)
         predictions = model.predict(features)
         anomaly_indices = np.where(predictions == -1)[0]
-        logger.info(f"Model identified {len(anomaly_indices)} transactions as anomalies")
+        timer.mark("score")
+        logger.info("Model identified %s transactions as anomalies", len(anomaly_indices))
         
-        # Create a list to store all detected anomalies
+        # Map every row to its category's statistics and the user's preferences as whole columns
+        unique_categories = category_stats.categories
+        mean_amount = category_stats.mean[codes]
+        # A single transaction has no spread, so assume 20% of the mean
+        std_dev = np.where(category_stats.count > 1, category_stats.std, category_stats.mean * 0.2)[codes]
+        # For simple outlier detection, calculate threshold as mean + 2*std
+        stat_threshold = mean_amount + 2 * std_dev
+        
+        # Accepted ranges: a (category x spending range) lookup table, indexed per row
+        accepted_table = np.array([[bool(user_accepted_ranges.get(f"{c}_{r}")) for r in SPENDING_RANGES]
+                                   for c in unique_categories], dtype=bool)
+        is_accepted_range = accepted_table[codes, get_range_indices(amounts)]
+        
+        has_user_threshold = np.array([f"{c}_threshold" in user_alert_thresholds for c in unique_categories])[codes]
+        user_threshold = np.array([user_alert_thresholds.get(f"{c}_threshold", float('inf')) for c in unique_categories],
+                                  dtype=float)[codes]
+        
+        # Ratio and z-score against the category, guarded against zero mean / std
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(mean_amount > 0, amounts / mean_amount, 1.0)
+            z_score = np.where(std_dev > 0, (amounts - mean_amount) / std_dev, 0.0)
+        
+        exceeds_user_threshold = has_user_threshold & (amounts > user_threshold)
+        
+        # Direct detection criteria:
+        # 1. With a user threshold: only amounts above it
+        # 2. Otherwise: amount exceeds the statistical threshold (mean + 2*std) OR ratio >= 1.5,
+        #    and the amount's range has not been marked as normal by the user
+        is_statistical_anomaly = (amounts > stat_threshold) | (ratio >= 1.5)
+        statistical_mask = np.where(has_user_threshold, exceeds_user_threshold,
+                                    is_statistical_anomaly & ~is_accepted_range)
+        statistical_scores = np.minimum(0.9, 0.6 + 0.1 * (ratio - 1))
+        statistical_severity = np.select([(ratio >= 3) | (z_score >= 3), (ratio >= 2) | (z_score >= 2)], [0, 1], 2)
+        
+        # Model detection: flagged by the forest, HIGHER than the category mean, not in an
+        # accepted range, and above the user's threshold if one is set
+        model_mask = ((predictions == -1) & (amounts > mean_amount) & ~is_accepted_range
+                      & ~(has_user_threshold & (amounts <= user_threshold)))
+        model_severity = np.select([(normalized_scores > 0.8) | (z_score > 3) | (ratio > 3),
+                                    (normalized_scores > 0.6) | (z_score > 2) | (ratio > 2)], [0, 1], 2)
+        
+        # Only flagged rows are turned into anomaly dicts
         anomalies = []
+        detected_ids = set()
         
-        # First pass: Perform direct statistical detection
         logger.info("Performing direct statistical detection for high values")
-        for i, tx in enumerate(sorted_transactions):
-            category = categories[i]
-            amount = amounts[i]
-            tx_id = tx.get('id', '')
-            
-            # Skip processing if no stats for this category
-            if category not in category_stats:
-                continue
-                
-            # Get statistics for this category
-            stats = category_stats[category]
-            mean_amount = stats['mean']
-            std_dev = stats['std']
-            threshold = stats['threshold']
-            
-            # Calculate ratio and z-score
-            ratio = amount / mean_amount if mean_amount > 0 else 1.0
-            z_score = (amount - mean_amount) / std_dev if std_dev > 0 else 0
-            
-            # Get the spending range for this amount
-            current_range = get_range_for_amount(amount)
-            range_key = f"{category}_{current_range}"
-            
-            # Check if this amount-range combination has been accepted by user
-            is_accepted_range = range_key in user_accepted_ranges and user_accepted_ranges[range_key]
-            
-            # Check if there's a user-defined threshold for this category
-            threshold_key = f"{category}_threshold"
-            has_user_threshold = threshold_key in user_alert_thresholds
-            user_threshold = user_alert_thresholds.get(threshold_key, float('inf')) if has_user_threshold else float('inf')
-            
-            # Direct detection criteria:
-            # 1. Amount exceeds statistical threshold (mean + 2*std) OR ratio >= 2.0, AND
-            # 2. NOT in a range marked as normal by user, AND
-            # 3. Either no user threshold OR exceeding user threshold
-            is_statistical_anomaly = (amount > threshold or ratio >= 1.5)
-            exceeds_user_threshold = has_user_threshold and amount > user_threshold
-            
-            # Apply user preferences
-            if (is_statistical_anomaly and not is_accepted_range) or exceeds_user_threshold:
-                # If there's a user threshold but we're below it, skip
-                if has_user_threshold and not exceeds_user_threshold:
-                    continue
-                    
-                logger.info(f"DIRECT DETECTION: {currency_symbol}{amount:.2f} in category '{category}' (threshold: {currency_symbol}{threshold:.2f}, ratio: {ratio:.2f}x)")
-            
-                # Create anomaly object
-                anomaly = tx.copy()
-                anomaly['detection_method'] = "statistical" if not exceeds_user_threshold else "threshold"
-                anomaly['anomalyScore'] = min(0.9, 0.6 + (0.1 * (ratio - 1)))
-                anomaly['category_avg'] = float(mean_amount)
-                anomaly['category_ratio'] = float(ratio)
-                anomaly['z_score'] = float(z_score)
-                
-                # Generate reason based on detection method
-                if exceeds_user_threshold:
-                    anomaly['reason'] = f"This expense exceeds your {currency_symbol}{user_threshold:.2f} alert threshold for {tx.get('categoryName', 'this category')}."
-                elif ratio >= 3:
-                    anomaly['reason'] = f"This expense is {ratio:.1f}x higher than your typical {category} spending."
-                elif ratio >= 2:
-                    anomaly['reason'] = f"This expense is significantly higher than your usual {category} spending."
-                else:
-                    anomaly['reason'] = f"This expense is higher than your usual {category} spending pattern."
-            
-                # Set severity
-                if ratio >= 3 or z_score >= 3:
-                    anomaly['severity'] = 'High'
-                elif ratio >= 2 or z_score >= 2:
-                    anomaly['severity'] = 'Medium'
-                else:
-                    anomaly['severity'] = 'Low'
+        for i in np.flatnonzero(statistical_mask):
+            tx = record(i)
+            category = unique_categories[codes[i]]
+            logger.debug("DIRECT DETECTION: %s%.2f in category '%s' (threshold: %s%.2f, ratio: %.2fx)",
+                         currency_symbol, amounts[i], category, currency_symbol, stat_threshold[i], ratio[i], extra=SAMPLED)
+            
+            anomaly = tx.copy()
+            anomaly['detection_method'] = "threshold" if exceeds_user_threshold[i] else "statistical"
+            anomaly['anomalyScore'] = float(statistical_scores[i])
+            anomaly['category_avg'] = float(mean_amount[i])
+            anomaly['category_ratio'] = float(ratio[i])
+            anomaly['z_score'] = float(z_score[i])
+            
+            # Generate reason based on detection method
+            if exceeds_user_threshold[i]:
+                anomaly['reason'] = f"This expense exceeds your {currency_symbol}{user_threshold[i]:.2f} alert threshold for {tx.get('categoryName', 'this category')}."
+            elif ratio[i] >= 3:
+                anomaly['reason'] = f"This expense is {ratio[i]:.1f}x higher than your typical {category} spending."
+            elif ratio[i] >= 2:
+                anomaly['reason'] = f"This expense is significantly higher than your usual {category} spending."
+            else:
+                anomaly['reason'] = f"This expense is higher than your usual {category} spending pattern."
             
-                anomalies.append(anomaly)
+            anomaly['severity'] = SEVERITY_LEVELS[statistical_severity[i]]
+            anomalies.append(anomaly)
+            detected_ids.add(tx.get('id'))
         
-        # Second pass: Add model-detected anomalies, but only if they're higher than normal
-        for i, score in enumerate(normalized_scores):
-            tx = sorted_transactions[i]
-            category = categories[i]
-            amount = amounts[i]
-            tx_id = tx.get('id', '')
+        for i in np.flatnonzero(model_mask):
+            tx = record(i)
             
             # Skip if already detected by statistical method
-            if any(a.get('id') == tx_id for a in anomalies):
+            if tx.get('id', '') in detected_ids:
                 continue
-                
-            # Determine if it's an anomaly based on model prediction
-            is_model_anomaly = predictions[i] == -1
             
-            # Skip if not an anomaly according to model
-            if not is_model_anomaly:
-                continue
-                
-            # Get category statistics
-            if category in category_stats:
-                stats = category_stats[category]
-                mean_amount = stats['mean']
-                median_amount = stats['median']
-                std_dev = stats['std']
+            score = float(normalized_scores[i])
+            anomaly = tx.copy()
+            anomaly['anomalyScore'] = score
+            anomaly['detection_method'] = "isolation_forest"
+            anomaly['model_score'] = score
+            anomaly['category_avg'] = float(mean_amount[i])
+            anomaly['category_ratio'] = float(ratio[i])
+            anomaly['z_score'] = float(z_score[i])
+            
+            if has_user_threshold[i]:
+                anomaly['reason'] = f"This expense exceeds your {currency_symbol}{user_threshold[i]:.2f} alert threshold for {tx.get('categoryName', 'this category')}."
             else:
-                mean_amount = np.mean(amounts) if amounts else 50.0
-                median_amount = np.median(amounts) if amounts else 50.0
-                std_dev = np.std(amounts) if len(amounts) > 1 else 10.0
-            
-            # Calculate ratio and z-score
-            ratio = amount / mean_amount if mean_amount > 0 else 1.0
-            z_score = (amount - mean_amount) / std_dev if std_dev > 0 else 0
-            
-            # Only flag as anomaly if amount is HIGHER than typical
-            is_higher_than_normal = amount > mean_amount
-            
-            # Get the spending range
-            current_range = get_range_for_amount(amount)
-            range_key = f"{category}_{current_range}"
+                anomaly['reason'] = generate_anomaly_reason(tx, [], category_stats)
             
-            # Check if this amount-range has been accepted by user
-            is_accepted_range = range_key in user_accepted_ranges and user_accepted_ranges[range_key]
+            anomaly['severity'] = SEVERITY_LEVELS[model_severity[i]]
+            anomalies.append(anomaly)
+            detected_ids.add(tx.get('id'))
             
-            # Check if amount is below user's threshold
-            threshold_key = f"{category}_threshold"
-            has_user_threshold = threshold_key in user_alert_thresholds
-            user_threshold = user_alert_thresholds.get(threshold_key, float('inf')) if has_user_threshold else float('inf')
-            below_user_threshold = has_user_threshold and amount <= user_threshold
-            
-            # Skip if:
-            # 1. User has marked this range as normal, OR
-            # 2. User has a threshold and we're below it
-            if is_accepted_range or (has_user_threshold and below_user_threshold):
-                continue
-            
-            # Only include if higher than normal
-            if is_model_anomaly and is_higher_than_normal:
-                # Create anomaly object
-                anomaly = tx.copy()
-                
-                # Set anomaly score - use model score
-                anomaly['anomalyScore'] = float(score)
-                
-                # Add detection metadata
-                anomaly['detection_method'] = "isolation_forest"
-                anomaly['model_score'] = float(score)
-                
-                # Add statistical context
-                anomaly['category_avg'] = float(mean_amount)
-                anomaly['category_ratio'] = float(ratio)
-                anomaly['z_score'] = float(z_score)
-                
-                # Generate appropriate reason
-                if has_user_threshold and amount > user_threshold:
-                    anomaly['reason'] = f"This expense exceeds your {currency_symbol}{user_threshold:.2f} alert threshold for {tx.get('categoryName', 'this category')}."
-                else:
-                    # Use the generate_anomaly_reason function
-                    anomaly['reason'] = generate_anomaly_reason(tx, sorted_transactions)
-                
-                # Set severity based on score and amount
-                if score > 0.8 or z_score > 3 or ratio > 3:
-                    anomaly['severity'] = 'High'
-                elif score > 0.6 or z_score > 2 or ratio > 2:
-                    anomaly['severity'] = 'Medium'
-                else:
-                    anomaly['severity'] = 'Low'
-                
-                anomalies.append(anomaly)
-    
-                logger.info(f"MODEL DETECTION: {currency_symbol}{amount:.2f} in category '{category}', score: {score:.4f}, " + 
-                           f"ratio: {ratio:.2f}x, z-score: {z_score:.2f}")
+            logger.debug("MODEL DETECTION: %s%.2f in category '%s', score: %.4f, ratio: %.2fx, z-score: %.2f",
+                         currency_symbol, amounts[i], unique_categories[codes[i]], score, ratio[i], z_score[i], extra=SAMPLED)
         
         # Sort anomalies by severity and score
         severity_order = {'High': 0, 'Medium': 1, 'Low': 2}
@@ -460,14 +505,26 @@ def detect_anomalies_isolation_forest(transactions: List[Dict[str, Any]], user_i
                                  key=lambda x: (severity_order.get(x.get('severity'), 3), 
                                                -float(x.get('anomalyScore', 0))))
         
-        logger.info(f"Isolation Forest found {len(sorted_anomalies)} anomalies")
+        logger.info("Isolation Forest found %s anomalies", len(sorted_anomalies))
+        timer.mark("postprocess")
         return sorted_anomalies
         
     except Exception as e:
-        logger.error(f"Error in Isolation Forest detection: {str(e)}")
+        logger.error("Error in Isolation Forest detection: %s", e)
         logger.error(traceback.format_exc())
         return []
 
+# Spending range names from lowest to highest, and the upper bounds separating them
+SPENDING_RANGES = ("low", "medium_low", "medium", "high", "very_high", "extreme")
+USD_RANGE_BOUNDS = np.array([50, 100, 150, 200, 300])
+JPY_RANGE_BOUNDS = np.array([5000, 10000, 15000, 20000, 30000])
+
+def get_range_indices(amounts: np.ndarray) -> np.ndarray:
+    """Vectorized get_range_for_amount: the SPENDING_RANGES index for each amount"""
+    usd = np.searchsorted(USD_RANGE_BOUNDS, amounts, side='right')
+    jpy = np.searchsorted(JPY_RANGE_BOUNDS, amounts, side='right')
+    return np.where(amounts > 1000, jpy, usd)
+
 def get_range_for_amount(amount: float) -> str:
     """Get the spending range for a given amount"""
     # Default ranges (for USD)
@@ -513,113 +570,113 @@ def get_range_for_amount(amount: float) -> str:
     
     return "extreme"  # Default if no range matches
 
-def detect_anomalies_sliding_window(transactions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Fallback method using sliding window approach"""
-    logger.info(f"Starting sliding window detection on {len(transactions)} transactions")
+def parse_transaction_dates(transactions: List[Dict[str, Any]]) -> pd.Series:
+    """Batch-parse transaction dates to UTC timestamps (NaT where missing or unparseable)."""
+    raw = pd.Series([tx.get('date') for tx in transactions], dtype=object)
+    parsed = pd.to_datetime(raw, errors='coerce', utc=True, format='ISO8601')
+    
+    # Only the rows the ISO fast path missed go through the slower per-element parser
+    missed = parsed.isna() & raw.notna()
+    if missed.any():
+        parsed[missed] = pd.to_datetime(raw[missed], errors='coerce', utc=True, format='mixed')
+    return parsed
+
+def rolling_window_stats(amounts: np.ndarray, window_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean and population std of the previous window_size amounts before each position.
+    
+    Early positions use however many previous amounts exist; NaN amounts are ignored.
+    """
+    previous = pd.Series(amounts).shift(1).rolling(window_size, min_periods=1)
+    return previous.mean().to_numpy(), previous.std(ddof=0).to_numpy()
+
+def detect_anomalies_sliding_window(transactions: List[Dict[str, Any]], window_sizes: Sequence[int] = (10,),
+                                    min_window: int = 5, by_category: bool = False) -> List[Dict[str, Any]]:
+    """Fallback method using sliding window approach.
+    
+    Each transaction is compared with the window_sizes transactions before it (by date);
+    amounts above mean + 2.5 std of any window are flagged, scored by the largest
+    z-score. The first min_window transactions only serve as context. With by_category,
+    windows are taken within each transaction's category rather than across the list.
+    """
+    logger.info("Starting sliding window detection on %s transactions", len(transactions))
     
     if len(transactions) < 5:
         logger.info("Not enough transactions for sliding window (minimum 5 required)")
         return []
     
     # Determine currency symbol
-    currency_symbol = "¥"  # Default to yen
-    for tx in transactions[:5]:
-        if tx.get('currency') == 'USD':
-            currency_symbol = "$"
-            break
-        elif tx.get('currency') == 'EUR':
-            currency_symbol = "€"
-            break
-        elif tx.get('currency') == 'GBP':
-            currency_symbol = "£"
-            break
+    currency_symbol = currency_symbol_for(tx.get('currency') for tx in transactions[:5])
         
     try:
-        # Convert dates to datetime objects for sorting
-        tx_with_dates = []
-        for tx in transactions:
-            try:
-                date_str = tx.get('date')
-                date = pd.to_datetime(date_str)
-                if not pd.isna(date):
-                    tx_with_dates.append((date, tx))
-            except Exception as e:
-                logger.warning(f"Error parsing date {date_str}: {str(e)}")
+        # Sort transactions with valid dates by date, keeping input order for ties
+        dates = parse_transaction_dates(transactions)
+        dated = np.flatnonzero(dates.notna().to_numpy())
+        order = dated[np.argsort(dates.iloc[dated].to_numpy(), kind='stable')]
+        sorted_tx = [transactions[i] for i in order]
         
-        # Sort by date
-        tx_with_dates.sort(key=lambda x: x[0])
-        sorted_tx = [tx for _, tx in tx_with_dates]
+        logger.info("Analyzing %s transactions with valid dates", len(sorted_tx))
         
-        logger.info(f"Analyzing {len(sorted_tx)} transactions with valid dates")
+        amounts = pd.to_numeric(pd.Series([tx.get('amount', 0) for tx in sorted_tx], dtype=object),
+                                errors='coerce').to_numpy(dtype=np.float64)
         
-        anomalies = []
-        window_size = 10  # Look at past 10 transactions
-        min_window = 5    # Need at least 5 for good stats
+        # Partition rows (positions in sorted_tx) into independent windowing groups
+        if by_category:
+            partitions = {}
+            for i, tx in enumerate(sorted_tx):
+                partitions.setdefault(category_key(tx), []).append(i)
+            partitions = [np.array(rows) for rows in partitions.values()]
+        else:
+            partitions = [np.arange(len(sorted_tx))]
+        
+        # Best (highest z-score) flagging window for each row
+        best_score = np.full(len(sorted_tx), -np.inf)
+        best_mean = np.zeros(len(sorted_tx))
+        
+        for rows in partitions:
+            group_amounts = amounts[rows]
+            has_context = np.arange(len(rows)) >= min_window
+            for window_size in window_sizes:
+                mean, std_dev = rolling_window_stats(group_amounts, window_size)
+                
+                # Skip rows without amounts, and windows with no spread (all amounts identical)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    usable = has_context & ~np.isnan(group_amounts) & (std_dev > 0)
+                    flagged = usable & (group_amounts > mean + 2.5 * std_dev)
+                    score = (group_amounts - mean) / std_dev
+                
+                better = flagged & (score > best_score[rows])
+                best_score[rows[better]] = score[better]
+                best_mean[rows[better]] = mean[better]
         
-        for i in range(min_window, len(sorted_tx)):
+        anomalies = []
+        for i in np.flatnonzero(np.isfinite(best_score)):
             current_tx = sorted_tx[i]
+            current_amount = amounts[i]
+            score = float(best_score[i])
+            mean = best_mean[i]
             
-            # Get window of previous transactions
-            available_context = min(window_size, i)
-            window = sorted_tx[i-available_context:i]
+            # Create explanation
+            category_name = current_tx.get("categoryName", "")
             
-            # Extract amounts, handling potential errors
-            amounts = []
-            for tx in window:
-                try:
-                    amount = float(tx.get('amount', 0))
-                    if not np.isnan(amount):
-                        amounts.append(amount)
-                except (ValueError, TypeError):
-                    logger.warning(f"Invalid amount in window: {tx.get('amount')}")
+            if score > 5:
+                reason = f"This expense of {currency_symbol}{current_amount:.2f} is extremely high compared to your typical {category_name} spending of around {currency_symbol}{mean:.2f}."
+            elif score > 3:
+                reason = f"This expense is significantly higher than your average {category_name} spending from this time period."
+            else:
+                reason = f"This {category_name} expense is higher than your typical spending pattern at the time."
             
-            if not amounts:
-                continue  # Skip if no valid amounts in window
-                
-            # Calculate statistics
-            mean = np.mean(amounts)
-            std_dev = np.std(amounts)
+            # Create a copy of the transaction with anomaly data
+            anomaly_tx = current_tx.copy()
+            anomaly_tx['anomalyScore'] = score
+            anomaly_tx['reason'] = reason
+            anomaly_tx['detectionMethod'] = 'sliding_window'
             
-            # Skip if standard deviation is zero (all amounts identical)
-            if std_dev == 0:
-                continue
-                
-            # Check if current transaction is anomalous
-            try:
-                current_amount = float(current_tx.get('amount', 0))
-                if np.isnan(current_amount):
-                    continue
-                    
-                threshold = mean + 2.5 * std_dev
-                
-                if current_amount > threshold:
-                    # Calculate z-score
-                    score = (current_amount - mean) / std_dev
-                    
-                    # Create explanation
-                    category_name = current_tx.get("categoryName", "")
-                    
-                    if score > 5:
-                        reason = f"This expense of {currency_symbol}{current_amount:.2f} is extremely high compared to your typical {category_name} spending of around {currency_symbol}{mean:.2f}."
-                    elif score > 3:
-                        reason = f"This expense is significantly higher than your average {category_name} spending from this time period."
-                    else:
-                        reason = f"This {category_name} expense is higher than your typical spending pattern at the time."
-                    
-                    # Create a copy of the transaction with anomaly data
-                    anomaly_tx = current_tx.copy()
-                    anomaly_tx['anomalyScore'] = score
-                    anomaly_tx['reason'] = reason
-                    anomaly_tx['detectionMethod'] = 'sliding_window'
-                    
-                    anomalies.append(anomaly_tx)
-            except Exception as e:
-                logger.warning(f"Error processing transaction: {str(e)}")
-        
-        logger.info(f"Sliding window found {len(anomalies)} anomalies")
+            anomalies.append(anomaly_tx)
+        
+        logger.info("Sliding window found %s anomalies", len(anomalies))
         return sorted(anomalies, key=lambda x: x.get('anomalyScore', 0), reverse=True)
         
     except Exception as e:
-        logger.error(f"Error in sliding window detection: {str(e)}")
+        logger.error("Error in sliding window detection: %s", e)
         logger.error(traceback.format_exc())
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,72 @@
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+def category_key(tx: Dict[str, Any]) -> Any:
+    """Category a transaction is grouped under for statistics"""
+    return tx.get('category', tx.get('categoryName', 'Unknown'))
+
+class CategoryStats:
+    """Per-category amount statistics, built once per request with a vectorized groupby.
+    
+    Amounts are absolute values; rows whose amount can't be parsed are ignored.
+    Statistics are stored as arrays indexed by category code, so callers can map
+    whole columns of rows to their category's values with codes_for().
+    """
+
+    def __init__(self, keys: Sequence[Hashable], amounts: np.ndarray):
+        self.index: Dict[Hashable, int] = {}
+        self.codes = np.array([self.index.setdefault(key, len(self.index)) for key in keys], dtype=np.int64)
+        self.categories: List[Hashable] = list(self.index)
+        self._compute(amounts)
+
+    @classmethod
+    def from_codes(cls, codes: np.ndarray, categories: Sequence[Hashable], amounts: np.ndarray) -> "CategoryStats":
+        """Build from rows already coded by category, where categories[code] is the category key"""
+        stats = cls.__new__(cls)
+        stats.index = {key: code for code, key in enumerate(categories)}
+        stats.codes = np.asarray(codes, dtype=np.int64)
+        stats.categories = list(categories)
+        stats._compute(amounts)
+        return stats
+
+    def _compute(self, amounts: np.ndarray) -> None:
+        amounts = pd.Series(np.abs(np.asarray(amounts, dtype=np.float64)))
+        grouped = amounts.groupby(self.codes)
+        k = len(self.categories)
+        self.count = grouped.count().reindex(range(k), fill_value=0).to_numpy()
+        self.mean = grouped.mean().reindex(range(k)).to_numpy()
+        self.std = grouped.std(ddof=0).reindex(range(k)).to_numpy()
+        self.min = grouped.min().reindex(range(k)).to_numpy()
+        self.max = grouped.max().reindex(range(k)).to_numpy()
+        self.median = grouped.median().reindex(range(k)).to_numpy()
+        
+        # Across every category, for callers that treat the whole request as one group
+        self.overall_count = int(amounts.count())
+        self.overall_mean = float(amounts.mean()) if self.overall_count else 0.0
+        self.overall_std = float(amounts.std(ddof=0)) if self.overall_count else 0.0
+
+    @classmethod
+    def from_transactions(cls, transactions: List[Dict[str, Any]]) -> "CategoryStats":
+        keys = [category_key(tx) for tx in transactions]
+        amounts = pd.to_numeric(pd.Series([tx.get('amount', 0) for tx in transactions], dtype=object), errors='coerce')
+        return cls(keys, amounts.to_numpy(dtype=np.float64))
+
+    def codes_for(self, keys: Sequence[Hashable]) -> np.ndarray:
+        """Category codes for a column of category keys (KeyError if a category is unknown)"""
+        return np.array([self.index[key] for key in keys], dtype=np.int64)
+
+    def summary(self, key: Hashable) -> Optional[Dict[str, float]]:
+        """Statistics for one category, or None if it has no valid amounts"""
+        code = self.index.get(key)
+        if code is None or self.count[code] == 0:
+            return None
+        return {
+            'count': int(self.count[code]),
+            'mean': float(self.mean[code]),
+            'std': float(self.std[code]),
+            'min': float(self.min[code]),
+            'max': float(self.max[code]),
+            'median': float(self.median[code]),
+        }
@@ -0,0 +1,307 @@
+"""Columnar detection requests: parallel arrays instead of a list of transaction dicts.
+
+A body such as {"columns": {"id": [...], "amount": [...], "date": [...], "category": [...],
+"currency": [...]}} is decoded straight into the NumPy columns detection works on (see
+ingest.TransactionColumns), with no per-transaction dict or pydantic model on the way.
+Any other column of the same length (categoryName, description, ...) is kept as it was
+decoded and only read for the transactions that end up flagged.
+
+The same body can be sent as MessagePack, or the columns as an Arrow IPC stream or file,
+whose numeric buffers are used as NumPy arrays without a copy (see columns_from_arrow).
+"""
+import json
+from typing import Any, Dict, List
+
+import numpy as np
+
+from .anomaly_detection import parse_amounts, parse_dates
+from .ingest import TransactionColumns, currency_codes
+from .responses import ARROW_FILE, ARROW_STREAM, JSON, MSGPACK, available, media_type
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt, the json fallback is just slower
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - only needed for MessagePack bodies
+    msgpack = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover - only needed for Arrow bodies
+    pa = None
+
+# Category key for rows with no category
+UNKNOWN_CATEGORY = "Unknown"
+
+class ArrayTransactionColumns(TransactionColumns):
+    """TransactionColumns built from request arrays, with each row's fields kept in memory instead of a spool file"""
+
+    def __init__(self, amounts: np.ndarray, dates: np.ndarray, has_date: np.ndarray,
+                 category_codes: np.ndarray, categories: List[Any], currency_codes: np.ndarray,
+                 fields: Dict[str, List[Any]]):
+        super().__init__(amounts, dates, has_date, category_codes, categories, currency_codes,
+                         offsets=None, lengths=None, spool_path=None)
+        self.fields = fields
+
+    def record(self, row: int) -> Dict[str, Any]:
+        """The transaction dict for one row; null values are left out, as if the field was never sent"""
+        return {name: values[row] for name, values in self.fields.items() if values[row] is not None}
+
+    def slice(self, start: int, stop: int) -> "ArrayTransactionColumns":
+        """Rows start to stop as their own columns (categories, and so category codes, are shared)"""
+        return ArrayTransactionColumns(
+            self.amounts[start:stop], self.dates[start:stop], self.has_date[start:stop],
+            self.category_codes[start:stop], self.categories, self.currency_codes[start:stop],
+            {name: values[start:stop] for name, values in self.fields.items()}
+        )
+
+    def take(self, rows: np.ndarray) -> "ArrayTransactionColumns":
+        """The given rows, in the given order, as their own columns"""
+        indexes = rows.tolist()
+        return ArrayTransactionColumns(
+            self.amounts[rows], self.dates[rows], self.has_date[rows],
+            self.category_codes[rows], self.categories, self.currency_codes[rows],
+            {name: [values[i] for i in indexes] for name, values in self.fields.items()}
+        )
+
+    def release(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+def _amount_column(values: List[Any]) -> np.ndarray:
+    try:
+        # Numbers (and numeric strings) convert in one C pass; None becomes NaN
+        return np.abs(np.array(values, dtype=np.float64))
+    except (TypeError, ValueError):
+        return parse_amounts(values)
+
+def columns_from_arrays(columns: Dict[str, Any]) -> ArrayTransactionColumns:
+    """Build detection columns from parallel arrays keyed by transaction field. Raises ValueError for malformed input.
+
+    "amount" is required. "date", "category" (else "categoryName") and "currency" feed
+    the numeric columns when present, and every column is returned in the flagged records.
+    """
+    if not isinstance(columns, dict):
+        raise ValueError("Expected an object of columns")
+    if "amount" not in columns:
+        raise ValueError("An 'amount' column is required")
+    for name, values in columns.items():
+        if not isinstance(values, list):
+            raise ValueError(f"Column {name!r} must be an array")
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same length")
+    n = lengths.pop()
+
+    if "date" in columns:
+        dates, has_date = parse_dates(columns["date"])
+    else:
+        dates, has_date = np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]"), np.zeros(n, dtype=bool)
+
+    # Grouped by category_stats.category_key of each row's record, where nulls are left out:
+    # the category, else the categoryName, else UNKNOWN_CATEGORY
+    categories = columns.get("category", [None] * n)
+    category_names = columns.get("categoryName", [None] * n)
+    category_index: Dict[Any, int] = {}
+    try:
+        category_codes = np.array([
+            category_index.setdefault(
+                key if key is not None else name if name is not None else UNKNOWN_CATEGORY, len(category_index))
+            for key, name in zip(categories, category_names)
+        ], dtype=np.int32)
+    except TypeError as e:
+        raise ValueError(f"Invalid category value: {e}") from e
+
+    currencies = columns.get("currency")
+    return ArrayTransactionColumns(
+        amounts=_amount_column(columns["amount"]),
+        dates=dates,
+        has_date=has_date,
+        category_codes=category_codes,
+        categories=list(category_index),
+        currency_codes=currency_codes(currencies) if currencies is not None else np.zeros(n, dtype=np.int8),
+        fields=dict(columns)
+    )
+
+def to_columns(transactions: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """The columnar form of a list of transaction dicts: one array per field, null where a transaction lacks it"""
+    names = list(dict.fromkeys(name for tx in transactions for name in tx))
+    return {name: [tx.get(name) for tx in transactions] for name in names}
+
+class UnsupportedMediaTypeError(ValueError):
+    """Raised for a request body in a format this service can't read"""
+
+def decode_columns(body: bytes, content_type: str = JSON) -> ArrayTransactionColumns:
+    """Parse a columnar request body into columns, by Content-Type. Raises ValueError for malformed input.
+    
+    JSON (the default, also for a missing or +json type) and MessagePack bodies are
+    {"columns": {...}}; Arrow bodies are a table with one column per field.
+    """
+    kind = media_type(content_type)
+    if kind and not available(kind):
+        raise UnsupportedMediaTypeError(f"{kind} bodies need a library that isn't installed")
+    if kind in (ARROW_STREAM, ARROW_FILE):
+        return columns_from_arrow(read_arrow(body, kind))
+    if kind == MSGPACK:
+        try:
+            payload = msgpack.unpackb(body)
+        except Exception as e:
+            raise ValueError(f"Invalid MessagePack body: {e}") from e
+    elif kind in ("", JSON) or kind.endswith("+json"):
+        try:
+            payload = orjson.loads(body) if orjson is not None else json.loads(body)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON body: {e}") from e
+    else:
+        raise UnsupportedMediaTypeError(f"Unsupported Content-Type {kind!r}")
+    if not isinstance(payload, dict) or "columns" not in payload:
+        raise ValueError('Expected an object with a "columns" field')
+    return columns_from_arrays(payload["columns"])
+
+def read_arrow(body: bytes, kind: str = ARROW_STREAM) -> "pa.Table":
+    """The table in an Arrow IPC stream (or file) body, backed by the body's own memory"""
+    try:
+        buffer = pa.py_buffer(body)
+        reader = pa.ipc.open_file(buffer) if kind == ARROW_FILE else pa.ipc.open_stream(buffer)
+        return reader.read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise ValueError(f"Invalid Arrow body: {e}") from e
+
+class ArrowTransactionColumns(ArrayTransactionColumns):
+    """ArrayTransactionColumns whose fields are Arrow arrays; a row's values become Python objects only in record()"""
+
+    def record(self, row: int) -> Dict[str, Any]:
+        row = int(row)
+        record = {}
+        for name, values in self.fields.items():
+            value = values[row].as_py()
+            if value is not None:
+                record[name] = value
+        return record
+
+    def slice(self, start: int, stop: int) -> "ArrowTransactionColumns":
+        # Arrow slices pickle their whole parent buffers, so copy the rows out instead
+        return self.take(np.arange(start, stop))
+
+    def take(self, rows: np.ndarray) -> "ArrowTransactionColumns":
+        indices = pa.array(rows, type=pa.int64())
+        return ArrowTransactionColumns(
+            self.amounts[rows], self.dates[rows], self.has_date[rows],
+            self.category_codes[rows], self.categories, self.currency_codes[rows],
+            {name: values.take(indices) for name, values in self.fields.items()}
+        )
+
+def _arrow_amounts(column: "pa.Array") -> np.ndarray:
+    if pa.types.is_floating(column.type) or pa.types.is_integer(column.type) or pa.types.is_decimal(column.type):
+        column = column.cast(pa.float64())
+        # A float64 column without nulls is read in place; nulls become NaN
+        amounts = column.to_numpy(zero_copy_only=False) if column.null_count else column.to_numpy()
+        return np.abs(amounts)
+    return parse_amounts(column.to_pylist())
+
+def _arrow_dates(column: "pa.Array"):
+    if pa.types.is_timestamp(column.type) or pa.types.is_date(column.type):
+        dates = column.cast(pa.timestamp("ns")).to_numpy(zero_copy_only=False)
+        return dates, column.is_valid().to_numpy(zero_copy_only=False)
+    
+    # Strings: parse the YYYY-MM-DD prefix in Arrow, and only the rows it misses in Python
+    text = column.cast(pa.string())
+    has_date = pc.fill_null(pc.greater(pc.utf8_length(text), 0), False).to_numpy(zero_copy_only=False)
+    dates = pc.strptime(pc.utf8_slice_codeunits(text, 0, 10), format="%Y-%m-%d", unit="ns",
+                        error_is_null=True).to_numpy(zero_copy_only=False)
+    missed = np.flatnonzero(has_date & np.isnat(dates))
+    if len(missed):
+        dates[missed] = parse_dates(text.take(pa.array(missed)).to_pylist())[0]
+    return dates, has_date
+
+def _decoded(column: "pa.Array") -> "pa.Array":
+    return column.dictionary_decode() if pa.types.is_dictionary(column.type) else column
+
+def _arrow_codes(column: "pa.Array", null_key: Any = None):
+    """Codes and their keys for a column, via Arrow's dictionary encoding; nulls get null_key's code"""
+    if not pa.types.is_dictionary(column.type):
+        column = pc.dictionary_encode(column)
+    keys = column.dictionary.to_pylist()
+    if len(set(keys)) != len(keys):
+        column = pc.dictionary_encode(column.dictionary_decode())
+        keys = column.dictionary.to_pylist()
+    codes = column.indices.cast(pa.int32())
+    if column.null_count:
+        if null_key not in keys:
+            keys.append(null_key)
+        codes = pc.fill_null(codes, keys.index(null_key))
+    return codes.to_numpy(zero_copy_only=False), keys
+
+def columns_from_arrow(table: "pa.Table") -> ArrowTransactionColumns:
+    """columns_from_arrays for an Arrow table. Raises ValueError for malformed input.
+    
+    Numeric amounts, timestamp or date dates and dictionary-encoded categories map
+    straight onto NumPy; string dates are parsed by Arrow. The table's columns, as Arrow
+    arrays, are the fields returned for flagged rows.
+    """
+    fields = {name: table.column(name).combine_chunks() for name in table.column_names}
+    if "amount" not in fields:
+        raise ValueError("An 'amount' column is required")
+    n = table.num_rows
+    try:
+        if "date" in fields:
+            dates, has_date = _arrow_dates(fields["date"])
+        else:
+            dates, has_date = np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]"), np.zeros(n, dtype=bool)
+        
+        # Same fallback as columns_from_arrays: the category, else the categoryName, else UNKNOWN_CATEGORY
+        keys = fields.get("category")
+        names = fields.get("categoryName")
+        if keys is None:
+            keys = names
+        elif names is not None and keys.null_count:
+            keys = _decoded(keys)
+            keys = pc.coalesce(keys, _decoded(names).cast(keys.type))
+        if keys is None:
+            category_codes, categories = np.zeros(n, dtype=np.int32), [UNKNOWN_CATEGORY] if n else []
+        else:
+            category_codes, categories = _arrow_codes(keys, null_key=UNKNOWN_CATEGORY)
+        
+        if "currency" in fields:
+            codes, currencies = _arrow_codes(fields["currency"].cast(pa.string()))
+            currency_column = currency_codes(currencies)[codes]
+        else:
+            currency_column = np.zeros(n, dtype=np.int8)
+        
+        amounts = _arrow_amounts(fields["amount"])
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        raise ValueError(f"Invalid Arrow column: {e}") from e
+    
+    return ArrowTransactionColumns(
+        amounts=amounts,
+        dates=dates,
+        has_date=has_date,
+        category_codes=category_codes.astype(np.int32, copy=False),
+        categories=categories,
+        currency_codes=currency_column,
+        fields=fields
+    )
+
+def split_by_category(data: ArrayTransactionColumns) -> Dict[Any, ArrayTransactionColumns]:
+    """Group rows by category, keeping input order within each category"""
+    # Reorder every column once, then each category is a contiguous slice
+    order = np.argsort(data.category_codes, kind="stable")
+    grouped = data.take(order)
+    counts = np.bincount(grouped.category_codes, minlength=len(data.categories))
+    by_category = {}
+    start = 0
+    for code, count in enumerate(counts.tolist()):
+        if count:
+            key = data.categories[code]
+            part = grouped.slice(start, start + count)
+            part.category_codes = np.zeros(count, dtype=np.int32)
+            part.categories = [key]
+            by_category[key] = part
+        start += count
+    return by_category
@@ -0,0 +1,55 @@
+"""Service configuration, read from environment variables with development defaults."""
+import os
+
+def _int_env(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+def _float_env(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+# Fitted Isolation Forest cache (see model_cache.py)
+MODEL_CACHE_MAX_SIZE = _int_env("MODEL_CACHE_MAX_SIZE", 256)       # Max fitted models kept in memory
+MODEL_CACHE_TTL_SECONDS = _float_env("MODEL_CACHE_TTL_SECONDS", 600)  # Refit after this many seconds
+
+# Detection result cache (see result_cache.py)
+RESULT_CACHE_MAX_MB = _float_env("RESULT_CACHE_MAX_MB", 64)  # Memory for cached results, measured as encoded JSON (0 disables)
+RESULT_CACHE_MAX_ENTRIES = _int_env("RESULT_CACHE_MAX_ENTRIES", 1024)  # Most results kept
+RESULT_CACHE_TTL_SECONDS = _float_env("RESULT_CACHE_TTL_SECONDS", 300)  # Recompute after this many seconds
+
+# Detection worker pool (see workers.py)
+DETECTION_EXECUTOR = os.environ.get("DETECTION_EXECUTOR", "process")  # "process" or "thread"
+DETECTION_WORKERS = _int_env("DETECTION_WORKERS", os.cpu_count() or 1)  # Concurrent detection jobs
+DETECTION_MAX_PENDING = _int_env("DETECTION_MAX_PENDING", 64)  # Queued + running jobs before returning 503
+
+# Streaming detector (see streaming.py)
+STREAM_WINDOW_SIZE = _int_env("STREAM_WINDOW_SIZE", 10)  # Recent transactions each verdict is scored against
+STREAM_MIN_WINDOW = _int_env("STREAM_MIN_WINDOW", 5)     # Transactions needed before anything is flagged
+STREAM_SNAPSHOT_PATH = os.environ.get("STREAM_SNAPSHOT_PATH", "data/streaming_state.json")
+STREAM_SNAPSHOT_EVERY = _int_env("STREAM_SNAPSHOT_EVERY", 100)  # Snapshot after this many updates (0 = only on shutdown)
+STREAM_SNAPSHOT_INTERVAL_SECONDS = _float_env("STREAM_SNAPSHOT_INTERVAL_SECONDS", 10)  # How often the snapshot task checks for updates
+STREAM_MAX_STATES = _int_env("STREAM_MAX_STATES", 100000)  # Per-user category states kept, least recently updated dropped first
+
+# Multi-user batch detection (POST /detect-user-anomalies/batch)
+BATCH_MAX_USERS = _int_env("BATCH_MAX_USERS", 1000)  # Largest number of users accepted in one request
+BATCH_CONCURRENT_USERS = _int_env("BATCH_CONCURRENT_USERS", 4)  # Users of a batch detected at the same time
+
+# Stored transaction histories for the /history endpoints (see history.py)
+# They live in this process: run one uvicorn worker, or route each user to the same worker every time
+HISTORY_MAX_TRANSACTIONS = _int_env("HISTORY_MAX_TRANSACTIONS", 5000)  # Newest transactions kept per user and category
+HISTORY_MAX_AGE_DAYS = _float_env("HISTORY_MAX_AGE_DAYS", 730)  # Transactions older than this are dropped
+HISTORY_MAX_USERS = _int_env("HISTORY_MAX_USERS", 10000)  # Users whose history is kept, least recently used dropped first
+
+# User preference storage (see storage.py) and cache (see preferences.py)
+PREFERENCE_BACKEND = os.environ.get("PREFERENCE_BACKEND", "json")  # "json" (per-user files, for dev) or "sqlite"
+PREFERENCE_DB_PATH = os.environ.get("PREFERENCE_DB_PATH", "data/preferences.db")
+PREFERENCE_CACHE_SIZE = _int_env("PREFERENCE_CACHE_SIZE", 10000)  # Users whose ranges/alerts are kept in memory
+
+# Feedback writes (see feedback.py)
+FEEDBACK_COALESCE_MS = _float_env("FEEDBACK_COALESCE_MS", 50)  # Wait this long to merge a user's feedback into one write
+FEEDBACK_BATCH_MAX_ITEMS = _int_env("FEEDBACK_BATCH_MAX_ITEMS", 500)  # Largest list accepted by /feedback/batch
+
+# Logging (see logging_setup.py)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")  # Root log level
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")    # Per-logger overrides, e.g. "anomaly-detection=DEBUG,ml-service=WARNING"
+LOG_SAMPLE_EVERY = _int_env("LOG_SAMPLE_EVERY", 100)  # Keep 1 in N per-transaction debug lines
+LOG_BUFFER_SIZE = _int_env("LOG_BUFFER_SIZE", 1000)  # Recent service log records kept for GET /logs
@@ -0,0 +1,397 @@
+import asyncio
+import logging
+import traceback
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .anomaly_detection import (
+    detect_anomalies_isolation_forest,
+    detect_anomalies_isolation_forest_columns,
+    detect_anomalies_sliding_window,
+    parse_amounts,
+)
+from .category_stats import CategoryStats
+from .ingest import TransactionColumns
+from .logging_setup import SAMPLED
+from .metrics import SLIDING_WINDOW_FALLBACKS
+from .workers import DetectionPool, PoolSaturatedError
+
+# Detection runs inside the worker pool, but logs under the service logger
+logger = logging.getLogger("ml-service")
+
+# Severity ordering used when sorting anomalies for display
+SEVERITY_ORDER = {'High': 0, 'Medium': 1, 'Low': 2}
+
+def sort_anomalies(anomalies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sort anomalies in place by severity first, then anomaly score"""
+    anomalies.sort(key=lambda x: (
+        SEVERITY_ORDER.get(x.get('severity', 'Low'), 3),
+        -float(x.get('anomalyScore', 0))
+    ))
+    return anomalies
+
+class DetectionInput(NamedTuple):
+    """A category's transactions as the shared detection steps see them, list or columns alike"""
+    amounts: np.ndarray  # Absolute amounts, NaN where unparseable
+    record: Callable[[int], Dict[str, Any]]  # One transaction dict, by row
+    records: Callable[[], List[Dict[str, Any]]]  # Every transaction dict, for the sliding window
+    category_stats: Callable[[], CategoryStats]
+    isolation_forest: Callable[..., List[Dict[str, Any]]]  # detect_anomalies_isolation_forest(_columns), bound to the data
+
+def list_input(transactions: List[Dict[str, Any]]) -> DetectionInput:
+    return DetectionInput(
+        amounts=parse_amounts([tx.get('amount', 0) for tx in transactions]),
+        record=transactions.__getitem__,
+        records=lambda: transactions,
+        category_stats=lambda: CategoryStats.from_transactions(transactions),
+        isolation_forest=partial(detect_anomalies_isolation_forest, transactions),
+    )
+
+def columns_input(data: TransactionColumns) -> DetectionInput:
+    return DetectionInput(
+        amounts=data.amounts,
+        record=data.record,
+        records=data.records,
+        category_stats=lambda: CategoryStats.from_codes(data.category_codes, data.categories, data.amounts),
+        isolation_forest=partial(detect_anomalies_isolation_forest_columns, data),
+    )
+
+def format_thresholds(category_id: str, category_alerts: Dict[str, float]) -> Dict[str, float]:
+    """The category's alert threshold in the form detect_anomalies_isolation_forest expects ({category}_threshold)"""
+    if category_id not in category_alerts:
+        return {}
+    return {f"{category_id}_threshold": category_alerts[category_id]}
+
+def direct_anomaly(tx: Dict[str, Any], amount: float, avg_amount: float, alert_threshold: Optional[float]) -> Dict[str, Any]:
+    """Anomaly from the direct check, used when the model finds nothing: over the alert threshold if there is one, else well above average"""
+    if alert_threshold is not None:
+        reason = f"This expense exceeds your ${alert_threshold:.2f} alert threshold for {tx.get('categoryName', 'this category')}."
+    else:
+        reason = f"This {tx.get('categoryName', 'expense')} is {amount / avg_amount:.1f}x higher than your typical spending pattern."
+    anomaly = tx.copy()
+    anomaly["anomalyScore"] = min(0.95, 0.6 + (0.1 * (amount / avg_amount - 1)))
+    anomaly["reason"] = reason
+    anomaly["severity"] = "High" if amount > avg_amount * 3 else "Medium"
+    return anomaly
+
+def detect_category(category_id: str, source: DetectionInput, user_id: str,
+                    user_accepted_ranges: Dict[str, bool],
+                    category_alerts: Dict[str, float]) -> Dict[str, Any]:
+    """Decisions behind /detect-category-anomalies, shared by its list and columns forms.
+    
+    Isolation Forest first; if it finds nothing, the direct check (amounts over the
+    alert threshold, or well above the request's average); if it fails, the sliding
+    window. Rows with an unparseable amount are never flagged by the direct check.
+    """
+    formatted_thresholds = format_thresholds(category_id, category_alerts)
+    if formatted_thresholds:
+        logger.info("Using threshold for %s: $%s", category_id, category_alerts[category_id])
+    
+    if len(source.amounts) < 5:
+        logger.info("Not enough transactions for category %s (%s/5)", category_id, len(source.amounts))
+        return {
+            "anomalies": [],
+            "count": 0,
+            "categoryId": category_id,
+            "message": "Not enough transaction data for anomaly detection"
+        }
+    
+    # Category statistics shared by the direct check, the model and its reasons
+    category_stats = source.category_stats()
+    
+    # Direct detection over the whole request, turned into anomalies only if the model finds nothing
+    avg_amount = category_stats.overall_mean
+    std_dev = category_stats.overall_std if category_stats.overall_count > 1 else avg_amount * 0.2  # Estimate std dev if only one transaction
+    logger.info("Average amount: $%.2f, StdDev: $%.2f", avg_amount, std_dev)
+    alert_threshold = category_alerts.get(category_id)
+    # Over the alert threshold if there is one, else over 1.8x average or avg + 1.5*std_dev, whichever is higher
+    direct_threshold = alert_threshold if alert_threshold is not None else max(avg_amount * 1.8, avg_amount + 1.5 * std_dev)
+    with np.errstate(invalid='ignore'):
+        direct_mask = source.amounts > direct_threshold
+    
+    # Try isolation forest first with user preferences
+    try:
+        logger.info("Attempting isolation forest detection with user preferences")
+        anomalies = source.isolation_forest(
+            user_id=user_id,
+            user_accepted_ranges=user_accepted_ranges,
+            user_alert_thresholds=formatted_thresholds,
+            category_id=category_id,
+            category_stats=category_stats
+        )
+        method = "isolation_forest"
+        logger.info("Isolation forest found %s anomalies", len(anomalies))
+        
+        # Log any anomalies found
+        if anomalies:
+            for i, anomaly in enumerate(anomalies):
+                logger.debug("Anomaly #%s: amount=%s, score=%s", i+1, anomaly.get('amount'), anomaly.get('anomalyScore'), extra=SAMPLED)
+        else:
+            logger.warning("No anomalies found by Isolation Forest despite having sufficient data")
+        
+        # If isolation forest found nothing but direct detection did, use direct detection results
+        if not anomalies and direct_mask.any():
+            anomalies = []
+            for i in np.flatnonzero(direct_mask):
+                amount = float(source.amounts[i])
+                logger.debug("DIRECT DETECTION: Anomaly found: $%.2f (threshold: $%.2f, avg: $%.2f)", amount, direct_threshold, avg_amount, extra=SAMPLED)
+                anomalies.append(direct_anomaly(source.record(i), amount, avg_amount, alert_threshold))
+            logger.info("Using %s directly detected anomalies as fallback", len(anomalies))
+            method = "direct_detection"
+    except Exception as e:
+        logger.error("Isolation forest failed: %s", e)
+        logger.error(traceback.format_exc())
+        # Fall back to sliding window
+        logger.info("Falling back to sliding window detection")
+        SLIDING_WINDOW_FALLBACKS.inc()
+        anomalies = detect_anomalies_sliding_window(source.records())
+        method = "sliding_window"
+        logger.info("Sliding window found %s anomalies", len(anomalies))
+    
+    return {
+        "anomalies": anomalies,
+        "count": len(anomalies),
+        "categoryId": category_id,
+        "method": method
+    }
+
+def run_category_detection(category_id: str, transactions: List[Dict[str, Any]], user_id: str,
+                           user_accepted_ranges: Dict[str, bool],
+                           category_alerts: Dict[str, float]) -> Dict[str, Any]:
+    """Detection pipeline behind /detect-category-anomalies.
+    
+    Plain synchronous function so it can be shipped to the detection worker pool.
+    """
+    # Enhanced debugging: Log all transactions (sampled, and skipped entirely unless DEBUG is on)
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, tx in enumerate(transactions):
+            logger.debug("Input Transaction #%s: amount=%s, desc=%s", i, tx.get('amount'), tx.get('description', 'N/A'), extra=SAMPLED)
+    return detect_category(category_id, list_input(transactions), user_id, user_accepted_ranges, category_alerts)
+
+def run_category_detection_columns(category_id: str, data: TransactionColumns, user_id: str,
+                                   user_accepted_ranges: Dict[str, bool],
+                                   category_alerts: Dict[str, float]) -> Dict[str, Any]:
+    """run_category_detection for a history ingested into columns (see ingest.py).
+    
+    Transaction dicts are read back only for anomalies, or for everything if detection
+    has to fall back to the sliding window.
+    """
+    try:
+        return detect_category(category_id, columns_input(data), user_id, user_accepted_ranges, category_alerts)
+    finally:
+        data.release()
+
+def threshold_alert(tx: Dict[str, Any], amount: float, threshold: float) -> Dict[str, Any]:
+    """Alert anomaly for a transaction over the user's alert threshold that detection didn't flag"""
+    alert_anomaly = tx.copy()
+    alert_anomaly['anomalyScore'] = 0.7  # Medium-high score
+    alert_anomaly['reason'] = f"This expense exceeds your ${threshold} alert threshold for this category."
+    
+    # Determine severity based on price
+    if amount >= 200:
+        alert_anomaly['severity'] = 'High'
+    elif amount >= 100:
+        alert_anomaly['severity'] = 'Medium'
+    else:
+        alert_anomaly['severity'] = 'Low'
+        
+    alert_anomaly['detection_method'] = "threshold_alert"  # Mark as alert-based anomaly
+    logger.debug("Added explicit alert for transaction %s: $%.2f > $%.2f", tx.get('id', ''), amount, threshold, extra=SAMPLED)
+    return alert_anomaly
+
+def detect_user_category(category_id: str, source: DetectionInput, user_id: str,
+                         user_accepted_ranges: Dict[str, bool],
+                         category_alerts: Dict[str, float]) -> Dict[str, Any]:
+    """Decisions behind one category of /detect-user-anomalies, shared by its list and columns forms.
+    
+    Returns the category's entry for category_results. Errors are reported in the
+    entry instead of raised, so one bad category doesn't fail the whole user.
+    """
+    try:
+        logger.info("Processing category %s with %s transactions", category_id, len(source.amounts))
+        
+        if len(source.amounts) < 5:
+            logger.info("Not enough transactions for category %s", category_id)
+            return {
+                "anomalies": [],
+                "count": 0,
+                "method": "skipped",
+                "message": "Not enough data"
+            }
+        
+        # Try isolation forest with user feedback incorporated
+        try:
+            formatted_thresholds = format_thresholds(category_id, category_alerts)
+            if formatted_thresholds:
+                logger.info("Using user-defined alert threshold for %s: $%s", category_id, category_alerts[category_id])
+            else:
+                logger.info("No user-defined alert threshold for category %s", category_id)
+            
+            anomalies = source.isolation_forest(
+                user_id=user_id,
+                user_accepted_ranges=user_accepted_ranges,
+                user_alert_thresholds=formatted_thresholds,
+                category_id=category_id
+            )
+            method = "isolation_forest"
+            logger.info("Isolation Forest found %s anomalies for category %s", len(anomalies), category_id)
+        except Exception as e:
+            logger.error("Isolation forest failed for category %s: %s", category_id, e)
+            logger.error(traceback.format_exc())
+            # Fall back to sliding window
+            SLIDING_WINDOW_FALLBACKS.inc()
+            anomalies = detect_anomalies_sliding_window(source.records())
+            method = "sliding_window"
+            logger.info("Sliding window found %s anomalies", len(anomalies))
+        
+        # Transactions over the alert threshold that detection didn't already report as such
+        if category_id in category_alerts:
+            threshold = category_alerts[category_id]
+            found_threshold_anomalies = {
+                anomaly.get('id', '') for anomaly in anomalies if 'exceeds your' in anomaly.get('reason', '')
+            }
+            with np.errstate(invalid='ignore'):
+                over_threshold = np.flatnonzero(source.amounts > threshold)
+            for i in over_threshold:
+                tx = source.record(i)
+                if tx.get('id', '') not in found_threshold_anomalies:
+                    anomalies.append(threshold_alert(tx, float(source.amounts[i]), threshold))
+        
+        logger.info("Found %s anomalies in category %s using %s", len(anomalies), category_id, method)
+        
+        return {
+            "anomalies": anomalies,
+            "count": len(anomalies),
+            "method": method
+        }
+    except Exception as e:
+        logger.error("Error processing category %s: %s", category_id, e)
+        logger.error(traceback.format_exc())
+        return {
+            "error": str(e),
+            "count": 0,
+            "method": "error"
+        }
+
+def run_user_category_detection(category_id: str, transactions: List[Dict[str, Any]], user_id: str,
+                                user_accepted_ranges: Dict[str, bool],
+                                category_alerts: Dict[str, float]) -> Dict[str, Any]:
+    """Detect anomalies in one category of a /detect-user-anomalies request (see detect_user_category)"""
+    return detect_user_category(category_id, list_input(transactions), user_id, user_accepted_ranges, category_alerts)
+
+def run_user_category_detection_columns(category_id: str, data: TransactionColumns, user_id: str,
+                                        user_accepted_ranges: Dict[str, bool],
+                                        category_alerts: Dict[str, float]) -> Dict[str, Any]:
+    """run_user_category_detection for one category of a columnar request (see columnar.py).
+    
+    Transaction dicts are only built for anomalies and alerts, or for every row if
+    detection has to fall back to the sliding window.
+    """
+    try:
+        return detect_user_category(category_id, columns_input(data), user_id, user_accepted_ranges, category_alerts)
+    finally:
+        data.release()
+
+async def run_user_detection(pool: DetectionPool,
+                             transactions_by_category: Dict[str, Any], user_id: str,
+                             user_accepted_ranges: Dict[str, bool],
+                             category_alerts: Dict[str, float],
+                             detect: Callable[..., Dict[str, Any]] = run_user_category_detection
+                             ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Detection pipeline behind /detect-user-anomalies.
+    
+    Categories are fitted concurrently on the pool, at most max_workers at a time per
+    request. A category whose job fails gets an error entry; the others are unaffected.
+    Returns all anomalies sorted for display, plus the per-category results.
+    Each category's transactions are a list of dicts, or TransactionColumns when
+    detect is run_user_category_detection_columns.
+    """
+    # Admit the request up front so a busy pool rejects it whole rather than category by category
+    pool.check_capacity(min(len(transactions_by_category), pool.max_workers))
+    slots = asyncio.Semaphore(pool.max_workers)
+    
+    async def detect_category(category_id: str, transactions: Any) -> Dict[str, Any]:
+        # Categories too small to fit a model return immediately, no need for a worker
+        if len(transactions) < 5:
+            return detect(
+                category_id, transactions, user_id, user_accepted_ranges, category_alerts
+            )
+        async with slots:
+            return await pool.run(
+                detect,
+                category_id, transactions, user_id, user_accepted_ranges, category_alerts
+            )
+    
+    category_ids = list(transactions_by_category)
+    results = await asyncio.gather(
+        *(detect_category(category_id, transactions_by_category[category_id]) for category_id in category_ids),
+        return_exceptions=True
+    )
+    
+    # Merge in request order so the output doesn't depend on which worker finished first
+    all_anomalies = []
+    category_results = {}
+    for category_id, result in zip(category_ids, results):
+        if isinstance(result, BaseException):
+            logger.error("Detection job failed for category %s: %s", category_id, result)
+            result = {
+                "error": str(result),
+                "count": 0,
+                "method": "error"
+            }
+        all_anomalies.extend(result.get("anomalies", []))
+        category_results[category_id] = result
+    
+    return sort_anomalies(all_anomalies), category_results
+
+async def run_batch_user_detection(pool: DetectionPool,
+                                   users: List[Tuple[str, Dict[str, List[Dict[str, Any]]]]],
+                                   load_preferences: Callable[[str], Awaitable[Any]],
+                                   max_concurrent_users: int = 4) -> AsyncIterator[Dict[str, Any]]:
+    """Detection pipeline behind /detect-user-anomalies/batch.
+    
+    Runs run_user_detection for up to max_concurrent_users users at a time and yields
+    each user's result as soon as it is ready, so results arrive in completion order.
+    load_preferences(user_id) returns the user's preferences (see preferences.py).
+    A user whose detection fails gets an entry with "error" and an HTTP-style "status"
+    (503 when the pool was full, so the caller can retry just that user); the rest of
+    the batch carries on.
+    """
+    slots = asyncio.Semaphore(max(1, max_concurrent_users))
+    
+    async def detect_user(user_id: str, transactions_by_category: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+        async with slots:
+            try:
+                preferences = await load_preferences(user_id)
+                anomalies, category_results = await run_user_detection(
+                    pool,
+                    transactions_by_category,
+                    user_id,
+                    preferences.accepted_ranges,
+                    preferences.alert_thresholds
+                )
+                return {
+                    "user_id": user_id,
+                    "anomalies": anomalies,
+                    "count": len(anomalies),
+                    "category_results": category_results
+                }
+            except PoolSaturatedError as e:
+                logger.warning("Batch detection for user %s rejected: %s", user_id, e)
+                return {"user_id": user_id, "error": str(e), "status": 503}
+            except Exception as e:
+                logger.error("Batch detection failed for user %s: %s", user_id, e)
+                logger.error(traceback.format_exc())
+                return {"user_id": user_id, "error": str(e), "status": 500}
+    
+    tasks = [asyncio.ensure_future(detect_user(user_id, transactions_by_category))
+             for user_id, transactions_by_category in users]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        # The client went away mid-stream: don't keep fitting models nobody will read
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from .anomaly_detection import SPENDING_RANGES, USD_RANGE_BOUNDS
+from .models import AnomalyFeedback
+from .preferences import PreferenceCache, preference_cache
+from .result_cache import ResultCache, result_cache
+from .storage import PreferenceStore, preference_store
+
+logger = logging.getLogger("ml-service")
+
+def accepted_range_keys(category: str, amount: float) -> List[str]:
+    """Range keys to accept when a transaction is marked normal: its own range and every lower one.
+
+    This means if a user marks a $200 transaction as normal, we'll also accept $180, etc.
+    Ranges always use the USD bounds here, even for amounts detection treats as yen.
+    """
+    range_index = int(np.searchsorted(USD_RANGE_BOUNDS, amount, side='right'))
+    return [f"{category}_{name}" for name in SPENDING_RANGES[:range_index + 1]]
+
+class FeedbackWriter:
+    """Applies user feedback to the preference store without losing concurrent updates.
+
+    Feedback for a user is queued and flushed after a short coalescing window, so a
+    burst of clicks becomes one read-modify-write of that user's preferences. Flushes
+    for the same user are serialized by a per-user asyncio lock, and run in a thread
+    so store I/O stays off the event loop. Once a batch is written, the user's cached
+    detection results for the categories it touched are dropped.
+    """
+
+    def __init__(self, store: PreferenceStore, cache: Optional[PreferenceCache] = None,
+                 coalesce_seconds: float = 0.05, result_cache: Optional[ResultCache] = None):
+        self.store = store
+        self.cache = cache
+        self.result_cache = result_cache
+        self.coalesce_seconds = coalesce_seconds
+        self._pending: Dict[str, List[Tuple[AnomalyFeedback, asyncio.Future]]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tasks: set = set()
+        self.flushes = 0
+
+    async def submit(self, user_id: str, feedback: AnomalyFeedback) -> Tuple[bool, bool]:
+        """Queue feedback and wait until it is written. Returns (updated_model, alert_set)."""
+        return (await self.submit_many(user_id, [feedback]))[0]
+
+    async def submit_many(self, user_id: str, items: List[AnomalyFeedback]) -> List[Tuple[bool, bool]]:
+        """Queue several feedback items for one user so they are written together. Results follow item order."""
+        loop = asyncio.get_running_loop()
+        queued = [(feedback, loop.create_future()) for feedback in items]
+        if not queued:
+            return []
+        batch = self._pending.get(user_id)
+        if batch is None:
+            self._pending[user_id] = queued
+            task = asyncio.create_task(self._flush_later(user_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            batch.extend(queued)
+        return list(await asyncio.gather(*(future for _, future in queued)))
+
+    async def _flush_later(self, user_id: str) -> None:
+        await asyncio.sleep(self.coalesce_seconds)
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            # Anything arriving from here on starts a new batch
+            batch = self._pending.pop(user_id)
+            try:
+                results = await asyncio.to_thread(self._apply, user_id, [feedback for feedback, _ in batch])
+            except Exception as e:
+                logger.error("Error saving feedback batch for user %s: %s", user_id, e)
+                results = [(False, False)] * len(batch)
+            finally:
+                if self.cache is not None:
+                    self.cache.invalidate(user_id)
+                if self.result_cache is not None:
+                    self.result_cache.invalidate(user_id, {feedback.category for feedback, _ in batch})
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            if user_id not in self._pending:
+                self._locks.pop(user_id, None)
+
+    def _apply(self, user_id: str, batch: List[AnomalyFeedback]) -> List[Tuple[bool, bool]]:
+        """Fold a batch of feedback into one ranges write and one alerts write"""
+        self.flushes += 1
+        range_keys: Dict[str, None] = {}
+        for feedback in batch:
+            if feedback.is_normal:
+                for range_key in accepted_range_keys(feedback.category, feedback.anomaly_amount):
+                    range_keys[range_key] = None
+                    logger.info("Marking range %s as normal based on user feedback", range_key)
+
+        ranges_saved = True
+        if range_keys:
+            try:
+                self.store.accept_ranges(user_id, list(range_keys))
+                logger.info("Updated accepted ranges for user %s: %s ranges from %s feedback items", user_id, len(range_keys), len(batch))
+            except Exception as e:
+                logger.error("Error saving user feedback: %s", e)
+                ranges_saved = False
+
+        alerts_saved = True
+        needs_alerts = any(feedback.is_normal or (feedback.set_alert and feedback.alert_threshold) for feedback in batch)
+        if needs_alerts:
+            try:
+                alerts_by_category: Dict[Any, Dict[str, Any]] = {
+                    alert.get('category'): alert for alert in self.store.load_alerts(user_id)
+                }
+                changed: Dict[Any, Dict[str, Any]] = {}
+                for feedback in batch:
+                    alert = alerts_by_category.get(feedback.category)
+                    # If user marks a transaction as normal, and that transaction would exceed their current threshold,
+                    # we should increase the threshold to avoid future false positives
+                    if feedback.is_normal and alert is not None:
+                        current_threshold = alert.get('threshold', 0)
+                        if feedback.anomaly_amount > current_threshold:
+                            # Round up to nearest $5 for a better user experience
+                            new_threshold = math.ceil(feedback.anomaly_amount / 5) * 5
+                            alert['threshold'] = new_threshold
+                            changed[feedback.category] = alert
+                            logger.info("Automatically increased threshold for %s from $%s to $%s based on user feedback", feedback.category, current_threshold, new_threshold)
+                    if feedback.set_alert and feedback.alert_threshold:
+                        alert = alerts_by_category.setdefault(feedback.category, {"category": feedback.category})
+                        alert['threshold'] = feedback.alert_threshold
+                        alert['active'] = True
+                        changed[feedback.category] = alert
+                        logger.info("Set spending alert for user %s, category %s: $%s", user_id, feedback.category, feedback.alert_threshold)
+                        logger.info("Transactions below $%s in %s will NOT be flagged as anomalies", feedback.alert_threshold, feedback.category)
+                if changed:
+                    self.store.upsert_alerts(user_id, list(changed.values()))
+            except Exception as e:
+                logger.error("Error saving spending alerts: %s", e)
+                alerts_saved = False
+
+        return [
+            (feedback.is_normal and ranges_saved,
+             bool(feedback.set_alert and feedback.alert_threshold) and alerts_saved)
+            for feedback in batch
+        ]
+
+    async def drain(self) -> None:
+        """Wait for every queued batch to be written"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+# Shared writer used by the /feedback endpoints
+feedback_writer = FeedbackWriter(
+    preference_store,
+    preference_cache,
+    coalesce_seconds=config.FEEDBACK_COALESCE_MS / 1000,
+    result_cache=result_cache
+)
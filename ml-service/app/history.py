@@ -0,0 +1,209 @@
+import math
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from .anomaly_detection import parse_dates
+from .category_stats import category_key
+
+class HistoryConflictError(Exception):
+    """The client's view of a stored history is out of date (the server restarted, or the user was evicted)"""
+
+class _UserHistory:
+    def __init__(self):
+        self.generation = uuid.uuid4().hex
+        self.version = 0
+        # category -> transaction id -> (date as epoch seconds, NaN if missing, transaction)
+        self.categories: Dict[Hashable, Dict[str, Tuple[float, Dict[str, Any]]]] = {}
+        # category -> its transactions in date order, built on first read after the category changes
+        self.views: Dict[Hashable, List[Dict[str, Any]]] = {}
+        # No stored transaction is dated before this, so expiry can skip the scan until the cutoff passes it
+        self.oldest = math.inf
+
+    def size(self) -> int:
+        return sum(len(rows) for rows in self.categories.values())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "generation": self.generation,
+            "size": self.size(),
+            "categories": {category: len(rows) for category, rows in self.categories.items()},
+        }
+
+def _timestamps(transactions: List[Dict[str, Any]]) -> np.ndarray:
+    dates, _ = parse_dates([tx.get('date') for tx in transactions])
+    seconds = dates.astype('datetime64[s]')
+    return np.where(np.isnat(seconds), np.nan, seconds.astype(np.int64)).astype(np.float64)
+
+def _oldest_first(item: Tuple[str, Tuple[float, Dict[str, Any]]]) -> float:
+    timestamp = item[1][0]
+    return -np.inf if np.isnan(timestamp) else timestamp
+
+class TransactionHistory:
+    """Bounded per-user, per-category transaction histories kept on the server.
+
+    Clients send only what changed since their last call (new or edited transactions
+    to append, ids to delete) instead of the whole history with every detection.
+    Transactions are keyed by id, so appending an existing id replaces it, also when
+    its category changed. Each category keeps at most max_transactions, dropping the
+    oldest by date (undated ones first), and transactions older than max_age_days are
+    dropped. Beyond max_users, the least recently used user's history is dropped.
+    Each category's date-ordered view is kept until the category changes, so repeat
+    detections over an unchanged history don't sort it again.
+
+    Histories live in this process only: with several server processes, a user's
+    requests must always reach the same one (see the note in config.py).
+
+    Every user history has a random generation. A client passes back the generation
+    it last saw, and gets HistoryConflictError if the history was lost in between,
+    so it knows to send everything again. The version counts changes, so detection
+    results can be cached per (generation, version).
+    """
+
+    def __init__(self, max_transactions: int = 5000, max_age_days: float = 730, max_users: int = 10000):
+        self.max_transactions = max_transactions
+        self.max_age_days = max_age_days
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def transaction_count(self) -> int:
+        with self._lock:
+            return sum(history.size() for history in self._users.values())
+
+    def apply(self, user_id: str, append: Iterable[Dict[str, Any]] = (), delete: Iterable[Any] = (),
+              replace: bool = False, generation: Optional[str] = None) -> Dict[str, Any]:
+        """Apply a client's changes and return the summary (generation, size, per-category counts).
+
+        With replace, the user's stored history is discarded first. Otherwise a given
+        generation must match the stored one, else HistoryConflictError. Raises
+        ValueError, before changing anything, if a transaction has no id.
+        """
+        append, delete = list(append), list(delete)
+        if any(tx.get('id') is None for tx in append):
+            raise ValueError("Every transaction added to the stored history needs an id")
+        timestamps = _timestamps(append) if append else np.empty(0)
+
+        with self._lock:
+            history = self._users.get(user_id)
+            if replace or history is None:
+                if not replace and generation is not None:
+                    raise HistoryConflictError(f"No stored history for generation {generation}")
+                history = self._users[user_id] = _UserHistory()
+            elif generation is not None and generation != history.generation:
+                raise HistoryConflictError(f"Stored history is generation {history.generation}, not {generation}")
+            self._users.move_to_end(user_id)
+
+            for transaction_id in delete:
+                self._remove(history, str(transaction_id))
+            touched = set()
+            for tx, timestamp in zip(append, timestamps):
+                transaction_id = str(tx['id'])
+                self._remove(history, transaction_id)
+                category = category_key(tx)
+                history.categories.setdefault(category, {})[transaction_id] = (float(timestamp), tx)
+                if timestamp < history.oldest:
+                    history.oldest = float(timestamp)
+                touched.add(category)
+            for category in touched:
+                history.views.pop(category, None)
+                rows = history.categories.get(category, {})
+                if len(rows) > self.max_transactions:
+                    for transaction_id, _ in sorted(rows.items(), key=_oldest_first)[:len(rows) - self.max_transactions]:
+                        del rows[transaction_id]
+            if self._expire(history) or append or delete or replace:
+                history.version += 1
+
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return history.summary()
+
+    def transactions(self, user_id: str, category: Optional[Hashable] = None, generation: Optional[str] = None
+                     ) -> Tuple[str, int, Dict[Hashable, List[Dict[str, Any]]]]:
+        """(generation, version, transactions by category in date order) for a user, or one category of theirs.
+
+        Treat the transactions as read-only. Raises HistoryConflictError if the user has
+        no stored history, or a given generation doesn't match it: an empty history
+        would pass for "no anomalies" when this process never got, or lost, the data.
+        """
+        with self._lock:
+            history = self._users.get(user_id)
+            if history is None:
+                raise HistoryConflictError("No stored history for this user")
+            if generation is not None and generation != history.generation:
+                raise HistoryConflictError(f"Stored history is generation {history.generation}, not {generation}")
+            self._users.move_to_end(user_id)
+            if self._expire(history):
+                history.version += 1
+            keys = list(history.categories) if category is None else [category]
+            return history.generation, history.version, {key: self._view(history, key) for key in keys}
+
+    def summary(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            history = self._users.get(user_id)
+            return None if history is None else history.summary()
+
+    def clear(self, user_id: Optional[str] = None) -> None:
+        """Drop one user's stored history, or everyone's"""
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+    @staticmethod
+    def _view(history: _UserHistory, category: Hashable) -> List[Dict[str, Any]]:
+        view = history.views.get(category)
+        if view is None:
+            rows = history.categories.get(category)
+            if rows is None:
+                return []
+            view = history.views[category] = [tx for _, (_, tx) in sorted(rows.items(), key=_oldest_first)]
+        return view
+
+    @staticmethod
+    def _remove(history: _UserHistory, transaction_id: str) -> None:
+        for category, rows in list(history.categories.items()):
+            if rows.pop(transaction_id, None) is not None:
+                history.views.pop(category, None)
+                if not rows:
+                    del history.categories[category]
+                return
+
+    def _expire(self, history: _UserHistory) -> bool:
+        """Drop transactions older than max_age_days; True if any were dropped"""
+        cutoff = (datetime.now() - timedelta(days=self.max_age_days) - datetime(1970, 1, 1)).total_seconds()
+        if history.oldest >= cutoff:
+            return False
+        expired = False
+        oldest = math.inf
+        for category, rows in list(history.categories.items()):
+            stale = [transaction_id for transaction_id, (timestamp, _) in rows.items() if timestamp < cutoff]
+            for transaction_id in stale:
+                del rows[transaction_id]
+            if stale:
+                history.views.pop(category, None)
+                expired = True
+            if not rows:
+                del history.categories[category]
+                continue
+            dated = [timestamp for timestamp, _ in rows.values() if not math.isnan(timestamp)]
+            if dated:
+                oldest = min(oldest, min(dated))
+        history.oldest = oldest
+        return expired
+
+# Shared stored histories for the /history endpoints
+transaction_history = TransactionHistory(
+    max_transactions=config.HISTORY_MAX_TRANSACTIONS,
+    max_age_days=config.HISTORY_MAX_AGE_DAYS,
+    max_users=config.HISTORY_MAX_USERS,
+)
@@ -0,0 +1,278 @@
+"""Incremental ingestion of large transaction histories into columnar buffers.
+
+The request body (NDJSON, or a JSON array of transaction objects) is parsed chunk by
+chunk. Each transaction's amount, date, category and currency go straight into numeric
+columns, and its raw JSON is appended to a spool file on disk, so memory stays close to
+the size of the columns (about 35 bytes per transaction) however long the history is.
+Detection reads back only the transactions it flags (see TransactionColumns.record).
+"""
+import asyncio
+import codecs
+import json
+import logging
+import os
+import tempfile
+from typing import Any, AsyncIterable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .anomaly_detection import parse_amounts, parse_dates
+from .category_stats import category_key
+
+logger = logging.getLogger("ml-service")
+
+# Transactions parsed per batch before their columns are appended
+FLUSH_ROWS = 4096
+
+# A single transaction's JSON larger than this is rejected (it is most likely malformed input)
+MAX_RECORD_BYTES = 1 << 20
+
+# Currency codes stored per row; index 0 means none or unrecognised
+CURRENCIES = (None, 'USD', 'EUR', 'GBP')
+_CURRENCY_CODES = {currency: code for code, currency in enumerate(CURRENCIES) if currency}
+
+Record = Tuple[Dict[str, Any], bytes]
+
+def currency_codes(currencies: Sequence[Any]) -> np.ndarray:
+    """Codes into CURRENCIES for a column of currency values"""
+    return np.array([_CURRENCY_CODES.get(currency, 0) for currency in currencies], dtype=np.int8)
+
+def _as_transaction(value: Any) -> Dict[str, Any]:
+    if not isinstance(value, dict):
+        raise ValueError(f"Expected a transaction object, got {type(value).__name__}")
+    return value
+
+class NdjsonParser:
+    """Splits NDJSON chunks into (transaction, raw line) pairs; blank lines are skipped"""
+
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, chunk: bytes) -> List[Record]:
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        if len(self._buffer) > MAX_RECORD_BYTES:
+            raise ValueError(f"NDJSON line longer than {MAX_RECORD_BYTES} bytes")
+        return [self._parse(line) for line in lines if line.strip()]
+
+    def close(self) -> List[Record]:
+        line, self._buffer = self._buffer, b""
+        return [self._parse(line)] if line.strip() else []
+
+    @staticmethod
+    def _parse(line: bytes) -> Record:
+        try:
+            return _as_transaction(json.loads(line)), line
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid NDJSON line: {e}") from e
+
+class JsonArrayParser:
+    """Splits a JSON array of transaction objects, arriving in arbitrary chunks, into (transaction, raw JSON) pairs"""
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._text = ""
+        self._started = False
+        self._finished = False
+
+    def feed(self, chunk: bytes) -> List[Record]:
+        self._text += self._utf8.decode(chunk)
+        return self._drain()
+
+    def close(self) -> List[Record]:
+        self._text += self._utf8.decode(b"", final=True)
+        records = self._drain()
+        if not self._finished:
+            if self._text.strip():
+                # Re-raise the decoder's own message for the record that never completed
+                start = self._skip(0, " \t\r\n,")
+                try:
+                    self._decoder.raw_decode(self._text, start)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Invalid JSON transaction: {e}") from e
+            raise ValueError("JSON array is not terminated")
+        return records
+
+    def _skip(self, pos: int, chars: str) -> int:
+        while pos < len(self._text) and self._text[pos] in chars:
+            pos += 1
+        return pos
+
+    def _drain(self) -> List[Record]:
+        records = []
+        pos = 0
+        text = self._text
+        if not self._started:
+            pos = self._skip(pos, " \t\r\n")
+            if pos == len(text):
+                return records
+            if text[pos] != "[":
+                raise ValueError("Expected a JSON array of transactions")
+            self._started = True
+            pos += 1
+        while not self._finished:
+            pos = self._skip(pos, " \t\r\n,")
+            if pos == len(text):
+                break
+            if text[pos] == "]":
+                self._finished = True
+                pos += 1
+                break
+            try:
+                value, end = self._decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                # Most likely the object continues in the next chunk; close() reports real errors
+                if len(text) - pos > MAX_RECORD_BYTES:
+                    raise ValueError(f"JSON transaction longer than {MAX_RECORD_BYTES} bytes or malformed")
+                break
+            records.append((_as_transaction(value), text[pos:end].encode()))
+            pos = end
+        if self._finished and text[pos:].strip():
+            raise ValueError("Unexpected data after the JSON array")
+        self._text = text[pos:]
+        return records
+
+class TransactionColumns:
+    """A transaction history held as numeric columns, with each row's full JSON spooled to disk.
+
+    Columns are aligned by row, in input order: amounts (absolute, NaN if unparseable),
+    dates (datetime64[ns], NaT if missing or unparseable), has_date, category_codes
+    (indexes into categories) and currency_codes (indexes into CURRENCIES). Picklable,
+    so it can be sent to a detection worker process, which reads the same spool file.
+    """
+
+    def __init__(self, amounts: np.ndarray, dates: np.ndarray, has_date: np.ndarray,
+                 category_codes: np.ndarray, categories: List[Any], currency_codes: np.ndarray,
+                 offsets: np.ndarray, lengths: np.ndarray, spool_path: str):
+        self.amounts = amounts
+        self.dates = dates
+        self.has_date = has_date
+        self.category_codes = category_codes
+        self.categories = categories
+        self.currency_codes = currency_codes
+        self.offsets = offsets
+        self.lengths = lengths
+        self.spool_path = spool_path
+        self._spool = None
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_spool"] = None
+        return state
+
+    def currency(self, row: int) -> Optional[str]:
+        return CURRENCIES[self.currency_codes[row]]
+
+    def record(self, row: int) -> Dict[str, Any]:
+        """The full transaction dict for one row, read back from the spool file"""
+        if self._spool is None:
+            self._spool = open(self.spool_path, "rb")
+        self._spool.seek(int(self.offsets[row]))
+        return json.loads(self._spool.read(int(self.lengths[row])))
+
+    def records(self) -> List[Dict[str, Any]]:
+        """Every transaction as a dict; only for fallbacks that need the list form"""
+        return [self.record(row) for row in range(len(self))]
+
+    def release(self) -> None:
+        """Close this copy's handle on the spool file"""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def close(self) -> None:
+        """Close and delete the spool file; record() no longer works afterwards"""
+        self.release()
+        try:
+            os.unlink(self.spool_path)
+        except FileNotFoundError:
+            pass
+
+class TransactionColumnsBuilder:
+    """Accumulates parsed transactions into TransactionColumns, FLUSH_ROWS at a time"""
+
+    def __init__(self, spool_dir: Optional[str] = None):
+        fd, self.spool_path = tempfile.mkstemp(prefix="transactions-", suffix=".ndjson", dir=spool_dir)
+        self._spool = os.fdopen(fd, "wb")
+        self._position = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._category_index: Dict[Any, int] = {}
+        self._chunks: Dict[str, List[np.ndarray]] = {name: [] for name in (
+            "amounts", "dates", "has_date", "category_codes", "currency_codes", "offsets", "lengths")}
+        self._offsets: List[int] = []
+        self._lengths: List[int] = []
+
+    def add(self, records: List[Record]) -> None:
+        for transaction, raw in records:
+            self._spool.write(raw)
+            self._offsets.append(self._position)
+            self._lengths.append(len(raw))
+            self._position += len(raw)
+            self._pending.append(transaction)
+            if len(self._pending) >= FLUSH_ROWS:
+                self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        dates, has_date = parse_dates([tx.get('date') for tx in batch])
+        chunks = self._chunks
+        chunks["amounts"].append(parse_amounts([tx.get('amount', 0) for tx in batch]))
+        chunks["dates"].append(dates)
+        chunks["has_date"].append(has_date)
+        chunks["category_codes"].append(np.array(
+            [self._category_index.setdefault(category_key(tx), len(self._category_index)) for tx in batch],
+            dtype=np.int32))
+        chunks["currency_codes"].append(currency_codes([tx.get('currency') for tx in batch]))
+        chunks["offsets"].append(np.array(self._offsets, dtype=np.int64))
+        chunks["lengths"].append(np.array(self._lengths, dtype=np.int32))
+        self._offsets, self._lengths = [], []
+
+    def finish(self) -> TransactionColumns:
+        self._flush()
+        self._spool.close()
+        dtypes = {"amounts": np.float64, "dates": "datetime64[ns]", "has_date": bool,
+                  "category_codes": np.int32, "currency_codes": np.int8, "offsets": np.int64, "lengths": np.int32}
+        columns = {
+            name: np.concatenate(chunks) if chunks else np.array([], dtype=dtypes[name])
+            for name, chunks in self._chunks.items()
+        }
+        return TransactionColumns(categories=list(self._category_index), spool_path=self.spool_path, **columns)
+
+    def discard(self) -> None:
+        self._spool.close()
+        try:
+            os.unlink(self.spool_path)
+        except FileNotFoundError:
+            pass
+
+async def ingest_transactions(chunks: AsyncIterable[bytes], content_type: str = "",
+                              spool_dir: Optional[str] = None) -> TransactionColumns:
+    """Parse a streamed body into TransactionColumns: NDJSON if the content type says so, else a JSON array.
+
+    Raises ValueError for malformed input. The caller must close() the result.
+    Parsing, spool writes and date parsing run in a worker thread, chunk by chunk,
+    so a large upload doesn't hold up the event loop.
+    """
+    parser = NdjsonParser() if "ndjson" in content_type.lower() else JsonArrayParser()
+    builder = TransactionColumnsBuilder(spool_dir)
+    
+    def feed(chunk: bytes) -> None:
+        builder.add(parser.feed(chunk))
+    
+    def finish() -> TransactionColumns:
+        builder.add(parser.close())
+        return builder.finish()
+    
+    try:
+        async for chunk in chunks:
+            await asyncio.to_thread(feed, chunk)
+        return await asyncio.to_thread(finish)
+    except BaseException:
+        builder.discard()
+        raise
@@ -0,0 +1,209 @@
+"""Logging for the service: request paths only enqueue records, handlers run on a background thread.
+
+configure_logging() installs a QueueHandler on the root logger and a QueueListener
+that feeds the real handlers. Detection worker processes forward their records to
+the same listener through a multiprocessing queue (see worker_initializer()).
+
+Per-transaction lines should be logged at DEBUG with %-style arguments and
+extra=SAMPLED, e.g. logger.debug("Transaction %s: %.2f", tx_id, amount, extra=SAMPLED).
+They cost nothing when DEBUG is off, and only one in LOG_SAMPLE_EVERY is kept when it is on.
+"""
+import atexit
+import logging
+import multiprocessing
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import config
+from .request_context import RequestIdFilter
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Pass as extra= on per-transaction debug lines to have them sampled
+SAMPLED = {"sample": True}
+
+class SampleFilter(logging.Filter):
+    """Keeps the first and then every Nth record of each sampled log line; unsampled records always pass"""
+
+    def __init__(self, every: int = 100):
+        super().__init__()
+        self.every = max(1, every)
+        self._counts: Dict[Tuple[str, Any], int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1 or not getattr(record, "sample", False):
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % self.every == 0
+
+def parse_logger_levels(spec: str) -> Dict[str, str]:
+    """Parse "name=LEVEL,other=LEVEL" into {name: LEVEL}"""
+    levels = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def _apply_levels(level: str, logger_levels: Dict[str, str]) -> None:
+    logging.getLogger().setLevel(level.upper())
+    for name, logger_level in logger_levels.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+def _install_queue_handler(log_queue: Any, sample_filter: SampleFilter) -> None:
+    handler = QueueHandler(log_queue)
+    handler.addFilter(sample_filter)
+    handler.addFilter(RequestIdFilter())
+    logging.getLogger().addHandler(handler)
+
+class MemoryLogHandler(logging.Handler):
+    """Keeps the most recent records in a fixed-size ring buffer for the /logs endpoint.
+
+    Every record gets an increasing sequence number, which doubles as the pagination
+    cursor: query(cursor=n) returns records logged after record n.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        if capacity < 1:
+            raise ValueError(f"Log buffer capacity must be at least 1, got {capacity}")
+        super().__init__()
+        self.capacity = capacity
+        self._buffer: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._next_seq = 0
+        self._buffer_lock = threading.Lock()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            entry = {
+                "timestamp": record.created,
+                "level": record.levelname,
+                "levelno": record.levelno,
+                "logger": record.name,
+                "request_id": getattr(record, "request_id", None),
+                "message": record.getMessage(),
+            }
+            with self._buffer_lock:
+                entry["seq"] = self._next_seq
+                self._buffer[self._next_seq % self.capacity] = entry
+                self._next_seq += 1
+        except Exception:
+            self.handleError(record)
+
+    def query(self, level: Optional[str] = None, since: Optional[float] = None,
+              request_id: Optional[str] = None, cursor: Optional[int] = None,
+              limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[int], bool]:
+        """Matching records (oldest first), the cursor for the next page, and whether more records are buffered.
+
+        Records older than the buffer are gone; a stale cursor resumes from the oldest one still held.
+        """
+        min_levelno = logging.getLevelName(level.upper()) if level else 0
+        if not isinstance(min_levelno, int):
+            raise ValueError(f"Unknown log level: {level}")
+        with self._buffer_lock:
+            end = self._next_seq
+            start = max(end - self.capacity, 0 if cursor is None else cursor + 1)
+            window = [self._buffer[seq % self.capacity] for seq in range(start, end)]
+
+        results = []
+        last_seq = None
+        for entry in window:
+            last_seq = entry["seq"]
+            if (entry["levelno"] >= min_levelno
+                    and (since is None or entry["timestamp"] >= since)
+                    and (request_id is None or entry["request_id"] == request_id)):
+                results.append(entry)
+                if len(results) >= limit:
+                    break
+        next_cursor = last_seq if last_seq is not None else cursor
+        has_more = last_seq is not None and last_seq < end - 1
+        return [self._public(entry) for entry in results], next_cursor, has_more
+
+    @staticmethod
+    def _public(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "seq": entry["seq"],
+            "timestamp": datetime.fromtimestamp(entry["timestamp"], timezone.utc).isoformat(),
+            "level": entry["level"],
+            "logger": entry["logger"],
+            "request_id": entry["request_id"],
+            "message": entry["message"],
+        }
+
+_lock = threading.Lock()
+_listeners: List[QueueListener] = []
+_handlers: List[logging.Handler] = []
+_worker_queue: Optional[Any] = None
+_stream_handler: Optional[logging.Handler] = None
+_sample_filter = SampleFilter(config.LOG_SAMPLE_EVERY)
+
+def configure_logging(level: str = config.LOG_LEVEL, logger_levels: Optional[Dict[str, str]] = None,
+                      sample_every: int = config.LOG_SAMPLE_EVERY) -> None:
+    """Route all logging through a queue to a background listener thread. Safe to call more than once."""
+    global _stream_handler
+    if logger_levels is None:
+        logger_levels = parse_logger_levels(config.LOG_LEVELS)
+    with _lock:
+        _apply_levels(level, logger_levels)
+        _sample_filter.every = max(1, sample_every)
+        if _listeners:
+            return
+        if _stream_handler is None:
+            _stream_handler = logging.StreamHandler()
+            _stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            _handlers.append(_stream_handler)
+
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        _install_queue_handler(log_queue, _sample_filter)
+        listener = QueueListener(log_queue, *_handlers, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+    atexit.register(stop_logging)
+
+def add_handler(handler: logging.Handler) -> None:
+    """Attach a handler to the background listener(s); it will see records from every process"""
+    with _lock:
+        _handlers.append(handler)
+        for listener in _listeners:
+            listener.handlers = tuple(_handlers)
+
+def worker_initializer() -> Tuple[Any, ...]:
+    """(initializer, initargs) for a detection ProcessPoolExecutor, so worker logs reach the parent's handlers"""
+    global _worker_queue
+    with _lock:
+        if not _listeners:
+            return (None, ())
+        if _worker_queue is None:
+            _worker_queue = multiprocessing.get_context("spawn").Queue()
+            listener = QueueListener(_worker_queue, *_handlers, respect_handler_level=True)
+            listener.start()
+            _listeners.append(listener)
+        root = logging.getLogger()
+        logger_levels = {
+            name: logging.getLevelName(logger.level)
+            for name, logger in logging.Logger.manager.loggerDict.items()
+            if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET
+        }
+        return (configure_worker_logging,
+                (_worker_queue, logging.getLevelName(root.level), logger_levels, _sample_filter.every))
+
+def configure_worker_logging(log_queue: Any, level: str, logger_levels: Dict[str, str], sample_every: int) -> None:
+    """Runs in each worker process: send every record to the parent over log_queue"""
+    _install_queue_handler(log_queue, SampleFilter(sample_every))
+    _apply_levels(level, logger_levels)
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener threads"""
+    global _worker_queue
+    with _lock:
+        for listener in _listeners:
+            listener.stop()
+        _listeners.clear()
+        _worker_queue = None
@@ -1,9 +1,15 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, Request
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, List, Optional, Any, Union
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from typing import Awaitable, Callable, Dict, List, Optional, Any, Tuple, Union
 from jose import jwt, JWTError
+import asyncio
+import contextlib
+from datetime import datetime, timezone
 import json
 import logging
+import time
 import traceback
 from pydantic import BaseModel
 import os
@@ -11,40 +17,33 @@ import pandas as pd
 import numpy as np
 import math
 
-from .anomaly_detection import detect_anomalies_isolation_forest, detect_anomalies_sliding_window
-from .models import AnomalyResponse, TransactionList, CategoryAnomalyRequest, AnomalyFeedback, AnomalyFeedbackResponse, CategoryAlert
+from . import config
+from .category_stats import category_key
+from .columnar import UnsupportedMediaTypeError, decode_columns, split_by_category
+from .detection import run_batch_user_detection, run_category_detection, run_category_detection_columns, run_user_category_detection_columns, run_user_detection
+from .feedback import feedback_writer
+from .history import HistoryConflictError, transaction_history
+from .ingest import TransactionColumns, ingest_transactions
+from .responses import JSON, RESPONSE_MEDIA_TYPES, FastJSONResponse, encode_binary, encode_json, lean_category_results, lean_result, media_type, negotiate, parse_view, project_anomalies
+from .logging_setup import configure_logging, add_handler, MemoryLogHandler
+from .metrics import registry, DETECTIONS_COALESCED, REQUEST_SECONDS, RESULT_CACHE_LOOKUPS, STAGE_SECONDS, TRANSACTIONS_PROCESSED, count_anomalies
+from .request_context import RequestIdMiddleware
+from .preferences import preference_cache
+from .result_cache import canonical_digest, result_cache
+from .single_flight import detection_flights
+from .storage import preference_store
+from .streaming import StreamingDetector
+from .workers import detection_pool, PoolSaturatedError
+from .models import AnomalyResponse, HistoryDelta, TransactionList, BatchUserAnomalyRequest, CategoryAnomalyRequest, AnomalyFeedback, AnomalyFeedbackResponse, AnomalyFeedbackBatch, AnomalyFeedbackBatchResponse, FeedbackItemResult, CategoryAlert, Transaction
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: handlers run on a background thread, levels come from LOG_LEVEL / LOG_LEVELS
+configure_logging()
 logger = logging.getLogger("ml-service")
 
-# Create an in-memory log handler for retrieving logs via API
-class MemoryLogHandler(logging.Handler):
-    def __init__(self, capacity=1000):
-        super().__init__()
-        self.capacity = capacity
-        self.logs = []
-        
-    def emit(self, record):
-        log_entry = self.format(record)
-        self.logs.append(log_entry)
-        # Keep only the most recent logs
-        if len(self.logs) > self.capacity:
-            self.logs = self.logs[-self.capacity:]
-            
-    def get_logs(self):
-        return self.logs
-
-# Create and add the memory handler
-memory_handler = MemoryLogHandler()
-memory_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(memory_handler)
+# Keep recent service logs (including those from detection workers) in memory for /logs
+memory_handler = MemoryLogHandler(capacity=config.LOG_BUFFER_SIZE)
+memory_handler.addFilter(logging.Filter("ml-service"))
+add_handler(memory_handler)
 
 # Development mode flag - set to True for testing
 DEV_MODE = True
@@ -55,6 +54,121 @@ os.makedirs("data/alerts", exist_ok=True)
 
 app = FastAPI(title="Anomaly Detection Service")
 
+# Per-user, per-category running state for single-transaction scoring
+stream_detector = StreamingDetector(
+    window_size=config.STREAM_WINDOW_SIZE,
+    min_window=config.STREAM_MIN_WINDOW,
+    max_states=config.STREAM_MAX_STATES
+)
+snapshot_task: Optional[asyncio.Task] = None
+
+# Scrape-time gauges for state owned by the pool, caches and streaming detector
+registry.gauge("detection_pool_pending", "Detection jobs queued or running", lambda: detection_pool.pending)
+registry.gauge("detection_pool_max_pending", "Pending jobs allowed before detection returns 503", lambda: detection_pool.max_pending)
+registry.gauge("preference_cache_hit_ratio", "Share of preference lookups served from memory",
+               lambda: preference_cache.hits / max(preference_cache.hits + preference_cache.misses, 1))
+registry.gauge("preference_cache_size", "Users with cached preferences", lambda: preference_cache.stats()["size"])
+registry.gauge("result_cache_size", "Detection results held by the result cache", lambda: result_cache.stats()["size"])
+registry.gauge("result_cache_bytes", "Approximate memory held by the result cache", lambda: result_cache.stats()["bytes"])
+registry.gauge("detections_in_flight", "Distinct detections running for the detection endpoints", lambda: len(detection_flights))
+registry.gauge("history_users", "Users with a stored transaction history", lambda: len(transaction_history))
+registry.gauge("history_transactions", "Transactions held in stored histories", transaction_history.transaction_count)
+registry.gauge("stream_category_states", "Per-user category states held by the streaming detector", lambda: len(stream_detector))
+
+def json_response(content: Any) -> JSONResponse:
+    """Encode a response here rather than in FastAPI, so serialization time shows up in the stage metrics"""
+    with STAGE_SECONDS.time(stage="serialize"):
+        return JSONResponse(jsonable_encoder(content))
+
+def lean_response(content: Any) -> FastJSONResponse:
+    """json_response for lean views: plain data, encoded without jsonable_encoder"""
+    with STAGE_SECONDS.time(stage="serialize"):
+        return FastJSONResponse(content)
+
+def response_view(
+    view: Optional[str] = Query(None, description="'full' (default) or 'lean'"),
+    fields: Optional[str] = Query(None, description="Comma-separated anomaly fields to return; implies the lean view")
+) -> Optional[Tuple[str, ...]]:
+    """Anomaly fields for a lean detection response, or None for the full response (see responses.py)"""
+    try:
+        return parse_view(view, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def response_media_type(accept: Optional[str] = Header(None)) -> str:
+    """Media type of a detection response, negotiated from the Accept header (see responses.negotiate)"""
+    chosen = negotiate(accept)
+    if chosen is None:
+        raise HTTPException(status_code=406, detail=f"Detection responses are available as {', '.join(RESPONSE_MEDIA_TYPES)}")
+    return chosen
+
+def binary_response(content: Any, media_type: str) -> Response:
+    """json_response for MessagePack and Arrow responses"""
+    with STAGE_SECONDS.time(stage="serialize"):
+        return Response(encode_binary(content, media_type), media_type=media_type)
+
+def category_response(result: Dict[str, Any], lean_fields: Optional[Tuple[str, ...]], media_type: str) -> Response:
+    """Response of the category detection endpoints, full or lean, in the negotiated format"""
+    content = lean_result(result, lean_fields) if lean_fields else result
+    if media_type != JSON:
+        return binary_response(content, media_type)
+    return lean_response(content) if lean_fields else json_response(content)
+
+def user_response(all_anomalies: List[Dict[str, Any]], category_results: Dict[str, Any],
+                  lean_fields: Optional[Tuple[str, ...]], media_type: str = JSON) -> Response:
+    """Response of the user detection endpoints, full or lean, in the negotiated format"""
+    count_anomalies(all_anomalies)
+    
+    if lean_fields:
+        # Each anomaly once, at the top level; category_results keep only their counts and methods
+        content = {
+            "anomalies": project_anomalies(all_anomalies, lean_fields),
+            "count": len(all_anomalies),
+            "category_results": lean_category_results(category_results)
+        }
+        return lean_response(content) if media_type == JSON else binary_response(content, media_type)
+    if media_type != JSON:
+        return binary_response({
+            "anomalies": all_anomalies,
+            "count": len(all_anomalies),
+            "category_results": category_results
+        }, media_type)
+    return json_response(AnomalyResponse(
+        anomalies=all_anomalies,
+        count=len(all_anomalies),
+        category_results=category_results
+    ))
+
+def cached_result(endpoint: str, key: Tuple[str, str], preferences: Any) -> Optional[Any]:
+    """A detection result cached for this exact request and the user's current preferences (see result_cache.py)"""
+    result = result_cache.get(key, preferences)
+    RESULT_CACHE_LOOKUPS.inc(endpoint=endpoint, result="miss" if result is None else "hit")
+    if result is not None:
+        logger.info("Serving cached %s detection result", endpoint)
+    return result
+
+async def shared_detection(endpoint: str, key: Tuple[str, str], preferences: Any,
+                           detect: Callable[[], Awaitable[Any]]) -> Any:
+    """Result for a request from the result cache, else from an identical detection already running, else detect().
+    
+    Concurrent requests only share a detection when the user's preferences are the same too.
+    detect() should add its result to the result cache.
+    """
+    result = cached_result(endpoint, key, preferences)
+    if result is not None:
+        return result
+    flight_key = key + (canonical_digest([preferences.accepted_ranges, preferences.alert_thresholds]),)
+    if flight_key in detection_flights:
+        DETECTIONS_COALESCED.inc(endpoint=endpoint)
+        logger.info("Joining identical %s detection already in flight", endpoint)
+    return await detection_flights.run(flight_key, detect)
+
+def cache_user_result(key: Tuple[str, str], result: Tuple[List[Dict[str, Any]], Dict[str, Any]], preferences: Any) -> None:
+    """Cache a user detection result unless a category failed, which is worth retrying"""
+    category_results = result[1]
+    if not any("error" in category_result for category_result in category_results.values()):
+        result_cache.put(key, result, category_results.keys(), preferences)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -65,6 +179,9 @@ app.add_middleware(
     expose_headers=["*"],  # Expose all headers
 )
 
+# Tag every log line with the request it belongs to (X-Request-ID, generated if absent)
+app.add_middleware(RequestIdMiddleware)
+
 # Authentication middleware
 async def verify_token(authorization: str = Header(...)):
     """Verify JWT token from Clerk"""
@@ -89,461 +206,606 @@ async def verify_token(authorization: str = Header(...)):
             )
             return payload
         except JWTError as e:
-            logger.error(f"JWT decode error: {str(e)}")
+            logger.error("JWT decode error: %s", e)
             raise HTTPException(status_code=401, detail="Invalid token format")
             
     except Exception as e:
-        logger.error(f"Auth error: {str(e)}")
+        logger.error("Auth error: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=401, detail="Authentication failed")
 
+@app.on_event("startup")
+async def load_streaming_snapshot():
+    """Restore streaming detector state saved by a previous run, then snapshot it in the background"""
+    global snapshot_task
+    try:
+        stream_detector.load(config.STREAM_SNAPSHOT_PATH)
+    except Exception as e:
+        logger.error("Error loading streaming snapshot: %s", e)
+    if config.STREAM_SNAPSHOT_EVERY:
+        snapshot_task = asyncio.create_task(stream_detector.snapshot_periodically(
+            config.STREAM_SNAPSHOT_PATH, config.STREAM_SNAPSHOT_EVERY, config.STREAM_SNAPSHOT_INTERVAL_SECONDS))
+
+@app.on_event("shutdown")
+def shutdown_detection_pool():
+    """Stop detection workers when the server shuts down"""
+    detection_pool.shutdown()
+
+@app.on_event("shutdown")
+async def close_preference_store():
+    """Finish queued feedback writes, then close preference storage connections"""
+    await feedback_writer.drain()
+    preference_store.close()
+
+@app.on_event("shutdown")
+async def save_streaming_snapshot():
+    """Stop the snapshot task and persist streaming detector state so it survives restarts"""
+    global snapshot_task
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await snapshot_task
+        snapshot_task = None
+    try:
+        stream_detector.save(config.STREAM_SNAPSHOT_PATH)
+    except Exception as e:
+        logger.error("Error saving streaming snapshot: %s", e)
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
     return {"status": "ok", "service": "anomaly-detection"}
 
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 503 while the detection queue is full, so load balancers can back off"""
+    if detection_pool.pending >= detection_pool.max_pending:
+        raise HTTPException(status_code=503, detail=f"Detection queue is full ({detection_pool.pending} jobs pending)")
+    return {"status": "ready", "pending": detection_pool.pending, "max_pending": detection_pool.max_pending}
+
+@app.get("/metrics")
+async def metrics():
+    """Service metrics in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/logs")
-async def get_logs():
-    """Get recent logs for debugging"""
-    return memory_handler.get_logs()
+async def get_logs(
+    level: Optional[str] = None,
+    since: Optional[datetime] = None,
+    request_id: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Get recent logs for debugging, filtered by minimum level, time and request id.
+    
+    Pass the returned next_cursor back as `cursor` to fetch the following page.
+    """
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    try:
+        logs, next_cursor, has_more = memory_handler.query(
+            level=level,
+            since=since.timestamp() if since else None,
+            request_id=request_id,
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"logs": logs, "next_cursor": next_cursor, "has_more": has_more}
 
 @app.post("/detect-category-anomalies/{category_id}")
 async def detect_category_anomalies(
     category_id: str, 
     request: CategoryAnomalyRequest,
-    user: Dict = Depends(verify_token)
+    user: Dict = Depends(verify_token),
+    lean_fields: Optional[Tuple[str, ...]] = Depends(response_view),
+    output: str = Depends(response_media_type)
 ):
     """Detect anomalies for a specific category"""
+    start = time.perf_counter()
     try:
-        logger.info(f"Processing anomaly detection for category: {category_id}")
-        logger.info(f"Number of transactions: {len(request.transactions)}")
-        
-        # Enhanced debugging: Log all transactions
-        for i, tx in enumerate(request.transactions):
-            tx_amount = abs(float(tx.get('amount', 0)))
-            logger.info(f"Input Transaction #{i}: amount=${tx_amount:.2f}, desc={tx.get('description', 'N/A')}")
+        logger.debug("Processing anomaly detection for category: %s", category_id)
+        logger.debug("Number of transactions: %s", len(request.transactions))
+        TRANSACTIONS_PROCESSED.inc(len(request.transactions), endpoint="category")
         
         # Get user ID from token for user-specific preferences
         user_id = user.get('sub', 'unknown')
         
-        # Load user's accepted ranges if available
-        user_accepted_ranges = {}
-        user_ranges_file = f"data/user_feedback/{user_id}/accepted_ranges.json"
-        if os.path.exists(user_ranges_file):
-            try:
-                with open(user_ranges_file, 'r') as f:
-                    user_accepted_ranges = json.load(f)
-                logger.info(f"Loaded {len(user_accepted_ranges)} accepted ranges for user {user_id}")
-            except Exception as e:
-                logger.error(f"Error loading user accepted ranges: {str(e)}")
-        
-        # Load user's category alerts
-        category_alerts = {}
-        alerts_file = f"data/alerts/{user_id}/category_alerts.json"
-        if os.path.exists(alerts_file):
-            try:
-                with open(alerts_file, 'r') as f:
-                    alerts_list = json.load(f)
-                    for alert in alerts_list:
-                        if alert.get('active', True):
-                            category_alerts[alert.get('category')] = alert.get('threshold')
-                logger.info(f"Loaded user alert thresholds: {category_alerts}")
-            except Exception as e:
-                logger.error(f"Error loading user alerts: {str(e)}")
+        # Load user's accepted ranges and category alerts (copied, since request alerts are merged in)
+        preferences = await preference_cache.get_async(user_id)
+        user_accepted_ranges = preferences.accepted_ranges
+        category_alerts = dict(preferences.alert_thresholds)
         
         # Also use any alert thresholds provided in the request
         request_alerts = request.alert_thresholds if hasattr(request, 'alert_thresholds') else {}
         if request_alerts:
             # Merge with category_alerts, request takes precedence
             category_alerts.update(request_alerts)
-            logger.info(f"Using merged alert thresholds: {category_alerts}")
+            logger.info("Using merged alert thresholds: %s", category_alerts)
         
-        # Prepare threshold for isolation forest
-        formatted_thresholds = {}
-        if category_id in category_alerts:
-            threshold = category_alerts[category_id]
-            formatted_thresholds[f"{category_id}_threshold"] = threshold
-            logger.info(f"Using threshold for {category_id}: ${threshold}")
-        
-        # Force detect high transactions for fallback detection
-        debug_anomalies = []
-        if len(request.transactions) >= 5:
-            # Calculate average
-            amounts = [abs(float(tx.get('amount', 0))) for tx in request.transactions]
-            avg_amount = sum(amounts) / len(amounts)
-            std_dev = np.std(amounts) if len(amounts) > 1 else avg_amount * 0.2  # Estimate std dev if only one transaction
-            logger.info(f"Average amount: ${avg_amount:.2f}, StdDev: ${std_dev:.2f}")
-            
-            # Check if there's an alert threshold for this category
-            has_threshold = category_id in category_alerts
-            alert_threshold = category_alerts.get(category_id, float('inf'))
-            
-            # Find any transaction > 1.8x average or > avg + 1.5*std_dev, whichever is higher
-            # This ensures we only detect significantly higher values
-            for i, tx in enumerate(request.transactions):
-                tx_amount = abs(float(tx.get('amount', 0)))
-                threshold = max(avg_amount * 1.8, avg_amount + 1.5 * std_dev)
-                
-                # Only flag if either:
-                # 1. There's a threshold and the amount exceeds it, OR
-                # 2. There's no threshold and the amount exceeds the statistical threshold
-                if (has_threshold and tx_amount > alert_threshold) or (not has_threshold and tx_amount > threshold):
-                    # Calculate appropriate message and score
-                    if has_threshold and tx_amount > alert_threshold:
-                        reason = f"This expense exceeds your ${alert_threshold:.2f} alert threshold for {tx.get('categoryName', 'this category')}."
-                        threshold_used = alert_threshold
-                    else:
-                        ratio = tx_amount / avg_amount
-                        reason = f"This {tx.get('categoryName', 'expense')} is {ratio:.1f}x higher than your typical spending pattern."
-                        threshold_used = threshold
-                    
-                    logger.info(f"DIRECT DETECTION: Anomaly found: ${tx_amount:.2f} (threshold: ${threshold_used:.2f}, avg: ${avg_amount:.2f})")
-                    
-                    anomaly = tx.copy()
-                    anomaly["anomalyScore"] = min(0.95, 0.6 + (0.1 * (tx_amount / avg_amount - 1)))
-                    anomaly["reason"] = reason
-                    anomaly["severity"] = "High" if tx_amount > avg_amount * 3 else "Medium"
-                    debug_anomalies.append(anomaly)
+        async def detect():
+            # Run the detection pipeline on the worker pool so the event loop stays responsive
+            result = await detection_pool.run(
+                run_category_detection,
+                category_id,
+                request.transactions,
+                user_id,
+                user_accepted_ranges,
+                category_alerts
+            )
+            categories = {category_key(tx) for tx in request.transactions}
+            result_cache.put(cache_key, result, categories | {category_id}, preferences)
+            return result
         
-        if len(request.transactions) < 5:
-            logger.info(f"Not enough transactions for category {category_id} ({len(request.transactions)}/5)")
-            return {
-                "anomalies": [],
-                "count": 0,
-                "categoryId": category_id,
-                "message": "Not enough transaction data for anomaly detection"
-            }
+        # Repeat requests (dashboard refreshes) are answered from the result cache,
+        # and identical concurrent ones (several widgets or tabs) share one detection
+        cache_key = result_cache.make_key(user_id, f"category:{category_id}", [request.transactions, request_alerts])
+        result = await shared_detection("category", cache_key, preferences, detect)
+        count_anomalies(result.get('anomalies', []))
         
-        # Try isolation forest first with user preferences
+        response = category_response(result, lean_fields, output)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="category")
+        return response
+    except PoolSaturatedError as e:
+        logger.warning("Rejecting detection for category %s: %s", category_id, e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error("Error in detect_category_anomalies: %s", e)
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/detect-category-anomalies/{category_id}/stream")
+async def detect_category_anomalies_stream(
+    category_id: str,
+    request: Request,
+    user: Dict = Depends(verify_token),
+    lean_fields: Optional[Tuple[str, ...]] = Depends(response_view),
+    output: str = Depends(response_media_type)
+):
+    """Detect anomalies for a category from a streamed body: NDJSON or a JSON array of transactions.
+    
+    The body is parsed as it arrives into numeric columns (see ingest.py) instead of a
+    validated list of dicts, so very long histories don't need to fit in memory as objects.
+    """
+    start = time.perf_counter()
+    try:
+        with STAGE_SECONDS.time(stage="ingest"):
+            data = await ingest_transactions(request.stream(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        user_id = user.get('sub', 'unknown')
+        preferences = await preference_cache.get_async(user_id)
+        result = await detect_category_columns(category_id, data, user_id, preferences, "category_stream")
+    finally:
+        # detect_category_columns closes it too, but not if anything before it raised
+        data.close()
+    count_anomalies(result.get('anomalies', []))
+    response = category_response(result, lean_fields, output)
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="category_stream")
+    return response
+
+@app.post("/detect-category-anomalies/{category_id}/columns")
+async def detect_category_anomalies_columns(
+    category_id: str,
+    request: Request,
+    user: Dict = Depends(verify_token),
+    lean_fields: Optional[Tuple[str, ...]] = Depends(response_view),
+    output: str = Depends(response_media_type)
+):
+    """Detect anomalies for a category from a columnar body: {"columns": {"amount": [...], "date": [...], ...}}.
+    
+    The parallel arrays go straight into NumPy columns (see columnar.py), without a
+    dict or pydantic model per transaction.
+    """
+    start = time.perf_counter()
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    
+    user_id = user.get('sub', 'unknown')
+    preferences = await preference_cache.get_async(user_id)
+    
+    async def detect():
         try:
-            logger.info("Attempting isolation forest detection with user preferences")
-            anomalies = detect_anomalies_isolation_forest(
-                request.transactions,
-                user_id=user_id, 
-                user_accepted_ranges=user_accepted_ranges,
-                user_alert_thresholds=formatted_thresholds
-            )
-            method = "isolation_forest"
-            logger.info(f"Isolation forest found {len(anomalies)} anomalies")
-            
-            # Log any anomalies found
-            if anomalies:
-                for i, anomaly in enumerate(anomalies):
-                    logger.info(f"Anomaly #{i+1}: amount={anomaly.get('amount')}, score={anomaly.get('anomalyScore')}")
-            else:
-                logger.warning("No anomalies found by Isolation Forest despite having sufficient data")
-                
-            # If isolation forest found nothing but direct detection did, use direct detection results
-            if not anomalies and debug_anomalies:
-                logger.info(f"Using {len(debug_anomalies)} directly detected anomalies as fallback")
-                anomalies = debug_anomalies
-                method = "direct_detection"
-        except Exception as e:
-            logger.error(f"Isolation forest failed: {str(e)}")
-            logger.error(traceback.format_exc())
-            # Fall back to sliding window
-            logger.info("Falling back to sliding window detection")
-            anomalies = detect_anomalies_sliding_window(request.transactions)
-            method = "sliding_window"
-            logger.info(f"Sliding window found {len(anomalies)} anomalies")
-            
-        return {
-            "anomalies": anomalies,
-            "count": len(anomalies),
-            "categoryId": category_id,
-            "method": method
-        }
+            with STAGE_SECONDS.time(stage="ingest"):
+                data = decode_columns(body, content_type)
+        except UnsupportedMediaTypeError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return await detect_category_columns(category_id, data, user_id, preferences, "category_columns",
+                                             cache_key=cache_key)
+    
+    # Cached and in-flight results are shared before the body is even decoded
+    cache_key = result_cache.make_key(user_id, f"category_columns:{category_id}:{media_type(content_type)}", body)
+    result = await shared_detection("category_columns", cache_key, preferences, detect)
+    count_anomalies(result.get('anomalies', []))
+    response = category_response(result, lean_fields, output)
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="category_columns")
+    return response
+
+async def detect_category_columns(category_id: str, data: TransactionColumns, user_id: str, preferences: Any,
+                                  endpoint: str, cache_key: Optional[Tuple[str, str]] = None) -> Dict[str, Any]:
+    """Shared detection of the category endpoints that take TransactionColumns; closes data when done.
+    
+    With a cache_key, the result is added to the result cache.
+    """
+    try:
+        logger.debug("Processing %s anomaly detection for category: %s", endpoint, category_id)
+        logger.debug("Number of transactions: %s", len(data))
+        TRANSACTIONS_PROCESSED.inc(len(data), endpoint=endpoint)
+        
+        result = await detection_pool.run(
+            run_category_detection_columns,
+            category_id,
+            data,
+            user_id,
+            preferences.accepted_ranges,
+            preferences.alert_thresholds
+        )
+        if cache_key is not None:
+            result_cache.put(cache_key, result, {category_id, *data.categories}, preferences)
+        return result
+    except PoolSaturatedError as e:
+        logger.warning("Rejecting %s detection for category %s: %s", endpoint, category_id, e)
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        logger.error(f"Error in detect_category_anomalies: {str(e)}")
+        logger.error("Error in %s detection: %s", endpoint, e)
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        data.close()
 
 @app.post("/detect-user-anomalies")
 async def detect_user_anomalies(
     request: TransactionList,
-    user: Dict = Depends(verify_token)
+    user: Dict = Depends(verify_token),
+    lean_fields: Optional[Tuple[str, ...]] = Depends(response_view),
+    output: str = Depends(response_media_type)
 ):
     """Detect anomalies across all categories for a user"""
+    start = time.perf_counter()
     try:
-        logger.info(f"Processing user anomaly detection")
-        logger.info(f"Number of categories: {len(request.transactions_by_category)}")
+        logger.debug("Processing user anomaly detection")
+        logger.debug("Number of categories: %s", len(request.transactions_by_category))
+        TRANSACTIONS_PROCESSED.inc(sum(len(txs) for txs in request.transactions_by_category.values()), endpoint="user")
         
         # Get user ID from token
         user_id = user.get('sub', 'unknown')
         
-        # Load user's accepted ranges if available
-        user_accepted_ranges = {}
-        user_ranges_file = f"data/user_feedback/{user_id}/accepted_ranges.json"
-        if os.path.exists(user_ranges_file):
-            try:
-                with open(user_ranges_file, 'r') as f:
-                    user_accepted_ranges = json.load(f)
-                logger.info(f"Loaded {len(user_accepted_ranges)} accepted ranges for user {user_id}")
-            except Exception as e:
-                logger.error(f"Error loading user accepted ranges: {str(e)}")
+        # Load user's accepted ranges and category alerts
+        preferences = await preference_cache.get_async(user_id)
         
-        # Load user's category alerts
-        category_alerts = {}
-        alerts_file = f"data/alerts/{user_id}/category_alerts.json"
-        if os.path.exists(alerts_file):
-            try:
-                with open(alerts_file, 'r') as f:
-                    alerts_list = json.load(f)
-                    for alert in alerts_list:
-                        if alert.get('active', True):
-                            category_alerts[alert.get('category')] = alert.get('threshold')
-                logger.info(f"Loaded {len(category_alerts)} active alerts for user {user_id}: {category_alerts}")
-            except Exception as e:
-                logger.error(f"Error loading user alerts: {str(e)}")
-        else:
-            logger.info(f"No alert thresholds defined for user {user_id}")
+        async def detect():
+            result = await run_user_detection(
+                detection_pool,
+                request.transactions_by_category,
+                user_id,
+                preferences.accepted_ranges,
+                preferences.alert_thresholds
+            )
+            cache_user_result(cache_key, result, preferences)
+            return result
         
-        all_anomalies = []
-        category_results = {}
+        cache_key = result_cache.make_key(user_id, "user", request.transactions_by_category)
+        all_anomalies, category_results = await shared_detection("user", cache_key, preferences, detect)
         
-        for category_id, transactions in request.transactions_by_category.items():
-            try:
-                logger.info(f"Processing category {category_id} with {len(transactions)} transactions")
-                
-                if len(transactions) < 5:
-                    logger.info(f"Not enough transactions for category {category_id}")
-                    category_results[category_id] = {
-                        "anomalies": [],
-                        "count": 0,
-                        "method": "skipped",
-                        "message": "Not enough data"
-                    }
-                    continue
-                
-                # Try isolation forest with user feedback incorporated
-                try:
-                    # Convert category alerts to the expected format (category_threshold)
-                    formatted_thresholds = {}
-                    if category_id in category_alerts:
-                        threshold = category_alerts[category_id]
-                        formatted_thresholds[f"{category_id}_threshold"] = threshold
-                        logger.info(f"Using user-defined alert threshold for {category_id}: ${threshold}")
-                    else:
-                        logger.info(f"No user-defined alert threshold for category {category_id}")
-                        
-                    # Run anomaly detection with our improved Isolation Forest implementation 
-                    # that respects user preferences
-                    anomalies = detect_anomalies_isolation_forest(
-                        transactions, 
-                        user_id=user_id, 
-                        user_accepted_ranges=user_accepted_ranges,
-                        user_alert_thresholds=formatted_thresholds
-                    )
-                    method = "isolation_forest"
-                    logger.info(f"Isolation Forest found {len(anomalies)} anomalies for category {category_id}")
-                except Exception as e:
-                    logger.error(f"Isolation forest failed for category {category_id}: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    # Fall back to sliding window
-                    anomalies = detect_anomalies_sliding_window(transactions)
-                    method = "sliding_window"
-                    logger.info(f"Sliding window found {len(anomalies)} anomalies")
-                
-                # We only need to add explicit alerts if we don't have an isolation forest or sliding window alert
-                # First, check if we already have anomalies for transactions that exceed thresholds
-                found_threshold_anomalies = set()
-                if category_id in category_alerts:
-                    for anomaly in anomalies:
-                        if 'exceeds your' in anomaly.get('reason', ''):
-                            found_threshold_anomalies.add(anomaly.get('id', ''))
-                
-                # Check for spending alerts that weren't caught by anomaly detection
-                if category_id in category_alerts:
-                    threshold = category_alerts[category_id]
-                    for tx in transactions:
-                        tx_id = tx.get('id', '')
-                        # Skip if we already found this as an anomaly
-                        if tx_id in found_threshold_anomalies:
-                            continue
-                            
-                        amount = abs(float(tx.get('amount', 0)))
-                        
-                        # Only create alert if amount exceeds threshold
-                        if amount > threshold:
-                            # Create an alert anomaly
-                            alert_anomaly = tx.copy()
-                            alert_anomaly['anomalyScore'] = 0.7  # Medium-high score
-                            alert_anomaly['reason'] = f"This expense exceeds your ${threshold} alert threshold for this category."
-                            
-                            # Determine severity based on price
-                            if amount >= 200:
-                                alert_anomaly['severity'] = 'High'
-                            elif amount >= 100:
-                                alert_anomaly['severity'] = 'Medium'
-                            else:
-                                alert_anomaly['severity'] = 'Low'
-                                
-                            alert_anomaly['detection_method'] = "threshold_alert"  # Mark as alert-based anomaly
-                            anomalies.append(alert_anomaly)
-                            logger.info(f"Added explicit alert for transaction {tx_id}: ${amount:.2f} > ${threshold:.2f}")
-                    
-                logger.info(f"Found {len(anomalies)} anomalies in category {category_id} using {method}")
-                
-                all_anomalies.extend(anomalies)
-                category_results[category_id] = {
-                    "anomalies": anomalies,
-                    "count": len(anomalies),
-                    "method": method
-                }
-            except Exception as e:
-                logger.error(f"Error processing category {category_id}: {str(e)}")
-                logger.error(traceback.format_exc())
-                category_results[category_id] = {
-                    "error": str(e),
-                    "count": 0,
-                    "method": "error"
-                }
+        response = user_response(all_anomalies, category_results, lean_fields, output)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="user")
+        return response
+    except PoolSaturatedError as e:
+        logger.warning("Rejecting user anomaly detection: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error("Error in detect_user_anomalies: %s", e)
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/detect-user-anomalies/columns")
+async def detect_user_anomalies_columns(
+    request: Request,
+    user: Dict = Depends(verify_token),
+    lean_fields: Optional[Tuple[str, ...]] = Depends(response_view),
+    output: str = Depends(response_media_type)
+):
+    """Detect anomalies across all categories for a user from a columnar body (see columnar.py).
+    
+    Rows are grouped by their "category" column (else "categoryName"); the response is
+    the same as /detect-user-anomalies.
+    """
+    start = time.perf_counter()
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    
+    user_id = user.get('sub', 'unknown')
+    preferences = await preference_cache.get_async(user_id)
+    
+    async def detect():
+        try:
+            with STAGE_SECONDS.time(stage="ingest"):
+                data = decode_columns(body, content_type)
+                data_by_category = split_by_category(data)
+        except UnsupportedMediaTypeError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        try:
+            logger.debug("Processing columnar user anomaly detection")
+            logger.debug("Number of categories: %s", len(data_by_category))
+            TRANSACTIONS_PROCESSED.inc(sum(len(data) for data in data_by_category.values()), endpoint="user_columns")
+            
+            result = await run_user_detection(
+                detection_pool,
+                data_by_category,
+                user_id,
+                preferences.accepted_ranges,
+                preferences.alert_thresholds,
+                detect=run_user_category_detection_columns
+            )
+            cache_user_result(cache_key, result, preferences)
+            return result
+        except PoolSaturatedError as e:
+            logger.warning("Rejecting columnar user anomaly detection: %s", e)
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            logger.error("Error in detect_user_anomalies_columns: %s", e)
+            logger.error(traceback.format_exc())
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    cache_key = result_cache.make_key(user_id, f"user_columns:{media_type(content_type)}", body)
+    all_anomalies, category_results = await shared_detection("user_columns", cache_key, preferences, detect)
+    response = user_response(all_anomalies, category_results, lean_fields, output)
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="user_columns")
+    return response
+
+@app.post("/detect-category-anomalies/{category_id}/history")
+async def detect_category_anomalies_history(
+    category_id: str,
+    generation: Optional[str] = None,
+    user: Dict = Depends(verify_token),
+    lean_fields: Optional[Tuple[str, ...]] = Depends(response_view),
+    output: str = Depends(response_media_type)
+):
+    """Detect anomalies for a category of the user's stored history (see POST /history).
+    
+    Pass the generation POST /history returned: if this process doesn't hold that
+    history (restart, eviction, another worker), the request fails with 409.
+    """
+    start = time.perf_counter()
+    try:
+        user_id = user.get('sub', 'unknown')
+        generation, version, stored = transaction_history.transactions(user_id, category_id, generation)
+        transactions = stored[category_id]
+        logger.debug("Processing stored history anomaly detection for category: %s", category_id)
+        logger.debug("Number of transactions: %s", len(transactions))
+        TRANSACTIONS_PROCESSED.inc(len(transactions), endpoint="category_history")
+        
+        preferences = await preference_cache.get_async(user_id)
         
-        # Sort by severity first, then anomaly score
-        severity_order = {'High': 0, 'Medium': 1, 'Low': 2}
-        all_anomalies.sort(key=lambda x: (
-            severity_order.get(x.get('severity', 'Low'), 3),
-            -float(x.get('anomalyScore', 0))
-        ))
+        async def detect():
+            result = await detection_pool.run(
+                run_category_detection,
+                category_id,
+                transactions,
+                user_id,
+                preferences.accepted_ranges,
+                preferences.alert_thresholds
+            )
+            result_cache.put(cache_key, result, {category_id}, preferences)
+            return result
+        
+        # The stored history only changes with its version, so that is all the key needs
+        cache_key = result_cache.make_key(user_id, f"category_history:{category_id}", [generation, version])
+        result = await shared_detection("category_history", cache_key, preferences, detect)
+        count_anomalies(result.get('anomalies', []))
         
-        return AnomalyResponse(
-            anomalies=all_anomalies,
-            count=len(all_anomalies),
-            category_results=category_results
+        response = category_response(result, lean_fields, output)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="category_history")
+        return response
+    except HistoryConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PoolSaturatedError as e:
+        logger.warning("Rejecting stored history detection for category %s: %s", category_id, e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error("Error in detect_category_anomalies_history: %s", e)
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/detect-user-anomalies/history")
+async def detect_user_anomalies_history(
+    generation: Optional[str] = None,
+    user: Dict = Depends(verify_token),
+    lean_fields: Optional[Tuple[str, ...]] = Depends(response_view),
+    output: str = Depends(response_media_type)
+):
+    """Detect anomalies across all categories of the user's stored history (see POST /history).
+    
+    As for the category endpoint, a missing history or another generation returns 409.
+    """
+    start = time.perf_counter()
+    try:
+        user_id = user.get('sub', 'unknown')
+        generation, version, transactions_by_category = transaction_history.transactions(user_id, generation=generation)
+        logger.debug("Processing stored history user anomaly detection")
+        logger.debug("Number of categories: %s", len(transactions_by_category))
+        TRANSACTIONS_PROCESSED.inc(sum(len(txs) for txs in transactions_by_category.values()), endpoint="user_history")
+        
+        preferences = await preference_cache.get_async(user_id)
+        
+        async def detect():
+            result = await run_user_detection(
+                detection_pool,
+                transactions_by_category,
+                user_id,
+                preferences.accepted_ranges,
+                preferences.alert_thresholds
+            )
+            cache_user_result(cache_key, result, preferences)
+            return result
+        
+        cache_key = result_cache.make_key(user_id, "user_history", [generation, version])
+        all_anomalies, category_results = await shared_detection("user_history", cache_key, preferences, detect)
+        
+        response = user_response(all_anomalies, category_results, lean_fields, output)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="user_history")
+        return response
+    except HistoryConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PoolSaturatedError as e:
+        logger.warning("Rejecting stored history user anomaly detection: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error("Error in detect_user_anomalies_history: %s", e)
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/detect-user-anomalies/batch")
+async def detect_batch_user_anomalies(
+    request: BatchUserAnomalyRequest,
+    user: Dict = Depends(verify_token),
+    lean_fields: Optional[Tuple[str, ...]] = Depends(response_view)
+):
+    """Detect anomalies for many users, streaming one NDJSON line per user as each finishes.
+    
+    Lines are {"user_id", "anomalies", "count", "category_results"} on success or
+    {"user_id", "error", "status"} on failure, in completion order. The last line is
+    {"summary": {"users", "errors"}}, so a truncated stream can be told apart from a finished one.
+    With ?view=lean or ?fields=..., user lines are lean as in /detect-user-anomalies.
+    """
+    if len(request.users) > config.BATCH_MAX_USERS:
+        raise HTTPException(status_code=422, detail=f"At most {config.BATCH_MAX_USERS} users per request")
+    
+    start = time.perf_counter()
+    token_user_id = user.get('sub', 'unknown')
+    logger.debug("Processing batch anomaly detection for %s users", len(request.users))
+    TRANSACTIONS_PROCESSED.inc(
+        sum(len(txs) for entry in request.users for txs in entry.transactions_by_category.values()),
+        endpoint="batch"
+    )
+    
+    # Same rule as /alerts: outside dev mode a token may only scan its own user
+    allowed = []
+    forbidden = []
+    for entry in request.users:
+        if entry.user_id == token_user_id or user.get('dev_mode', False):
+            allowed.append((entry.user_id, entry.transactions_by_category))
+        else:
+            forbidden.append({"user_id": entry.user_id, "error": "Not authorized to scan this user", "status": 403})
+    
+    def encode(line: Dict[str, Any]) -> bytes:
+        with STAGE_SECONDS.time(stage="serialize"):
+            if lean_fields:
+                if "anomalies" in line:
+                    line = dict(line,
+                                anomalies=project_anomalies(line["anomalies"], lean_fields),
+                                category_results=lean_category_results(line["category_results"]))
+                return encode_json(line) + b"\n"
+            return (json.dumps(jsonable_encoder(line)) + "\n").encode()
+    
+    async def lines():
+        errors = 0
+        try:
+            for result in forbidden:
+                errors += 1
+                yield encode(result)
+            async for result in run_batch_user_detection(
+                detection_pool, allowed, preference_cache.get_async, config.BATCH_CONCURRENT_USERS
+            ):
+                if "error" in result:
+                    errors += 1
+                else:
+                    count_anomalies(result["anomalies"])
+                yield encode(result)
+            yield encode({"summary": {"users": len(request.users), "errors": errors}})
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="batch")
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/stream/transaction")
+async def stream_transaction(transaction: Transaction, user: Dict = Depends(verify_token)):
+    """Score a single new transaction against the user's running history and update it"""
+    try:
+        user_id = user.get('sub', 'unknown')
+        tx = transaction.dict(exclude_none=True)
+        preferences = await preference_cache.get_async(user_id)
+        
+        verdict = stream_detector.process(
+            user_id,
+            tx,
+            user_accepted_ranges=preferences.accepted_ranges,
+            category_alerts=preferences.alert_thresholds
         )
+        logger.info("Streamed transaction %s for user %s: anomaly=%s", verdict['transaction_id'], user_id, verdict['is_anomaly'])
+        
+        return verdict
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        logger.error(f"Error in detect_user_anomalies: {str(e)}")
+        logger.error("Error in stream_transaction: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+# Stored transaction histories, so detection requests don't have to resend them
+@app.post("/history")
+async def update_history(delta: HistoryDelta, user: Dict = Depends(verify_token)):
+    """Add new or edited transactions to the user's stored history and delete removed ones.
+    
+    Returns the history's generation, size and per-category counts. Pass the generation
+    back with the next delta; if the stored history was lost in the meantime (restart,
+    eviction), the request fails with 409 and the client should resend everything with
+    replace set.
+    """
+    user_id = user.get('sub', 'unknown')
+    try:
+        # Parsing a full re-seed's dates can take a while, so keep it off the event loop
+        summary = await asyncio.to_thread(
+            transaction_history.apply,
+            user_id,
+            delta.append,
+            delta.delete,
+            replace=delta.replace,
+            generation=delta.generation
+        )
+    except HistoryConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    logger.info("Updated stored history for user %s: %s added, %s deleted, %s stored", user_id, len(delta.append), len(delta.delete), summary['size'])
+    return summary
+
+@app.get("/history")
+async def get_history(user: Dict = Depends(verify_token)):
+    """Generation, size and per-category counts of the user's stored history"""
+    summary = transaction_history.summary(user.get('sub', 'unknown'))
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No stored history for this user")
+    return summary
+
+@app.delete("/history")
+async def delete_history(user: Dict = Depends(verify_token)):
+    """Forget the user's stored history"""
+    transaction_history.clear(user.get('sub', 'unknown'))
+    return {"success": True}
+
 # User feedback management
 @app.post("/feedback")
 async def process_feedback(feedback: AnomalyFeedback, user: Dict = Depends(verify_token)):
     """Process user feedback on anomaly detection"""
     try:
-        logger.info(f"Processing user feedback for transaction {feedback.transaction_id}")
-        logger.info(f"Feedback: is_normal={feedback.is_normal}, set_alert={feedback.set_alert}")
+        logger.debug("Processing user feedback for transaction %s", feedback.transaction_id)
+        logger.debug("Feedback: is_normal=%s, set_alert=%s", feedback.is_normal, feedback.set_alert)
         
         # Get user ID from token
         user_id = user.get('sub', 'unknown')
         
-        # Store user-accepted spending patterns
-        if feedback.is_normal:
-            # Store this range as accepted for this user and category
-            try:
-                # Create user feedback directory if it doesn't exist
-                user_dir = f"data/user_feedback/{user_id}"
-                os.makedirs(user_dir, exist_ok=True)
-                
-                # Load existing accepted ranges or create new
-                accepted_ranges_file = f"{user_dir}/accepted_ranges.json"
-                accepted_ranges = {}
-                
-                if os.path.exists(accepted_ranges_file):
-                    with open(accepted_ranges_file, 'r') as f:
-                        accepted_ranges = json.load(f)
-                
-                # Get the current range
-                current_range = get_range_for_amount(feedback.anomaly_amount)
-                
-                # Determine all ranges that should be accepted (all ranges up to and including current range)
-                ranges_order = ["low", "medium_low", "medium", "high", "very_high", "extreme"]
-                range_index = ranges_order.index(current_range)
-                
-                # Mark this range and all lower ranges as accepted
-                # This means if a user marks a $200 transaction as normal, we'll also accept $180, etc.
-                for i in range(range_index + 1):
-                    range_key = f"{feedback.category}_{ranges_order[i]}"
-                    accepted_ranges[range_key] = True
-                    logger.info(f"Marking range {range_key} as normal based on user feedback")
-                    
-                # Save updated accepted ranges
-                with open(accepted_ranges_file, 'w') as f:
-                    json.dump(accepted_ranges, f)
-                    
-                logger.info(f"Updated accepted ranges for user {user_id}: {range_key}")
-                updated_model = True
-                
-                # Check if we need to update alert thresholds
-                # If user marks a transaction as normal, and that transaction would exceed their current threshold,
-                # we should increase the threshold to avoid future false positives
-                try:
-                    alerts_dir = f"data/alerts/{user_id}"
-                    alerts_file = f"{alerts_dir}/category_alerts.json"
-                    
-                    if os.path.exists(alerts_file):
-                        with open(alerts_file, 'r') as f:
-                            alerts = json.load(f)
-                        
-                        # Find the alert for this category if it exists
-                        alert_modified = False
-                        for alert in alerts:
-                            if alert.get('category') == feedback.category:
-                                current_threshold = alert.get('threshold', 0)
-                                # If this "normal" transaction exceeds the threshold, raise the threshold
-                                if feedback.anomaly_amount > current_threshold:
-                                    # Round up to nearest $5 for a better user experience
-                                    new_threshold = math.ceil(feedback.anomaly_amount / 5) * 5
-                                    alert['threshold'] = new_threshold
-                                    logger.info(f"Automatically increased threshold for {feedback.category} from ${current_threshold} to ${new_threshold} based on user feedback")
-                                    alert_modified = True
-                        
-                        # Save if modified
-                        if alert_modified:
-                            with open(alerts_file, 'w') as f:
-                                json.dump(alerts, f)
-                except Exception as e:
-                    logger.error(f"Error updating alert threshold from feedback: {str(e)}")
-            except Exception as e:
-                logger.error(f"Error saving user feedback: {str(e)}")
-                updated_model = False
-        else:
-            # User confirmed this is not normal
-            updated_model = False
-        
-        # Set spending alert if requested
-        alert_set = False
-        if feedback.set_alert and feedback.alert_threshold:
-            try:
-                # Create alerts directory if it doesn't exist
-                alerts_dir = f"data/alerts/{user_id}"
-                os.makedirs(alerts_dir, exist_ok=True)
-                
-                # Load existing alerts or create new
-                alerts_file = f"{alerts_dir}/category_alerts.json"
-                category_alerts = []
-                
-                if os.path.exists(alerts_file):
-                    with open(alerts_file, 'r') as f:
-                        category_alerts = json.load(f)
-                
-                # Add or update alert for this category
-                alert_exists = False
-                for alert in category_alerts:
-                    if alert.get('category') == feedback.category:
-                        alert['threshold'] = feedback.alert_threshold
-                        alert['active'] = True
-                        alert_exists = True
-                        break
-                
-                if not alert_exists:
-                    category_alerts.append({
-                        "category": feedback.category,
-                        "threshold": feedback.alert_threshold,
-                        "active": True
-                    })
-                
-                # Save updated alerts
-                with open(alerts_file, 'w') as f:
-                    json.dump(category_alerts, f)
-                    
-                # Log more detailed information about the alert threshold
-                logger.info(f"Set spending alert for user {user_id}, category {feedback.category}: ${feedback.alert_threshold}")
-                logger.info(f"Transactions below ${feedback.alert_threshold} in {feedback.category} will NOT be flagged as anomalies")
-                alert_set = True
-            except Exception as e:
-                logger.error(f"Error setting spending alert: {str(e)}")
-                alert_set = False
+        # Queue the feedback; bursts for the same user are merged into one locked, atomic write
+        # that also invalidates the cached preferences
+        updated_model, alert_set = await feedback_writer.submit(user_id, feedback)
         
         return AnomalyFeedbackResponse(
             success=True,
@@ -552,7 +814,31 @@ async def process_feedback(feedback: AnomalyFeedback, user: Dict = Depends(verif
             alert_set=alert_set
         )
     except Exception as e:
-        logger.error(f"Error processing feedback: {str(e)}")
+        logger.error("Error processing feedback: %s", e)
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/feedback/batch")
+async def process_feedback_batch(batch: AnomalyFeedbackBatch, user: Dict = Depends(verify_token)):
+    """Process feedback on many anomalies at once, saving the user's preferences a single time"""
+    if len(batch.items) > config.FEEDBACK_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=422, detail=f"At most {config.FEEDBACK_BATCH_MAX_ITEMS} feedback items per request")
+    try:
+        user_id = user.get('sub', 'unknown')
+        logger.debug("Processing %s feedback items for user %s", len(batch.items), user_id)
+        
+        results = await feedback_writer.submit_many(user_id, batch.items)
+        
+        return AnomalyFeedbackBatchResponse(
+            success=True,
+            message=f"Processed {len(results)} feedback items",
+            results=[
+                FeedbackItemResult(transaction_id=feedback.transaction_id, updated_model=updated_model, alert_set=alert_set)
+                for feedback, (updated_model, alert_set) in zip(batch.items, results)
+            ]
+        )
+    except Exception as e:
+        logger.error("Error processing feedback batch: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -565,36 +851,13 @@ async def get_user_alerts(user_id: str, user: Dict = Depends(verify_token)):
         if token_user_id != user_id and not user.get('dev_mode', False):
             raise HTTPException(status_code=403, detail="Not authorized to access this user's alerts")
         
-        alerts_file = f"data/alerts/{user_id}/category_alerts.json"
-        if not os.path.exists(alerts_file):
-            return {"alerts": []}
-            
-        with open(alerts_file, 'r') as f:
-            alerts = json.load(f)
-            
-        return {"alerts": alerts}
+        preferences = await preference_cache.get_async(user_id)
+        return {"alerts": preferences.alerts}
     except Exception as e:
-        logger.error(f"Error getting user alerts: {str(e)}")
+        logger.error("Error getting user alerts: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
-def get_range_for_amount(amount: float) -> str:
-    """Get the spending range for a given amount"""
-    ranges = {
-        "low": (0, 50),
-        "medium_low": (50, 100),
-        "medium": (100, 150),
-        "high": (150, 200),
-        "very_high": (200, 300),
-        "extreme": (300, float('inf'))
-    }
-    
-    for range_name, (min_val, max_val) in ranges.items():
-        if min_val <= amount < max_val:
-            return range_name
-    
-    return "extreme"  # Default if no range matches
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
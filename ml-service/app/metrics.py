@@ -0,0 +1,271 @@
+"""In-process metrics with Prometheus text exposition, served by GET /metrics.
+
+Detection jobs may run in worker processes, whose metric updates would never reach
+the parent. Inside DetectionPool jobs, updates are therefore recorded into a batch
+(see collect()) that travels back with the job's result and is applied by the parent
+with registry.apply(). Everywhere else they update the registry directly.
+"""
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+# (metric name, label values, value) updates recorded inside a detection job
+MetricUpdate = Tuple[str, LabelValues, float]
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_batch: ContextVar[Optional[List[MetricUpdate]]] = ContextVar("metrics_batch", default=None)
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _record(self, values: LabelValues, amount: float) -> None:
+        batch = _batch.get()
+        if batch is not None:
+            batch.append((self.name, values, amount))
+        else:
+            self._apply(values, amount)
+
+    @abstractmethod
+    def _apply(self, values: LabelValues, amount: float) -> None:
+        """Add a recorded amount to the series for these label values"""
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        """(name suffix, label values, value) for every series, as rendered"""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, value in self.samples():
+            names = self.label_names + (("le",) if suffix == "_bucket" else ())
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        self._record(self._label_values(labels), amount)
+
+    def _apply(self, values: LabelValues, amount: float) -> None:
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        with self._lock:
+            if not self._values and not self.label_names:
+                return [("", (), 0)]
+            return [("", values, value) for values, value in sorted(self._values.items())]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        self._record(self._label_values(labels), value)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe the duration of the with-block, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _apply(self, values: LabelValues, amount: float) -> None:
+        with self._lock:
+            counts = self._counts.get(values)
+            if counts is None:
+                counts = self._counts[values] = [0] * (len(self.buckets) + 1)
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._sums[values] = self._sums.get(values, 0.0) + amount
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            counts = self._counts.get(self._label_values(labels))
+            return counts[-1] if counts else 0
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        samples = []
+        with self._lock:
+            for values in sorted(self._counts):
+                counts = self._counts[values]
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    samples.append(("_bucket", values + (_format_value(bound),), count))
+                samples.append(("_sum", values, self._sums[values]))
+                samples.append(("_count", values, counts[-1]))
+        return samples
+
+class Gauge(Metric):
+    """A value read at scrape time from a callback returning {label values: value} or a single number"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Callable[[], Any], labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def _apply(self, values: LabelValues, amount: float) -> None:
+        raise TypeError(f"{self.name} is a gauge; its value comes from its callback")
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        value = self.callback()
+        if isinstance(value, dict):
+            return [("", tuple(str(v) for v in key), float(v)) for key, v in sorted(value.items())]
+        return [("", (), float(value))]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable[[], Any], labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, callback, labels))
+
+    def apply(self, updates: List[MetricUpdate]) -> None:
+        """Apply updates recorded by a detection job (possibly in another process)"""
+        for name, values, amount in updates:
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric._apply(values, amount)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def collect(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Tuple[Any, List[MetricUpdate]]:
+    """Run fn, returning its result and the metric updates it made instead of applying them"""
+    updates: List[MetricUpdate] = []
+    token = _batch.set(updates)
+    try:
+        return fn(*args, **kwargs), updates
+    finally:
+        _batch.reset(token)
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "detection_stage_seconds",
+    "Time spent in each detection stage (ingest, parse, features, fit, score, postprocess, serialize)",
+    labels=("stage",)
+)
+REQUEST_SECONDS = registry.histogram(
+    "detection_request_seconds",
+    "End-to-end handling time of detection requests",
+    labels=("endpoint",)
+)
+TRANSACTIONS_PROCESSED = registry.counter(
+    "detection_transactions_processed_total",
+    "Transactions received by detection endpoints",
+    labels=("endpoint",)
+)
+ANOMALIES_FLAGGED = registry.counter(
+    "detection_anomalies_flagged_total",
+    "Anomalies returned, by detection method",
+    labels=("detection_method",)
+)
+SLIDING_WINDOW_FALLBACKS = registry.counter(
+    "detection_sliding_window_fallbacks_total",
+    "Categories that fell back to sliding-window detection"
+)
+MODEL_CACHE_LOOKUPS = registry.counter(
+    "model_cache_lookups_total",
+    "Fitted Isolation Forest cache lookups, summed over all detection workers",
+    labels=("result",)
+)
+
+RESULT_CACHE_LOOKUPS = registry.counter(
+    "result_cache_lookups_total",
+    "Detection result cache lookups",
+    labels=("endpoint", "result")
+)
+
+DETECTIONS_COALESCED = registry.counter(
+    "detection_coalesced_total",
+    "Detection requests that shared an identical detection already in flight",
+    labels=("endpoint",)
+)
+
+def _model_cache_hit_ratio() -> float:
+    hits = MODEL_CACHE_LOOKUPS.value(result="hit")
+    lookups = hits + MODEL_CACHE_LOOKUPS.value(result="miss")
+    return hits / lookups if lookups else 0.0
+
+registry.gauge("model_cache_hit_ratio", "Share of model cache lookups that were hits", _model_cache_hit_ratio)
+
+class StageTimer:
+    """Times consecutive stages: each mark(stage) observes the time since the previous mark"""
+
+    def __init__(self, histogram: Histogram = STAGE_SECONDS):
+        self.histogram = histogram
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.histogram.observe(now - self._last, stage=stage)
+        self._last = now
+
+def count_anomalies(anomalies: List[Dict[str, Any]]) -> None:
+    """Count returned anomalies by their detection method"""
+    counts: Dict[str, int] = {}
+    for anomaly in anomalies:
+        method = anomaly.get('detection_method') or anomaly.get('detectionMethod') or 'unknown'
+        counts[method] = counts.get(method, 0) + 1
+    for method, count in counts.items():
+        ANOMALIES_FLAGGED.inc(count, detection_method=method)
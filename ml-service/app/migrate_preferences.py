@@ -0,0 +1,66 @@
+"""Import preferences from the per-user JSON layout into the SQLite backend.
+
+Usage:
+    python -m app.migrate_preferences [--data-dir data] [--db data/preferences.db] [--batch-size 500]
+
+Safe to re-run: each migrated user's rows are replaced with the JSON values.
+"""
+import argparse
+import logging
+from typing import List, Optional
+
+from .storage import JsonPreferenceStore, SqlitePreferenceStore
+
+logger = logging.getLogger("ml-service")
+
+def migrate(data_dir: str, db_path: str, batch_size: int = 500) -> int:
+    """Copy every user's accepted ranges and alerts into SQLite, batch_size users per transaction.
+
+    A user whose JSON can't be read or whose preferences the database rejects is
+    logged and skipped; the rest of their batch is still imported.
+    """
+    source = JsonPreferenceStore(data_dir)
+    target = SqlitePreferenceStore(db_path)
+    migrated = 0
+    skipped = 0
+    batch = []
+
+    def flush() -> None:
+        nonlocal migrated, skipped
+        imported, failed = target.import_users(batch)
+        migrated += imported
+        skipped += len(failed)
+        for user_id, error in failed.items():
+            logger.error("Skipping user %s: %s", user_id, error)
+        batch.clear()
+
+    try:
+        for user_id in source.iter_users():
+            try:
+                batch.append((user_id, source.load_accepted_ranges(user_id), source.load_alerts(user_id)))
+            except Exception as e:
+                logger.error("Skipping user %s: %s", user_id, e)
+                skipped += 1
+                continue
+            if len(batch) >= batch_size:
+                flush()
+                logger.info("Migrated %s users", migrated)
+        if batch:
+            flush()
+    finally:
+        target.close()
+    logger.info("Migrated preferences for %s users from %s to %s (%s skipped)", migrated, data_dir, db_path, skipped)
+    return migrated
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Import per-user JSON preferences into SQLite")
+    parser.add_argument("--data-dir", default="data", help="Directory holding user_feedback/ and alerts/")
+    parser.add_argument("--db", default="data/preferences.db", help="SQLite database to write")
+    parser.add_argument("--batch-size", type=int, default=500, help="Users written per transaction")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    migrate(args.data_dir, args.db, args.batch_size)
+
+if __name__ == "__main__":
+    main()
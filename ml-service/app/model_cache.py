@@ -0,0 +1,84 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from . import config
+
+def fingerprint_features(features: np.ndarray) -> str:
+    """Hash a feature matrix (values, shape and dtype) into a short hex digest."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((features.shape, features.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(features).tobytes())
+    return digest.hexdigest()
+
+class ModelCache:
+    """Thread-safe LRU cache of fitted models with a per-entry time-to-live.
+
+    Entries are evicted least-recently-used first once max_size is reached, and
+    treated as missing once they are older than ttl_seconds.
+    """
+
+    def __init__(self, max_size: int = 256, ttl_seconds: float = 600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(user_id: Optional[str], category: Optional[str], features: np.ndarray) -> Tuple[Optional[str], Optional[str], str]:
+        return (user_id, category, fingerprint_features(features))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                # Expired - drop it and count as a miss
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+# Shared cache of fitted Isolation Forest models
+model_cache = ModelCache(
+    max_size=config.MODEL_CACHE_MAX_SIZE,
+    ttl_seconds=config.MODEL_CACHE_TTL_SECONDS,
+)
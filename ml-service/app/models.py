@@ -22,6 +22,15 @@ class TransactionList(BaseModel):
     """Request model for user anomaly detection"""
     transactions_by_category: Dict[str, List[Dict[str, Any]]]
 
+class UserTransactions(BaseModel):
+    """One user's transactions within a batch detection request"""
+    user_id: str
+    transactions_by_category: Dict[str, List[Dict[str, Any]]]
+
+class BatchUserAnomalyRequest(BaseModel):
+    """Request model for detecting anomalies for many users in one call"""
+    users: List[UserTransactions]
+
 class AnomalyResponse(BaseModel):
     """Response model for anomaly detection"""
     anomalies: List[Dict[str, Any]]
@@ -50,4 +59,27 @@ class AnomalyFeedbackResponse(BaseModel):
     success: bool
     message: str
     updated_model: bool = False
-    alert_set: bool = False
\ No newline at end of file
+    alert_set: bool = False
+
+class AnomalyFeedbackBatch(BaseModel):
+    """Request model for several feedback items submitted together"""
+    items: List[AnomalyFeedback]
+
+class FeedbackItemResult(BaseModel):
+    """Outcome of one item in a batch feedback request"""
+    transaction_id: str
+    updated_model: bool = False
+    alert_set: bool = False
+
+class AnomalyFeedbackBatchResponse(BaseModel):
+    """Response model for batch feedback processing, with one result per item in request order"""
+    success: bool
+    message: str
+    results: List[FeedbackItemResult]
+
+class HistoryDelta(BaseModel):
+    """Changes to a user's stored transaction history (see history.py)"""
+    append: List[Dict[str, Any]] = []  # New or edited transactions, each with an id
+    delete: List[str] = []  # Ids of transactions to remove
+    replace: bool = False  # Discard the stored history first, e.g. to re-seed it
+    generation: Optional[str] = None  # Generation the client last saw; a mismatch returns 409
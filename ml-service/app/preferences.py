@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from . import config
+from .storage import PreferenceStore, preference_store
+
+logger = logging.getLogger("ml-service")
+
+class UserPreferences(NamedTuple):
+    """A user's feedback-derived settings. Shared between requests, so treat as read-only."""
+    accepted_ranges: Dict[str, bool]
+    alerts: List[Dict[str, Any]]
+    alert_thresholds: Dict[str, float]  # Active alerts as {category: threshold}
+
+class PreferenceCache:
+    """Read-through LRU cache of per-user accepted ranges and category alerts.
+
+    Entries are revalidated against the store's version token on every read (file
+    mtime and size for JSON, a version row for SQLite), and can be dropped explicitly
+    with invalidate() after the service writes.
+    """
+
+    def __init__(self, store: PreferenceStore, max_size: int = 10000):
+        self.store = store
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[Hashable, UserPreferences]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_cached(self, user_id: str) -> Optional[UserPreferences]:
+        """Return the cached preferences if they haven't changed since they were loaded"""
+        version = self.store.version(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            return None
+
+    def get(self, user_id: str) -> UserPreferences:
+        """Return the user's preferences, reading the store on a miss"""
+        cached = self.get_cached(user_id)
+        if cached is not None:
+            return cached
+
+        version = self.store.version(user_id)
+        try:
+            accepted_ranges = self.store.load_accepted_ranges(user_id)
+        except Exception as e:
+            logger.error("Error loading user accepted ranges: %s", e)
+            accepted_ranges = {}
+        try:
+            alerts = self.store.load_alerts(user_id)
+        except Exception as e:
+            logger.error("Error loading user alerts: %s", e)
+            alerts = []
+        alert_thresholds = {
+            alert.get('category'): alert.get('threshold')
+            for alert in alerts if alert.get('active', True)
+        }
+        preferences = UserPreferences(accepted_ranges, alerts, alert_thresholds)
+        logger.info("Loaded %d accepted ranges and %d active alerts for user %s", len(accepted_ranges), len(alert_thresholds), user_id)
+
+        with self._lock:
+            self.misses += 1
+            self._entries[user_id] = (version, preferences)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return preferences
+
+    async def get_async(self, user_id: str) -> UserPreferences:
+        """Like get(), but store reads on a miss happen off the event loop"""
+        cached = self.get_cached(user_id)
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self.get, user_id)
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+# Shared cache of user preferences for the detection and alert endpoints
+preference_cache = PreferenceCache(preference_store, max_size=config.PREFERENCE_CACHE_SIZE)
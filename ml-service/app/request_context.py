@@ -0,0 +1,56 @@
+"""Per-request id, attached to every log record emitted while handling the request."""
+import logging
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+class RequestIdFilter(logging.Filter):
+    """Stamps record.request_id from the current context (None outside a request)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+class RequestIdMiddleware:
+    """ASGI middleware: reuse the caller's X-Request-ID or generate one, and echo it on the response"""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+
+        async def send_with_request_id(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode(), request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+def call_with_request_id(request_id: Optional[str], fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run fn with request_id set; used to carry the id into executor threads and worker processes"""
+    token = request_id_var.set(request_id)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        request_id_var.reset(token)
@@ -0,0 +1,175 @@
+"""Lean detection responses: projected anomaly fields, no duplication, fast JSON encoding.
+
+Full responses return every anomaly as a complete copy of its transaction, once in
+"anomalies" and again under "category_results", and go through jsonable_encoder.
+Lean responses (?view=lean, or ?fields=...) keep only the requested anomaly fields,
+list each anomaly once, and are encoded directly with orjson when it is installed.
+
+Detection responses can also be MessagePack or an Arrow IPC stream, chosen by the
+request's Accept header (see negotiate); JSON stays the default.
+"""
+import json
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt, the json fallback is just slower
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - only needed for MessagePack bodies
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - only needed for Arrow bodies
+    pa = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+
+# Other names clients use for the same formats
+MEDIA_TYPE_ALIASES = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    "application/vnd.apache.arrow": ARROW_STREAM,
+}
+
+# Response formats in order of preference for wildcard Accept headers
+RESPONSE_MEDIA_TYPES = (JSON, MSGPACK, ARROW_STREAM)
+
+# Anomaly fields returned by ?view=lean when no ?fields= are given
+LEAN_FIELDS = ("id", "amount", "date", "category", "anomalyScore", "severity", "reason", "detection_method")
+
+def parse_view(view: Optional[str], fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Anomaly fields to keep, or None for the full response. Raises ValueError for an unknown view."""
+    if view not in (None, "full", "lean"):
+        raise ValueError(f"Unknown view {view!r}, expected 'full' or 'lean'")
+    if fields:
+        return tuple(field.strip() for field in fields.split(",") if field.strip())
+    if view == "lean":
+        return LEAN_FIELDS
+    return None
+
+def project_anomalies(anomalies: List[Dict[str, Any]], fields: Sequence[str]) -> List[Dict[str, Any]]:
+    """Keep only `fields` of each anomaly; fields an anomaly doesn't have are left out"""
+    return [{field: anomaly[field] for field in fields if field in anomaly} for anomaly in anomalies]
+
+def lean_result(result: Dict[str, Any], fields: Sequence[str]) -> Dict[str, Any]:
+    """A category detection result with projected anomalies"""
+    lean = dict(result)
+    if "anomalies" in lean:
+        lean["anomalies"] = project_anomalies(lean["anomalies"], fields)
+    return lean
+
+def lean_category_results(category_results: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-category results without their anomaly lists, which the top-level "anomalies" already holds"""
+    return {
+        category_id: {key: value for key, value in result.items() if key != "anomalies"}
+        for category_id, result in category_results.items()
+    }
+
+def media_type(content_type: Optional[str]) -> str:
+    """The bare, lower-cased media type of a Content-Type or Accept entry, with aliases resolved"""
+    name = (content_type or "").split(";", 1)[0].strip().lower()
+    return MEDIA_TYPE_ALIASES.get(name, name)
+
+def available(media_type: str) -> bool:
+    """Whether the library for a binary format is installed"""
+    if media_type == MSGPACK:
+        return msgpack is not None
+    if media_type in (ARROW_STREAM, ARROW_FILE):
+        return pa is not None
+    return True
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """Response media type for an Accept header, or None if none of its types can be produced.
+    
+    The first listed type we support wins (q-values other than q=0 are not compared);
+    JSON when the header is missing or only has wildcards.
+    """
+    if not accept:
+        return JSON
+    for entry in accept.split(","):
+        name, *params = entry.split(";")
+        q = next((param.split("=", 1)[1] for param in params if param.strip().startswith("q=")), "1")
+        try:
+            if float(q) <= 0:
+                continue
+        except ValueError:
+            continue
+        name = media_type(name)
+        if name in ("*/*", "application/*"):
+            return JSON
+        if name in RESPONSE_MEDIA_TYPES and available(name):
+            return name
+    return None
+
+def _default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return _default(value)
+
+def encode_json(content: Any) -> bytes:
+    """Encode plain dicts/lists (numpy scalars allowed) without pydantic or jsonable_encoder"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+def encode_msgpack(content: Any) -> bytes:
+    """MessagePack encoding of the same plain data encode_json takes; dates become ISO strings"""
+    return msgpack.packb(content, default=_msgpack_default)
+
+def _arrow_column(values: List[Any]) -> "pa.Array":
+    try:
+        return pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed types (say amounts sent as numbers and as strings): fall back to strings, JSON for nested values
+        return pa.array([
+            None if value is None else value if isinstance(value, str) else encode_json(value).decode()
+            for value in values
+        ], type=pa.string())
+
+def encode_arrow(content: Dict[str, Any]) -> bytes:
+    """An Arrow IPC stream with one row per anomaly; the other top-level fields go, as JSON, in the schema metadata.
+    
+    The metadata key is "detection". category_results are stripped of their anomaly lists,
+    since every anomaly is already a row.
+    """
+    anomalies = content.get("anomalies", [])
+    names = list(dict.fromkeys(name for anomaly in anomalies for name in anomaly))
+    table = pa.table({name: _arrow_column([anomaly.get(name) for anomaly in anomalies]) for name in names})
+    rest = {key: value for key, value in content.items() if key != "anomalies"}
+    if isinstance(rest.get("category_results"), dict):
+        rest["category_results"] = lean_category_results(rest["category_results"])
+    table = table.replace_schema_metadata({"detection": encode_json(rest)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def encode_binary(content: Any, media_type: str) -> bytes:
+    """Encode a detection response as MSGPACK or ARROW_STREAM"""
+    if media_type == ARROW_STREAM:
+        return encode_arrow(content)
+    return encode_msgpack(content)
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
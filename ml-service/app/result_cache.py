@@ -0,0 +1,165 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Hashable, Iterable, NamedTuple, Optional, Set, Tuple
+
+from . import config
+from .anomaly_detection import SPENDING_RANGES
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt, the json fallback is just slower
+    orjson = None
+
+def canonical_digest(payload: Any) -> str:
+    """Hash a request payload independently of key order: raw bytes as they are, anything else as sorted-key JSON"""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        digest.update(payload)
+    elif orjson is not None:
+        digest.update(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS))
+    else:
+        digest.update(json.dumps(payload, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+def preference_version(preferences: Any, categories: Iterable[Hashable]) -> str:
+    """Fingerprint of the parts of a user's preferences that detection reads for these categories.
+
+    That is each category's accepted spending ranges and alert threshold, so feedback on
+    one category leaves cached results for the others valid.
+    """
+    relevant = []
+    for category in sorted(categories, key=str):
+        ranges = [name for name in SPENDING_RANGES if preferences.accepted_ranges.get(f"{category}_{name}")]
+        relevant.append((str(category), ranges, preferences.alert_thresholds.get(category)))
+    return hashlib.blake2b(repr(relevant).encode(), digest_size=16).hexdigest()
+
+def _estimate_size(value: Any) -> int:
+    try:
+        if orjson is not None:
+            return len(orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS))
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+class _Entry(NamedTuple):
+    stored_at: float
+    categories: FrozenSet[Hashable]
+    version: str
+    value: Any
+    size: int
+
+class ResultCache:
+    """Thread-safe LRU cache of complete detection results, bounded by size and age.
+
+    Keys are (user_id, hash of the endpoint and canonical request). Each entry remembers
+    the categories it covers and the preference_version it was computed under, and is
+    served only while the user's current preferences give the same version. Entries
+    are evicted least-recently-used first once max_bytes (measured as encoded JSON) or
+    max_entries is exceeded, and treated as missing once older than ttl_seconds, since
+    detection weighs transactions by how recent they are.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20, ttl_seconds: float = 300, max_entries: int = 1024):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._by_user: Dict[str, Set[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(user_id: str, scope: str, payload: Any) -> Tuple[str, str]:
+        """scope names the endpoint and any parameters (category id, content type) the payload doesn't include"""
+        return (user_id, canonical_digest([scope, canonical_digest(payload)]))
+
+    def get(self, key: Tuple[str, str], preferences: Any) -> Optional[Any]:
+        """The cached result, if it is fresh and the user's preferences for its categories haven't changed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if (time.monotonic() - entry.stored_at <= self.ttl_seconds
+                        and entry.version == preference_version(preferences, entry.categories)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.value
+                self._remove(key)
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: Tuple[str, str], value: Any, categories: Iterable[Hashable], preferences: Any) -> None:
+        """Cache a result. Treat it as read-only from here on, since later requests share it."""
+        if self.max_bytes <= 0 or self.max_entries <= 0:
+            return
+        categories = frozenset(categories)
+        entry = _Entry(time.monotonic(), categories, preference_version(preferences, categories), value,
+                       _estimate_size(value))
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._by_user.setdefault(key[0], set()).add(key)
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, user_id: str, categories: Optional[Iterable[Hashable]] = None) -> int:
+        """Drop a user's results that cover any of these categories (all of them if None). Returns how many."""
+        categories = None if categories is None else set(categories)
+        with self._lock:
+            stale = [
+                key for key in self._by_user.get(user_id, ())
+                if categories is None or not categories.isdisjoint(self._entries[key].categories)
+            ]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        keys = self._by_user[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_user[key[0]]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+# Shared cache of detection endpoint results
+result_cache = ResultCache(
+    max_bytes=int(config.RESULT_CACHE_MAX_MB * 2**20),
+    ttl_seconds=config.RESULT_CACHE_TTL_SECONDS,
+    max_entries=config.RESULT_CACHE_MAX_ENTRIES,
+)
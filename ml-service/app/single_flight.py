@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger("ml-service")
+
+class SingleFlight:
+    """Runs at most one computation per key at a time; callers with the same key share its result.
+
+    The first caller for a key starts compute() as a task, and anyone calling run() with
+    that key before it finishes awaits the same task instead of starting another. Results
+    and exceptions are shared alike. The task is shielded, so a caller that disconnects
+    doesn't cancel the work for the others. Keys are forgotten as soon as the task
+    finishes: this only merges concurrent calls, caching is left to the caller.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._in_flight
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the exception as retrieved, in case every caller went away before it was raised
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Shared computation failed: %r", task.exception())
+
+# Concurrent identical requests to the detection endpoints
+detection_flights = SingleFlight()
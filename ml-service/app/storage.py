@@ -0,0 +1,277 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from . import config
+
+logger = logging.getLogger("ml-service")
+
+class PreferenceStore(ABC):
+    """Persists per-user accepted spending ranges and category alerts.
+
+    Accepted ranges are {"<category>_<range>": bool}; alerts are a list of
+    {"category", "threshold", "active"} dicts with at most one per category.
+    """
+
+    @abstractmethod
+    def version(self, user_id: str) -> Hashable:
+        """A token that changes whenever the user's preferences change (used for cache validation)"""
+
+    @abstractmethod
+    def load_accepted_ranges(self, user_id: str) -> Dict[str, bool]:
+        """The user's accepted ranges, empty if they have none"""
+
+    @abstractmethod
+    def load_alerts(self, user_id: str) -> List[Dict[str, Any]]:
+        """The user's alerts in the order they were created, empty if they have none"""
+
+    @abstractmethod
+    def accept_ranges(self, user_id: str, range_keys: Iterable[str]) -> None:
+        """Mark the given range keys as normal spending for the user"""
+
+    @abstractmethod
+    def upsert_alerts(self, user_id: str, alerts: Iterable[Dict[str, Any]]) -> None:
+        """Add alerts, replacing any existing alert for the same category"""
+
+    def close(self) -> None:
+        pass
+
+def _merge_alerts(existing: List[Dict[str, Any]], updates: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Apply upserts to an alert list, keeping the original order of existing categories"""
+    merged = [dict(alert) for alert in existing]
+    positions = {alert.get('category'): i for i, alert in enumerate(merged)}
+    for alert in updates:
+        category = alert.get('category')
+        if category in positions:
+            merged[positions[category]].update(alert)
+        else:
+            positions[category] = len(merged)
+            merged.append(dict(alert))
+    return merged
+
+class JsonPreferenceStore(PreferenceStore):
+    """The original layout: one directory and JSON file per user under data/. Handy for development."""
+
+    def __init__(self, root: str = "data"):
+        self.root = root
+
+    def accepted_ranges_path(self, user_id: str) -> str:
+        return os.path.join(self.root, "user_feedback", user_id, "accepted_ranges.json")
+
+    def category_alerts_path(self, user_id: str) -> str:
+        return os.path.join(self.root, "alerts", user_id, "category_alerts.json")
+
+    @staticmethod
+    def _file_version(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _read(path: str, default: Any) -> Any:
+        if not os.path.exists(path):
+            return default
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write(path: str, data: Any) -> None:
+        """Write via a temp file and rename, so readers and crashes never see half a file"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def version(self, user_id: str) -> Hashable:
+        return (self._file_version(self.accepted_ranges_path(user_id)),
+                self._file_version(self.category_alerts_path(user_id)))
+
+    def load_accepted_ranges(self, user_id: str) -> Dict[str, bool]:
+        return self._read(self.accepted_ranges_path(user_id), {})
+
+    def load_alerts(self, user_id: str) -> List[Dict[str, Any]]:
+        return self._read(self.category_alerts_path(user_id), [])
+
+    def accept_ranges(self, user_id: str, range_keys: Iterable[str]) -> None:
+        accepted_ranges = self.load_accepted_ranges(user_id)
+        accepted_ranges.update((key, True) for key in range_keys)
+        self._write(self.accepted_ranges_path(user_id), accepted_ranges)
+
+    def upsert_alerts(self, user_id: str, alerts: Iterable[Dict[str, Any]]) -> None:
+        merged = _merge_alerts(self.load_alerts(user_id), alerts)
+        self._write(self.category_alerts_path(user_id), merged)
+
+    def iter_users(self) -> List[str]:
+        """Every user with a feedback or alerts directory"""
+        users = set()
+        for subdir in ("user_feedback", "alerts"):
+            path = os.path.join(self.root, subdir)
+            if os.path.isdir(path):
+                users.update(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+        return sorted(users)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS accepted_ranges (
+    user_id TEXT NOT NULL,
+    range_key TEXT NOT NULL,
+    accepted INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (user_id, range_key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS category_alerts (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    threshold REAL,
+    active INTEGER NOT NULL DEFAULT 1
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_category_alerts_user ON category_alerts (user_id, category);
+
+CREATE TABLE IF NOT EXISTS preference_versions (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+class SqlitePreferenceStore(PreferenceStore):
+    """All users in one SQLite database in WAL mode, so reads never block on writers.
+
+    Each thread gets its own connection. Every write runs in a single transaction
+    and bumps a per-user version row, which the preference cache checks.
+    """
+
+    def __init__(self, path: str = "data/preferences.db"):
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection, user_ids: Iterable[str]) -> None:
+        conn.executemany(
+            "INSERT INTO preference_versions (user_id, version) VALUES (?, 1) "
+            "ON CONFLICT(user_id) DO UPDATE SET version = version + 1",
+            ((user_id,) for user_id in user_ids)
+        )
+
+    def version(self, user_id: str) -> Hashable:
+        row = self._connection().execute(
+            "SELECT version FROM preference_versions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def load_accepted_ranges(self, user_id: str) -> Dict[str, bool]:
+        rows = self._connection().execute(
+            "SELECT range_key, accepted FROM accepted_ranges WHERE user_id = ?", (user_id,)
+        )
+        return {range_key: bool(accepted) for range_key, accepted in rows}
+
+    def load_alerts(self, user_id: str) -> List[Dict[str, Any]]:
+        rows = self._connection().execute(
+            "SELECT category, threshold, active FROM category_alerts WHERE user_id = ? ORDER BY id", (user_id,)
+        )
+        return [{"category": category, "threshold": threshold, "active": bool(active)}
+                for category, threshold, active in rows]
+
+    def _write_ranges(self, conn: sqlite3.Connection, user_id: str, accepted_ranges: Dict[str, bool]) -> None:
+        conn.executemany(
+            "INSERT INTO accepted_ranges (user_id, range_key, accepted) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id, range_key) DO UPDATE SET accepted = excluded.accepted",
+            ((user_id, key, int(bool(accepted))) for key, accepted in accepted_ranges.items())
+        )
+
+    def _write_alerts(self, conn: sqlite3.Connection, user_id: str, alerts: Iterable[Dict[str, Any]]) -> None:
+        # Upserting in place keeps the row id, so alerts keep the order they were created in
+        conn.executemany(
+            "INSERT INTO category_alerts (user_id, category, threshold, active) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id, category) DO UPDATE SET threshold = excluded.threshold, active = excluded.active",
+            ((user_id, alert.get('category'), alert.get('threshold'), int(bool(alert.get('active', True))))
+             for alert in alerts)
+        )
+
+    def accept_ranges(self, user_id: str, range_keys: Iterable[str]) -> None:
+        with self._connection() as conn:
+            self._write_ranges(conn, user_id, dict.fromkeys(range_keys, True))
+            self._bump_version(conn, [user_id])
+
+    def upsert_alerts(self, user_id: str, alerts: Iterable[Dict[str, Any]]) -> None:
+        with self._connection() as conn:
+            self._write_alerts(conn, user_id, alerts)
+            self._bump_version(conn, [user_id])
+
+    def import_users(self, users: Iterable[Tuple[str, Dict[str, bool], List[Dict[str, Any]]]]
+                     ) -> Tuple[int, Dict[str, str]]:
+        """Replace the stored preferences of (user_id, accepted_ranges, alerts) records in one transaction.
+
+        Each user's rows are deleted and rewritten under their own savepoint, so ranges
+        and alerts missing from a record are removed, and a record the database rejects
+        is rolled back alone. Returns the imported user count and the error per failed user.
+        """
+        count = 0
+        user_ids = []
+        failed: Dict[str, str] = {}
+        with self._connection() as conn:
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            for user_id, accepted_ranges, alerts in users:
+                conn.execute("SAVEPOINT import_user")
+                try:
+                    conn.execute("DELETE FROM accepted_ranges WHERE user_id = ?", (user_id,))
+                    conn.execute("DELETE FROM category_alerts WHERE user_id = ?", (user_id,))
+                    self._write_ranges(conn, user_id, accepted_ranges)
+                    self._write_alerts(conn, user_id, alerts)
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO import_user")
+                    failed[user_id] = str(e)
+                else:
+                    user_ids.append(user_id)
+                    count += 1
+                conn.execute("RELEASE import_user")
+            self._bump_version(conn, user_ids)
+        return count, failed
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+def create_preference_store(backend: str, json_root: str = "data", sqlite_path: str = "data/preferences.db") -> PreferenceStore:
+    if backend == "json":
+        return JsonPreferenceStore(json_root)
+    if backend == "sqlite":
+        return SqlitePreferenceStore(sqlite_path)
+    raise ValueError(f"Unknown preference backend: {backend!r} (expected 'json' or 'sqlite')")
+
+# Shared store for user preferences
+preference_store = create_preference_store(config.PREFERENCE_BACKEND, sqlite_path=config.PREFERENCE_DB_PATH)
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, Optional, Tuple
+
+from .anomaly_detection import currency_symbol_for, get_range_for_amount
+from .category_stats import category_key
+
+logger = logging.getLogger("ml-service")
+
+SNAPSHOT_VERSION = 1
+
+class CategoryStreamState:
+    """Running statistics for one user's category.
+
+    Welford's algorithm tracks the mean/variance of every amount seen, and a bounded
+    buffer holds the most recent amounts for sliding-window scoring. Updates cost O(1)
+    regardless of how much history has been seen.
+    """
+
+    def __init__(self, window_size: int):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.window: Deque[float] = deque(maxlen=window_size)
+
+    def update(self, amount: float) -> None:
+        self.count += 1
+        delta = amount - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (amount - self.mean)
+        self.window.append(amount)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.count) if self.count > 1 else 0.0
+
+    def window_stats(self) -> Tuple[float, float]:
+        """Mean and population std of the recent window (bounded size, so constant time)"""
+        n = len(self.window)
+        mean = sum(self.window) / n
+        return mean, math.sqrt(sum((x - mean) ** 2 for x in self.window) / n)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "window": list(self.window)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], window_size: int) -> "CategoryStreamState":
+        state = cls(window_size)
+        state.count = int(data["count"])
+        state.mean = float(data["mean"])
+        state.m2 = float(data["m2"])
+        state.window.extend(float(x) for x in data["window"])
+        return state
+
+class StreamingDetector:
+    """Scores transactions one at a time against per-user, per-category running state.
+
+    Uses the sliding-window rule: a transaction is anomalous when it exceeds the mean
+    of the recent window by more than 2.5 standard deviations. Each transaction is
+    scored against the state *before* it, then folded into that state, so callers
+    should push transactions in date order. Beyond max_states, the least recently
+    updated category state is dropped.
+    """
+
+    def __init__(self, window_size: int = 10, min_window: int = 5, max_states: int = 100000):
+        self.window_size = window_size
+        self.min_window = min_window
+        self.max_states = max_states
+        self._states: "OrderedDict[Tuple[str, Hashable], CategoryStreamState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.updates_since_snapshot = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def process(self, user_id: str, transaction: Dict[str, Any],
+                user_accepted_ranges: Optional[Dict[str, bool]] = None,
+                category_alerts: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """Score one transaction and update the running state. Returns the verdict."""
+        user_accepted_ranges = user_accepted_ranges or {}
+        category_alerts = category_alerts or {}
+
+        amount = float(transaction.get('amount', 0))
+        if math.isnan(amount):
+            raise ValueError("Transaction amount is not a number")
+        category = category_key(transaction)
+        currency_symbol = currency_symbol_for([transaction.get('currency')])
+
+        with self._lock:
+            state = self._states.get((user_id, category))
+            if state is None:
+                state = self._states[(user_id, category)] = CategoryStreamState(self.window_size)
+                while len(self._states) > self.max_states:
+                    self._states.popitem(last=False)
+            else:
+                self._states.move_to_end((user_id, category))
+
+            anomaly = None
+            window_mean = window_std = None
+            if len(state.window) >= self.min_window:
+                window_mean, window_std = state.window_stats()
+
+            # User preferences win over the statistics, as in batch detection
+            threshold = category_alerts.get(category)
+            accepted = user_accepted_ranges.get(f"{category}_{get_range_for_amount(abs(amount))}", False)
+
+            if threshold is not None and abs(amount) > threshold:
+                anomaly = transaction.copy()
+                anomaly['anomalyScore'] = 0.7
+                anomaly['reason'] = f"This expense exceeds your {currency_symbol}{threshold:.2f} alert threshold for {transaction.get('categoryName', 'this category')}."
+                anomaly['severity'] = 'High' if abs(amount) >= 200 else 'Medium' if abs(amount) >= 100 else 'Low'
+                anomaly['detectionMethod'] = 'threshold'
+            elif (threshold is None and not accepted and window_std
+                  and amount > window_mean + 2.5 * window_std):
+                score = (amount - window_mean) / window_std
+                category_name = transaction.get("categoryName", "")
+                if score > 5:
+                    reason = f"This expense of {currency_symbol}{amount:.2f} is extremely high compared to your typical {category_name} spending of around {currency_symbol}{window_mean:.2f}."
+                elif score > 3:
+                    reason = f"This expense is significantly higher than your average {category_name} spending from this time period."
+                else:
+                    reason = f"This {category_name} expense is higher than your typical spending pattern at the time."
+
+                anomaly = transaction.copy()
+                anomaly['anomalyScore'] = score
+                anomaly['reason'] = reason
+                anomaly['severity'] = 'High' if score > 5 else 'Medium' if score > 3 else 'Low'
+                anomaly['detectionMethod'] = 'streaming_window'
+
+            verdict = {
+                "transaction_id": transaction.get('id'),
+                "category": category,
+                "is_anomaly": anomaly is not None,
+                "anomaly": anomaly,
+                "window_mean": window_mean,
+                "window_std": window_std,
+                "category_avg": state.mean if state.count else None,
+                "category_std": state.std if state.count else None,
+                "history_count": state.count,
+            }
+
+            state.update(amount)
+            self.updates_since_snapshot += 1
+
+        return verdict
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._snapshot()
+
+    def _snapshot(self, reset_updates: bool = False) -> Dict[str, Any]:
+        # Only plain values are copied under the lock; building the dicts happens outside it
+        with self._lock:
+            rows = [(key, state.count, state.mean, state.m2, tuple(state.window))
+                    for key, state in self._states.items()]
+            if reset_updates:
+                self.updates_since_snapshot = 0
+        return {
+            "version": SNAPSHOT_VERSION,
+            "window_size": self.window_size,
+            "states": [
+                {"user_id": user_id, "category": category, "count": count, "mean": mean, "m2": m2, "window": list(window)}
+                for (user_id, category), count, mean, m2, window in rows
+            ],
+        }
+
+    def save(self, path: str) -> None:
+        """Write a snapshot atomically (temp file + rename) so a crash never leaves half a file"""
+        with self._save_lock:
+            snapshot = self._snapshot(reset_updates=True)
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        logger.info("Saved streaming snapshot with %d category states to %s", len(snapshot['states']), path)
+
+    def load(self, path: str) -> None:
+        """Restore state from a snapshot, if one exists"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r') as f:
+            snapshot = json.load(f)
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logger.warning("Ignoring streaming snapshot %s with unknown version %s", path, snapshot.get('version'))
+            return
+        # Snapshots list states least recently updated first, so the newest are kept
+        states = OrderedDict(
+            ((entry["user_id"], entry["category"]), CategoryStreamState.from_dict(entry, self.window_size))
+            for entry in snapshot["states"][-self.max_states:]
+        )
+        with self._lock:
+            self._states = states
+            self.updates_since_snapshot = 0
+        logger.info("Loaded streaming snapshot with %d category states from %s", len(states), path)
+
+    async def snapshot_periodically(self, path: str, every: int, interval_seconds: float) -> None:
+        """Save a snapshot, off the event loop, whenever at least `every` updates have
+        piled up; checked every interval_seconds until cancelled. Requests never wait on it.
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            if self.updates_since_snapshot < every:
+                continue
+            try:
+                await asyncio.to_thread(self.save, path)
+            except Exception as e:
+                logger.error("Error saving streaming snapshot: %s", e)
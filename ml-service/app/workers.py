@@ -0,0 +1,84 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from . import config
+from .logging_setup import worker_initializer
+from .metrics import collect, registry
+from .request_context import call_with_request_id, request_id_var
+
+logger = logging.getLogger("ml-service")
+
+class PoolSaturatedError(Exception):
+    """Raised when the detection pool already has max_pending jobs queued or running"""
+
+class DetectionPool:
+    """Runs CPU-bound detection off the event loop on a process or thread pool.
+    
+    Each process worker keeps its own model cache, so repeat requests only hit
+    the cache when they land on the same worker.
+    """
+
+    def __init__(self, kind: str = "process", max_workers: int = 1, max_pending: int = 64):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown detection executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # Spawn rather than fork: the parent has running threads (uvicorn, log handlers)
+                initializer, initargs = worker_initializer()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=initializer,
+                    initargs=initargs
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="detection"
+                )
+            logger.info("Started %s detection pool with %d workers", self.kind, self.max_workers)
+        return self._executor
+
+    def check_capacity(self, jobs: int = 1) -> None:
+        """Raise PoolSaturatedError unless `jobs` more jobs fit under max_pending."""
+        if self.pending + jobs > self.max_pending:
+            raise PoolSaturatedError(f"Detection queue is full ({self.pending} jobs pending)")
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run fn(*args, **kwargs) on the pool and await its result."""
+        self.check_capacity()
+        
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            # Carry the request id along so the job's log lines can be traced back to the request,
+            # and bring the job's metric updates back, since a worker process can't apply them itself
+            job = functools.partial(call_with_request_id, request_id_var.get(), collect, fn, *args, **kwargs)
+            result, metric_updates = await loop.run_in_executor(self._get_executor(), job)
+            registry.apply(metric_updates)
+            return result
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+# Shared pool used by the detection endpoints, started on first use
+detection_pool = DetectionPool(
+    kind=config.DETECTION_EXECUTOR,
+    max_workers=config.DETECTION_WORKERS,
+    max_pending=config.DETECTION_MAX_PENDING,
+)
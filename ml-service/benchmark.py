@@ -0,0 +1,283 @@
+"""Micro-benchmarks for the detection engine.
+
+Times every public function in app/anomaly_detection.py and both detection endpoints, with list and
+columnar bodies (through an in-process ASGI client), on deterministic synthetic histories, and reports
+throughput and peak memory per case. Results are written as JSON; pass --baseline to
+fail (exit 1) when a case got slower or hungrier than a stored run.
+
+Usage:
+    python benchmark.py [--sizes 100,1000,10000] [--categories 1,10,50] [--users 3]
+                        [--output benchmark-results.json] [--baseline baseline.json]
+
+Sizes up to 1e6 transactions are supported; the endpoint cases at that size take a while.
+Repeats cycle through the users' histories, with a fresh user id per call so fitted models are never reused.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+from fastapi import Header
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import anomaly_detection, main as service
+from app.columnar import columns_from_arrays, to_columns
+from app.logging_setup import configure_logging
+from app.model_cache import model_cache
+
+logger = logging.getLogger("benchmark")
+
+BASE_DATE = datetime(2024, 1, 1)
+ANOMALY_RATE = 0.01
+
+def generate_history(num_transactions: int, num_categories: int, seed: int) -> List[Dict[str, Any]]:
+    """Deterministic synthetic history: per-category normal spending plus ~1% large outliers, over a year"""
+    rng = random.Random(seed)
+    profiles = [(rng.uniform(10, 200), rng.uniform(0.05, 0.3)) for _ in range(num_categories)]
+    transactions = []
+    for i in range(num_transactions):
+        category = i % num_categories
+        mean, spread = profiles[category]
+        amount = rng.gauss(mean, mean * spread)
+        if rng.random() < ANOMALY_RATE:
+            amount *= rng.uniform(5, 15)
+        date = BASE_DATE + timedelta(minutes=rng.randrange(365 * 24 * 60))
+        transactions.append({
+            "id": f"tx-{seed}-{i}",
+            "amount": round(max(amount, 1.0), 2),
+            "date": date.strftime("%Y-%m-%d"),
+            "category": f"cat{category}",
+            "categoryName": f"Category {category}",
+            "description": f"Purchase {i}",
+            "type": "expense",
+        })
+    return transactions
+
+def group_by_category(transactions: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    grouped = defaultdict(list)
+    for tx in transactions:
+        grouped[tx["category"]].append(tx)
+    return dict(grouped)
+
+def function_cases(history: List[Dict[str, Any]]) -> Dict[str, Callable[[str], Any]]:
+    """One call per public function of app/anomaly_detection.py on this history, taking the user id"""
+    columns = anomaly_detection.extract_feature_columns(history)
+    amounts = np.abs(columns["amount"])
+    raw_amounts = [tx["amount"] for tx in history]
+    raw_dates = [tx["date"] for tx in history]
+    dates, has_date = anomaly_detection.parse_dates(raw_dates)
+    data = columns_from_arrays(to_columns(history))
+    currencies = [tx.get("currency") for tx in history]
+    category = history[0]["category"]
+    anomaly = max(history, key=lambda tx: tx["amount"])
+    return {
+        "preprocess_transactions": lambda user_id: anomaly_detection.preprocess_transactions(history),
+        "currency_symbol_for": lambda user_id: anomaly_detection.currency_symbol_for(currencies),
+        "parse_amounts": lambda user_id: anomaly_detection.parse_amounts(raw_amounts),
+        "parse_dates": lambda user_id: anomaly_detection.parse_dates(raw_dates),
+        "feature_columns_from_parsed":
+            lambda user_id: anomaly_detection.feature_columns_from_parsed(amounts, dates, has_date),
+        "extract_feature_columns": lambda user_id: anomaly_detection.extract_feature_columns(history),
+        "feature_matrix": lambda user_id: anomaly_detection.feature_matrix(columns),
+        "preprocess_transactions_for_isolation_forest":
+            lambda user_id: anomaly_detection.preprocess_transactions_for_isolation_forest(history),
+        "generate_anomaly_reason": lambda user_id: anomaly_detection.generate_anomaly_reason(anomaly, history),
+        "detect_anomalies_isolation_forest":
+            lambda user_id: anomaly_detection.detect_anomalies_isolation_forest(history, user_id=user_id, category_id=category),
+        "detect_anomalies_isolation_forest_columns":
+            lambda user_id: anomaly_detection.detect_anomalies_isolation_forest_columns(data, user_id=user_id, category_id=category),
+        "get_range_indices": lambda user_id: anomaly_detection.get_range_indices(amounts),
+        "get_range_for_amount": lambda user_id: [anomaly_detection.get_range_for_amount(a) for a in amounts.tolist()],
+        "parse_transaction_dates": lambda user_id: anomaly_detection.parse_transaction_dates(history),
+        "rolling_window_stats": lambda user_id: anomaly_detection.rolling_window_stats(amounts, 10),
+        "detect_anomalies_sliding_window": lambda user_id: anomaly_detection.detect_anomalies_sliding_window(history),
+    }
+
+def endpoint_cases(client: Any, history: List[Dict[str, Any]]) -> Dict[str, Callable[[str], Any]]:
+    """Calls to the detection endpoints (list and columnar bodies) as the given user, returning a coroutine that checks for a 200"""
+    category = history[0]["category"]
+    by_category = group_by_category(history)
+    columns = to_columns(history)
+    category_columns = to_columns(by_category[category])
+
+    async def post(url: str, payload: Dict[str, Any], user_id: str) -> None:
+        headers = {"Authorization": "Bearer benchmark", "X-Benchmark-User": user_id}
+        response = await client.post(url, json=payload, headers=headers)
+        response.raise_for_status()
+
+    return {
+        "POST /detect-category-anomalies":
+            lambda user_id: post(f"/detect-category-anomalies/{category}", {"transactions": history}, user_id),
+        "POST /detect-user-anomalies":
+            lambda user_id: post("/detect-user-anomalies", {"transactions_by_category": by_category}, user_id),
+        "POST /detect-category-anomalies/columns":
+            lambda user_id: post(f"/detect-category-anomalies/{category}/columns", {"columns": category_columns}, user_id),
+        "POST /detect-user-anomalies/columns":
+            lambda user_id: post("/detect-user-anomalies/columns", {"columns": columns}, user_id),
+    }
+
+def measure(run: Callable[[int], Any], repeat: int) -> Dict[str, float]:
+    """Median/min wall time over `repeat` calls of run(i) after one warm-up call, then peak traced memory of one more.
+
+    Peak memory is traced in this process only, so detection jobs run on a process pool are not included.
+    """
+    run(0)
+    times = []
+    for i in range(1, repeat + 1):
+        model_cache.clear()
+        start = time.perf_counter()
+        run(i)
+        times.append(time.perf_counter() - start)
+
+    model_cache.clear()
+    tracemalloc.start()
+    try:
+        run(repeat + 1)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"median_seconds": statistics.median(times), "min_seconds": min(times), "peak_memory_bytes": peak}
+
+def run_benchmarks(sizes: List[int], category_counts: List[int], users: int, repeat: int,
+                   endpoints: bool = True, seed: int = 0) -> Dict[str, Any]:
+    """Run every case and return the results document written by --output"""
+    results = []
+    loop = asyncio.new_event_loop()
+    client = _endpoint_client() if endpoints else None
+    try:
+        for size in sizes:
+            for num_categories in category_counts:
+                histories = [generate_history(size, num_categories, seed + user) for user in range(users)]
+
+                # Inputs are prepared up front so only the call itself is timed. Every call gets a
+                # fresh user id, so models cached by earlier calls (also in pool workers) never match.
+                functions = [function_cases(history) for history in histories]
+                for name in functions[0]:
+                    run = lambda i, name=name: functions[i % users][name](_user_id(size, num_categories, name, i))
+                    results.append(_result(name, "function", size, num_categories, measure(run, repeat)))
+
+                if client is not None:
+                    requests = [endpoint_cases(client, history) for history in histories]
+                    for name in requests[0]:
+                        run = lambda i, name=name: loop.run_until_complete(
+                            requests[i % users][name](_user_id(size, num_categories, name, i)))
+                        results.append(_result(name, "endpoint", size, num_categories, measure(run, repeat)))
+    finally:
+        if client is not None:
+            loop.run_until_complete(client.aclose())
+            _close_endpoint_client()
+        loop.close()
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "detection_executor": os.environ.get("DETECTION_EXECUTOR", "process"),
+        },
+        "parameters": {"sizes": sizes, "categories": category_counts, "users": users,
+                       "repeat": repeat, "seed": seed},
+        "results": results,
+    }
+
+def _user_id(size: int, num_categories: int, case: str, call: int) -> str:
+    return f"bench-{size}-{num_categories}-{case}-{call}"
+
+def _result(name: str, kind: str, size: int, num_categories: int, stats: Dict[str, float]) -> Dict[str, Any]:
+    result = {
+        "case": name,
+        "kind": kind,
+        "transactions": size,
+        "categories": num_categories,
+        **stats,
+        "transactions_per_second": size / stats["median_seconds"] if stats["median_seconds"] else None,
+    }
+    logger.info("%s n=%s categories=%s: %.4fs median, %.0f tx/s, peak %.1f MiB",
+                name, size, num_categories, stats["median_seconds"],
+                result["transactions_per_second"] or 0, stats["peak_memory_bytes"] / 2**20)
+    return result
+
+def _endpoint_client() -> Any:
+    """httpx client bound to the FastAPI app, with auth replaced by a per-request benchmark user"""
+    async def benchmark_user(x_benchmark_user: str = Header(...)):
+        return {"sub": x_benchmark_user, "dev_mode": True}
+
+    service.app.dependency_overrides[service.verify_token] = benchmark_user
+    transport = httpx.ASGITransport(app=service.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None)
+
+def _close_endpoint_client() -> None:
+    service.app.dependency_overrides.clear()
+    service.detection_pool.shutdown()
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.25) -> List[str]:
+    """Regressions against a baseline run: cases more than `tolerance` slower or using more peak memory"""
+    def key(result):
+        return (result["case"], result["transactions"], result["categories"])
+
+    previous = {key(result): result for result in baseline.get("results", [])}
+    regressions = []
+    for result in results["results"]:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        label = f"{result['case']} (n={result['transactions']}, categories={result['categories']})"
+        for metric in ("median_seconds", "peak_memory_bytes"):
+            if old[metric] and result[metric] > old[metric] * (1 + tolerance):
+                regressions.append(f"{label}: {metric} {old[metric]:.4g} -> {result[metric]:.4g}")
+    return regressions
+
+def _int_list(value: str) -> List[int]:
+    return [int(float(item)) for item in value.split(",") if item.strip()]
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the anomaly detection engine")
+    parser.add_argument("--sizes", type=_int_list, default=[100, 1000, 10000],
+                        help="Transactions per history, comma separated (1e2 to 1e6)")
+    parser.add_argument("--categories", type=_int_list, default=[1, 10, 50], help="Category counts, comma separated")
+    parser.add_argument("--users", type=int, default=3, help="Distinct synthetic users (histories) per case")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed calls per case")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic histories")
+    parser.add_argument("--no-endpoints", action="store_true", help="Only benchmark the detection functions")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Results file to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown/memory growth vs baseline")
+    args = parser.parse_args(argv)
+
+    # Detection logs at INFO would dominate the timings of small cases
+    configure_logging(level="WARNING", logger_levels={"benchmark": "INFO"})
+
+    results = run_benchmarks(args.sizes, args.categories, args.users, args.repeat,
+                             endpoints=not args.no_endpoints, seed=args.seed)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info("Wrote %s results to %s", len(results["results"]), args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            logger.error("Regression: %s", regression)
+        if regressions:
+            return 1
+        logger.info("No regressions against %s", args.baseline)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
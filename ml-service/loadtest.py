@@ -0,0 +1,299 @@
+"""Load generator for the service: many concurrent clients with a configurable request mix.
+
+Drives app.main:app in-process through httpx's ASGI transport (default), a uvicorn
+server launched locally (--launch), or an already running server (--url). Reports
+p50/p95/p99 latency, throughput and error rate overall and per request kind.
+
+Usage:
+    python loadtest.py [--concurrency 32] [--requests 2000 | --duration 60]
+                       [--mix category=4,user=1,feedback=3,alerts=2]
+                       [--transactions 200] [--categories 10] [--users 50]
+                       [--launch --workers 4] [--output loadtest-results.json]
+
+In-process and --launch runs keep preferences in a temporary SQLite database, so
+feedback traffic does not touch data/. In-process runs also give every simulated user
+their own identity; against a server (DEV_MODE), all requests authenticate as test-user.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+
+import httpx
+from fastapi import Header
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.logging_setup import configure_logging
+from benchmark import generate_history, group_by_category
+
+logger = logging.getLogger("loadtest")
+
+REQUEST_KINDS = ("category", "user", "feedback", "alerts")
+DEFAULT_MIX = "category=4,user=1,feedback=3,alerts=2"
+
+class Sample(NamedTuple):
+    kind: str
+    status: str  # HTTP status code, or the exception name when no response came back
+    latency: float
+    ok: bool
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse "kind=weight,..." into {kind: weight}; kinds are category, user, feedback and alerts"""
+    mix = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise ValueError(f"Unknown request kind {kind!r}, expected one of {', '.join(REQUEST_KINDS)}")
+        mix[kind] = float(weight) if weight.strip() else 1.0
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("Request mix needs at least one kind with a positive weight")
+    return mix
+
+class RequestFactory:
+    """Builds requests for simulated users, each with a fixed synthetic history of `transactions` items"""
+
+    def __init__(self, users: int, transactions: int, categories: int, seed: int = 0):
+        self.user_ids = [f"load-user-{u}" for u in range(users)]
+        self.histories = {
+            user_id: group_by_category(generate_history(transactions, categories, seed + u))
+            for u, user_id in enumerate(self.user_ids)
+        }
+
+    def build(self, kind: str, rng: random.Random) -> Dict[str, Any]:
+        """httpx request() keyword arguments for one request of this kind, sent as a random simulated user"""
+        user_id = rng.choice(self.user_ids)
+        history = self.histories[user_id]
+        category = rng.choice(list(history))
+        if kind == "category":
+            request = {"method": "POST", "url": f"/detect-category-anomalies/{category}",
+                       "json": {"transactions": history[category]}}
+        elif kind == "user":
+            request = {"method": "POST", "url": "/detect-user-anomalies",
+                       "json": {"transactions_by_category": history}}
+        elif kind == "feedback":
+            tx = rng.choice(history[category])
+            set_alert = rng.random() < 0.3
+            request = {"method": "POST", "url": "/feedback", "json": {
+                "transaction_id": tx["id"],
+                "user_id": user_id,
+                "is_normal": rng.random() < 0.7,
+                "anomaly_amount": tx["amount"],
+                "category": category,
+                "set_alert": set_alert,
+                "alert_threshold": round(tx["amount"] * 1.5, 2) if set_alert else None,
+            }}
+        else:
+            request = {"method": "GET", "url": f"/alerts/{user_id}"}
+        request["headers"] = {"Authorization": "Bearer loadtest", "X-Load-User": user_id}
+        return request
+
+async def run_load(client: httpx.AsyncClient, factory: RequestFactory, mix: Dict[str, float],
+                   concurrency: int, total_requests: Optional[int] = None,
+                   duration: Optional[float] = None, seed: int = 0) -> List[Sample]:
+    """Send requests from `concurrency` clients until total_requests are sent or duration seconds pass"""
+    if total_requests is None and duration is None:
+        raise ValueError("Pass total_requests or duration")
+    kinds, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + duration if duration is not None else None
+    issued = 0
+    samples: List[Sample] = []
+
+    async def client_loop(worker: int) -> None:
+        nonlocal issued
+        rng = random.Random(seed * 1000 + worker)
+        while True:
+            if total_requests is not None and issued >= total_requests:
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            issued += 1
+            kind = rng.choices(kinds, weights)[0]
+            request = factory.build(kind, rng)
+            start = time.perf_counter()
+            try:
+                response = await client.request(**request)
+                status, ok = str(response.status_code), response.is_success
+            except Exception as e:
+                status, ok = type(e).__name__, False
+            samples.append(Sample(kind, status, time.perf_counter() - start, ok))
+
+    await asyncio.gather(*(client_loop(worker) for worker in range(concurrency)))
+    return samples
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+def _summary(samples: List[Sample], elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(sample.latency for sample in samples)
+    errors = sum(1 for sample in samples if not sample.ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000,
+        },
+        "status_codes": dict(Counter(sample.status for sample in samples)),
+    }
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict[str, Any]:
+    """Overall and per-kind latency percentiles, throughput and error rates"""
+    by_kind = defaultdict(list)
+    for sample in samples:
+        by_kind[sample.kind].append(sample)
+    return {
+        "elapsed_seconds": elapsed,
+        "overall": _summary(samples, elapsed),
+        "by_kind": {kind: _summary(kind_samples, elapsed) for kind, kind_samples in sorted(by_kind.items())},
+    }
+
+@asynccontextmanager
+async def asgi_client(db_path: str, timeout: float) -> AsyncIterator[httpx.AsyncClient]:
+    """Client for app.main:app in this process, with a throwaway preference store and per-user auth"""
+    from app import main
+    from app.feedback import FeedbackWriter
+    from app.preferences import PreferenceCache
+    from app.storage import SqlitePreferenceStore
+
+    store = SqlitePreferenceStore(db_path)
+    cache = PreferenceCache(store)
+    # Feedback must still drop the app's cached detection results, or reads after it see stale anomalies
+    writer = FeedbackWriter(store, cache, coalesce_seconds=main.feedback_writer.coalesce_seconds,
+                            result_cache=main.result_cache)
+    saved = (main.preference_cache, main.feedback_writer)
+
+    async def load_user(x_load_user: str = Header(...)):
+        return {"sub": x_load_user, "dev_mode": True}
+
+    main.preference_cache, main.feedback_writer = cache, writer
+    main.app.dependency_overrides[main.verify_token] = load_user
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout) as client:
+            yield client
+        await writer.drain()
+    finally:
+        main.app.dependency_overrides.pop(main.verify_token, None)
+        main.preference_cache, main.feedback_writer = saved
+        store.close()
+
+def launch_server(port: int, workers: int, db_path: str) -> subprocess.Popen:
+    """Start uvicorn on app.main:app and wait until /ready answers"""
+    env = dict(os.environ, PREFERENCE_BACKEND="sqlite", PREFERENCE_DB_PATH=db_path, LOG_LEVEL="WARNING")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not become ready within 60 seconds")
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _run(args: argparse.Namespace, mix: Dict[str, float], factory: RequestFactory,
+               db_path: str) -> Dict[str, Any]:
+    server = None
+    url = args.url
+    if args.launch:
+        port = _free_port()
+        server = launch_server(port, args.workers, db_path)
+        url = f"http://127.0.0.1:{port}"
+    try:
+        if url:
+            client_context = httpx.AsyncClient(
+                base_url=url, timeout=args.timeout,
+                limits=httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            )
+        else:
+            client_context = asgi_client(db_path, args.timeout)
+        async with client_context as client:
+            start = time.perf_counter()
+            samples = await run_load(client, factory, mix, args.concurrency,
+                                     total_requests=None if args.duration else args.requests,
+                                     duration=args.duration, seed=args.seed)
+            elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+    return summarize(samples, elapsed)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the anomaly detection service")
+    parser.add_argument("--concurrency", type=int, default=32, help="Simultaneous clients")
+    parser.add_argument("--requests", type=int, default=2000, help="Total requests to send")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds instead of --requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Relative weights of category, user, feedback and alerts requests")
+    parser.add_argument("--transactions", type=int, default=200, help="Transactions in each simulated user's history")
+    parser.add_argument("--categories", type=int, default=10, help="Categories in each history")
+    parser.add_argument("--users", type=int, default=50, help="Simulated users")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for histories and request choices")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--url", help="Load-test a running server instead of the in-process app")
+    parser.add_argument("--launch", action="store_true", help="Start uvicorn locally and load-test it")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes with --launch")
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    # The app logs every request at INFO, which would dominate an in-process run
+    configure_logging(level="WARNING", logger_levels={"loadtest": "INFO"})
+
+    mix = parse_mix(args.mix)
+    factory = RequestFactory(args.users, args.transactions, args.categories, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        report = asyncio.run(_run(args, mix, factory, os.path.join(tmp, "preferences.db")))
+    report["parameters"] = {key: value for key, value in vars(args).items() if key != "output"}
+
+    overall = report["overall"]
+    logger.info("%s requests in %.1fs: %.1f req/s, %.2f%% errors, p50 %.1fms p95 %.1fms p99 %.1fms",
+                overall["requests"], report["elapsed_seconds"], overall["throughput_rps"],
+                overall["error_rate"] * 100, overall["latency_ms"]["p50"],
+                overall["latency_ms"]["p95"], overall["latency_ms"]["p99"])
+    for kind, summary in report["by_kind"].items():
+        logger.info("  %-8s %5s requests, %.2f%% errors, p50 %.1fms p95 %.1fms p99 %.1fms, statuses %s",
+                    kind, summary["requests"], summary["error_rate"] * 100, summary["latency_ms"]["p50"],
+                    summary["latency_ms"]["p95"], summary["latency_ms"]["p99"], summary["status_codes"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
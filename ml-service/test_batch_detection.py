@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import config, detection, main
+from app.workers import DetectionPool
+from benchmark import generate_history, group_by_category
+
+def batch_payload(user_ids, transactions=40):
+    return {"users": [
+        {"user_id": user_id, "transactions_by_category": group_by_category(generate_history(transactions, 2, seed))}
+        for seed, user_id in enumerate(user_ids)
+    ]}
+
+def post_batch(client, payload):
+    response = client.post("/detect-user-anomalies/batch", json=payload, headers={"Authorization": "Bearer test"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_one_line_per_user_and_inline_errors(monkeypatch):
+    """Every user gets a line, a failing user doesn't sink the batch, and a summary line ends the stream"""
+    pool = DetectionPool(kind="thread", max_workers=2)
+    monkeypatch.setattr(main, "detection_pool", pool)
+
+    run_user_detection = detection.run_user_detection
+
+    async def flaky_run_user_detection(pool, transactions_by_category, user_id, *args):
+        if user_id == "broken":
+            raise RuntimeError("model exploded")
+        return await run_user_detection(pool, transactions_by_category, user_id, *args)
+
+    monkeypatch.setattr(detection, "run_user_detection", flaky_run_user_detection)
+    try:
+        lines = post_batch(TestClient(main.app), batch_payload(["alice", "broken", "bob"]))
+    finally:
+        pool.shutdown()
+
+    *results, summary = lines
+    assert summary == {"summary": {"users": 3, "errors": 1}}
+    by_user = {result["user_id"]: result for result in results}
+    assert set(by_user) == {"alice", "broken", "bob"}
+    assert by_user["broken"] == {"user_id": "broken", "error": "model exploded", "status": 500}
+    for user_id in ("alice", "bob"):
+        assert by_user[user_id]["count"] == len(by_user[user_id]["anomalies"])
+        assert set(by_user[user_id]["category_results"]) == {"cat0", "cat1"}
+
+def test_other_users_need_dev_mode(monkeypatch):
+    pool = DetectionPool(kind="thread", max_workers=1)
+    monkeypatch.setattr(main, "detection_pool", pool)
+
+    async def regular_user():
+        return {"sub": "alice"}
+
+    main.app.dependency_overrides[main.verify_token] = regular_user
+    try:
+        lines = post_batch(TestClient(main.app), batch_payload(["alice", "mallory"]))
+    finally:
+        main.app.dependency_overrides.clear()
+        pool.shutdown()
+
+    by_user = {line.get("user_id"): line for line in lines}
+    assert by_user["mallory"]["status"] == 403
+    assert "anomalies" in by_user["alice"]
+
+def test_too_many_users_is_rejected(monkeypatch):
+    monkeypatch.setattr(config, "BATCH_MAX_USERS", 2)
+    response = TestClient(main.app).post("/detect-user-anomalies/batch", json=batch_payload(["a", "b", "c"], transactions=5),
+                                         headers={"Authorization": "Bearer test"})
+    assert response.status_code == 422
@@ -0,0 +1,26 @@
+import os
+import sys
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from benchmark import compare, generate_history, run_benchmarks
+
+def test_histories_are_deterministic():
+    first = generate_history(500, 5, seed=7)
+    assert first == generate_history(500, 5, seed=7)
+    assert first != generate_history(500, 5, seed=8)
+    assert {tx["category"] for tx in first} == {f"cat{i}" for i in range(5)}
+
+def test_results_and_regression_gate():
+    results = run_benchmarks([60], [2], users=2, repeat=1, endpoints=False)
+    cases = {result["case"] for result in results["results"]}
+    assert {"detect_anomalies_isolation_forest", "detect_anomalies_isolation_forest_columns", "detect_anomalies_sliding_window",
+            "extract_feature_columns", "parse_amounts", "parse_dates", "feature_columns_from_parsed"} <= cases
+    for result in results["results"]:
+        assert result["transactions"] == 60 and result["peak_memory_bytes"] >= 0
+
+    assert compare(results, results) == []
+    faster = {"results": [dict(result, median_seconds=result["median_seconds"] / 2) for result in results["results"]]}
+    regressions = compare(results, faster, tolerance=0.25)
+    assert len(regressions) == len(results["results"])
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.category_stats import CategoryStats
+from app.anomaly_detection import generate_anomaly_reason
+
+def test_groupby_matches_numpy():
+    """Per-category stats agree with computing each group by hand"""
+    transactions = [
+        {"category": "dining", "amount": 30},
+        {"category": "dining", "amount": -50},  # Refund-style negative amounts count by magnitude
+        {"category": "dining", "amount": "40"},
+        {"categoryName": "Travel", "amount": 400},
+        {"category": "dining", "amount": "n/a"},  # Ignored
+    ]
+
+    stats = CategoryStats.from_transactions(transactions)
+
+    dining = stats.summary("dining")
+    assert dining["count"] == 3
+    assert np.isclose(dining["mean"], np.mean([30, 50, 40]))
+    assert np.isclose(dining["std"], np.std([30, 50, 40]))
+    assert dining["median"] == 40 and dining["min"] == 30 and dining["max"] == 50
+    assert stats.summary("Travel")["mean"] == 400
+    assert stats.summary("groceries") is None
+    assert stats.codes_for(["Travel", "dining"]).tolist() == [1, 0]
+    assert np.isclose(stats.overall_mean, np.mean([30, 50, 40, 400]))
+
+def test_reason_uses_shared_index():
+    """Reasons read the prebuilt index and match building it on the fly"""
+    transactions = [{"id": str(i), "category": "dining", "categoryName": "Dining", "amount": 40} for i in range(19)]
+    outlier = {"id": "big", "category": "dining", "categoryName": "Dining", "amount": 400, "currency": "USD"}
+    transactions.append(outlier)
+
+    stats = CategoryStats.from_transactions(transactions)
+    reason = generate_anomaly_reason(outlier, transactions, stats)
+
+    assert reason == generate_anomaly_reason(outlier, transactions)
+    assert "significantly higher" in reason
@@ -0,0 +1,225 @@
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import main
+from app.category_stats import category_key
+from app.columnar import UnsupportedMediaTypeError, columns_from_arrays, decode_columns, split_by_category, to_columns
+from app.detection import (
+    run_category_detection,
+    run_category_detection_columns,
+    run_user_category_detection,
+    run_user_category_detection_columns,
+)
+from app.model_cache import model_cache
+from app.workers import DetectionPool
+from benchmark import generate_history, group_by_category
+
+TRANSACTIONS = [
+    {"id": "a", "amount": -12.5, "date": "2025-03-01", "category": "food", "description": "Lunch"},
+    {"id": "b", "amount": "7", "date": "2025-03-02T10:00:00Z", "category": "fun", "currency": "EUR"},
+    {"id": "c", "amount": "n/a", "category": "food"},
+    {"id": "d", "amount": 3, "date": "2025-03-04", "category": None},
+]
+
+def test_columns_and_records():
+    columns = to_columns(TRANSACTIONS)
+    assert list(columns) == ["id", "amount", "date", "category", "description", "currency"]
+
+    data = columns_from_arrays(columns)
+    assert len(data) == 4
+    np.testing.assert_allclose(data.amounts[[0, 1, 3]], [12.5, 7.0, 3.0])
+    assert np.isnan(data.amounts[2])
+    assert data.has_date.tolist() == [True, True, False, True]
+    assert [data.categories[code] for code in data.category_codes] == ["food", "fun", "food", "Unknown"]
+    assert [data.currency(row) for row in range(4)] == [None, "EUR", None, None]
+
+    # Null fields are left out of records, so they match the dicts the columns came from
+    assert [data.record(row) for row in range(3)] == TRANSACTIONS[:3]
+    assert pickle.loads(pickle.dumps(data)).record(1) == TRANSACTIONS[1]
+
+def test_split_by_category_keeps_input_order():
+    data = columns_from_arrays(to_columns(TRANSACTIONS))
+    by_category = split_by_category(data)
+    assert list(by_category) == ["food", "fun", "Unknown"]
+    assert [tx["id"] for tx in by_category["food"].records()] == ["a", "c"]
+    assert by_category["fun"].currency(0) == "EUR"
+
+@pytest.mark.parametrize("body", [
+    b'[1, 2]',
+    b'{"columns": {"date": ["2025-01-01"]}}',
+    b'{"columns": {"amount": [1, 2], "id": ["a"]}}',
+    b'{"columns": {"amount": 5}}',
+    b'{"columns": {"amount": [1], "category": [[1]]}}',
+    b'{"columns": ',
+])
+def test_malformed_bodies_are_rejected(body):
+    with pytest.raises(ValueError):
+        decode_columns(body)
+
+def test_unknown_content_type_is_rejected():
+    with pytest.raises(UnsupportedMediaTypeError):
+        decode_columns(b"amount\n1", "text/csv")
+
+def test_msgpack_body():
+    msgpack = pytest.importorskip("msgpack")
+    data = decode_columns(msgpack.packb({"columns": to_columns(TRANSACTIONS)}), "application/x-msgpack")
+    assert [data.record(row) for row in range(3)] == TRANSACTIONS[:3]
+
+def arrow_body(table):
+    pa = pytest.importorskip("pyarrow")
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def test_arrow_body():
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table({
+        "id": ["a", "b", "c", "d"],
+        "amount": [-12.5, 7.0, None, 3.0],
+        "date": ["2025-03-01", "2025-03-02T10:00:00Z", "", "March 4, 2025"],
+        "category": pa.array(["food", "fun", "food", None]).dictionary_encode(),
+        "currency": [None, "EUR", "GBP", "XXX"],
+    })
+    data = decode_columns(arrow_body(table), "application/vnd.apache.arrow.stream")
+    assert len(data) == 4
+    np.testing.assert_allclose(data.amounts[[0, 1, 3]], [12.5, 7.0, 3.0])
+    assert np.isnan(data.amounts[2])
+    assert data.has_date.tolist() == [True, True, False, True]
+    assert data.dates[[0, 1, 3]].astype("datetime64[D]").astype(str).tolist() == ["2025-03-01", "2025-03-02", "2025-03-04"]
+    assert [data.categories[code] for code in data.category_codes] == ["food", "fun", "food", "Unknown"]
+    assert [data.currency(row) for row in range(4)] == [None, "EUR", "GBP", None]
+    assert data.record(2) == {"id": "c", "date": "", "category": "food", "currency": "GBP"}
+
+    by_category = split_by_category(data)
+    assert [tx["id"] for tx in by_category["food"].records()] == ["a", "c"]
+    assert pickle.loads(pickle.dumps(by_category["fun"])).record(0)["currency"] == "EUR"
+
+    timestamps = pa.table({"amount": pa.array([1, 2], pa.int64()),
+                           "date": pa.array([0, None], pa.timestamp("ms"))})
+    data = decode_columns(arrow_body(timestamps), "application/vnd.apache.arrow.stream")
+    assert data.has_date.tolist() == [True, False]
+    assert str(data.dates[0]) == "1970-01-01T00:00:00.000000000"
+
+    with pytest.raises(ValueError):
+        decode_columns(b"not arrow", "application/vnd.apache.arrow.stream")
+
+def test_null_categories_group_like_the_list_pipeline():
+    """A missing category falls back to categoryName, then "Unknown", whatever the body format"""
+    pa = pytest.importorskip("pyarrow")
+    transactions = [
+        {"id": "a", "amount": 1, "category": "food", "categoryName": "Food"},
+        {"id": "b", "amount": 2, "categoryName": "Fun"},
+        {"id": "c", "amount": 3},
+        {"id": "d", "amount": 4, "category": "Fun"},
+    ]
+    expected = [category_key(tx) for tx in transactions]
+    assert expected == ["food", "Fun", "Unknown", "Fun"]
+
+    columns = to_columns(transactions)
+    table = pa.table({**columns, "category": pa.array(columns["category"]).dictionary_encode()})
+    for data in (columns_from_arrays(columns), decode_columns(arrow_body(table), "application/vnd.apache.arrow.stream")):
+        assert [data.categories[code] for code in data.category_codes] == expected
+        assert [category_key(data.record(row)) for row in range(len(data))] == expected
+        assert {key: [tx["id"] for tx in part.records()] for key, part in split_by_category(data).items()} == \
+            {"food": ["a"], "Fun": ["b", "d"], "Unknown": ["c"]}
+
+def test_same_anomalies_as_the_list_pipeline():
+    transactions = generate_history(600, 1, seed=3)
+    model_cache.clear()
+    expected = run_category_detection("cat0", transactions, "u", {}, {})
+    model_cache.clear()
+    result = run_category_detection_columns("cat0", columns_from_arrays(to_columns(transactions)), "u", {}, {})
+
+    assert result["method"] == expected["method"]
+    assert result["anomalies"] == expected["anomalies"]
+
+def test_user_category_detection_matches_with_alerts():
+    transactions = group_by_category(generate_history(400, 2, seed=5))["cat1"]
+    alerts = {"cat1": 150.0}
+    model_cache.clear()
+    expected = run_user_category_detection("cat1", transactions, "u", {}, alerts)
+    model_cache.clear()
+    data = split_by_category(columns_from_arrays(to_columns(transactions)))["cat1"]
+    result = run_user_category_detection_columns("cat1", data, "u", {}, alerts)
+
+    # Category statistics are summed in input order rather than newest first, so z-scores may differ in the last bit
+    assert result["method"] == expected["method"]
+    assert result["anomalies"] == [pytest.approx(anomaly) for anomaly in expected["anomalies"]]
+
+def test_columns_endpoints(monkeypatch):
+    pool = DetectionPool(kind="thread", max_workers=2)
+    monkeypatch.setattr(main, "detection_pool", pool)
+    client = TestClient(main.app)
+    headers = {"Authorization": "Bearer test"}
+    history = generate_history(300, 3, seed=2)
+    try:
+        model_cache.clear()
+        expected = client.post("/detect-user-anomalies", json={"transactions_by_category": group_by_category(history)},
+                               headers=headers).json()
+        model_cache.clear()
+        response = client.post("/detect-user-anomalies/columns", json={"columns": to_columns(history)}, headers=headers)
+        assert response.status_code == 200
+        result = response.json()
+        assert list(result["category_results"]) == list(expected["category_results"])
+        assert result["anomalies"] == [pytest.approx(anomaly) for anomaly in expected["anomalies"]]
+
+        category = [tx for tx in history if tx["category"] == "cat0"]
+        response = client.post("/detect-category-anomalies/cat0/columns?view=lean",
+                               json={"columns": to_columns(category)}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["count"] == len(response.json()["anomalies"])
+
+        response = client.post("/detect-user-anomalies/columns", content=json.dumps({"columns": {"id": [1]}}),
+                               headers=headers)
+        assert response.status_code == 400
+        response = client.post("/detect-user-anomalies/columns", content=b"amount\n1",
+                               headers=dict(headers, **{"Content-Type": "text/csv"}))
+        assert response.status_code == 415
+        response = client.post("/detect-category-anomalies/cat0/columns", json={"columns": to_columns(category)},
+                               headers=dict(headers, Accept="text/csv"))
+        assert response.status_code == 406
+    finally:
+        pool.shutdown()
+
+def test_binary_round_trips(monkeypatch):
+    msgpack = pytest.importorskip("msgpack")
+    pa = pytest.importorskip("pyarrow")
+    pool = DetectionPool(kind="thread", max_workers=2)
+    monkeypatch.setattr(main, "detection_pool", pool)
+    client = TestClient(main.app)
+    history = generate_history(300, 3, seed=2)
+    columns = to_columns(history)
+    try:
+        model_cache.clear()
+        expected = client.post("/detect-user-anomalies/columns", json={"columns": columns},
+                               headers={"Authorization": "Bearer test"}).json()
+
+        model_cache.clear()
+        response = client.post("/detect-user-anomalies/columns", content=msgpack.packb({"columns": columns}),
+                               headers={"Authorization": "Bearer test", "Content-Type": "application/msgpack",
+                                        "Accept": "application/msgpack"})
+        assert response.headers["content-type"] == "application/msgpack"
+        assert msgpack.unpackb(response.content) == expected
+
+        model_cache.clear()
+        table = pa.table({name: values for name, values in columns.items()})
+        response = client.post("/detect-user-anomalies/columns?view=lean", content=arrow_body(table),
+                               headers={"Authorization": "Bearer test",
+                                        "Content-Type": "application/vnd.apache.arrow.stream",
+                                        "Accept": "application/vnd.apache.arrow.stream"})
+        assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+        anomalies = pa.ipc.open_stream(response.content).read_all()
+        assert anomalies.column("id").to_pylist() == [anomaly["id"] for anomaly in expected["anomalies"]]
+        assert json.loads(anomalies.schema.metadata[b"detection"])["count"] == expected["count"]
+    finally:
+        pool.shutdown()
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.columnar import columns_from_arrays, to_columns
+from app.detection import run_category_detection, run_category_detection_columns
+from app.metrics import MODEL_CACHE_LOOKUPS, STAGE_SECONDS
+from app.model_cache import model_cache
+from app.workers import DetectionPool, PoolSaturatedError
+from benchmark import generate_history
+
+def slow_square(x, delay=0.0):
+    time.sleep(delay)
+    return x * x
+
+def test_runs_off_event_loop_thread():
+    """Jobs run on pool threads and their results are awaited by the caller"""
+    pool = DetectionPool(kind="thread", max_workers=2, max_pending=4)
+
+    async def main():
+        loop_thread = threading.get_ident()
+        worker_thread = await pool.run(threading.get_ident)
+        result = await pool.run(slow_square, 7)
+        return loop_thread, worker_thread, result
+
+    try:
+        loop_thread, worker_thread, result = asyncio.run(main())
+    finally:
+        pool.shutdown()
+
+    assert worker_thread != loop_thread
+    assert result == 49
+
+def test_rejects_jobs_beyond_max_pending():
+    """Once max_pending jobs are in flight, further submissions are refused"""
+    pool = DetectionPool(kind="thread", max_workers=1, max_pending=2)
+
+    async def main():
+        running = [asyncio.ensure_future(pool.run(slow_square, i, delay=0.2)) for i in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolSaturatedError):
+            await pool.run(slow_square, 3)
+        return await asyncio.gather(*running)
+
+    try:
+        assert asyncio.run(main()) == [0, 1]
+    finally:
+        pool.shutdown()
+    assert pool.pending == 0
+
+def test_user_detection_isolates_failing_category():
+    """A category that blows up reports an error without affecting its siblings"""
+    from app.detection import run_user_detection
+    from test_isolation_forest import generate_test_transactions
+
+    transactions_by_category = {}
+    for tx in generate_test_transactions():
+        transactions_by_category.setdefault(tx["category"], []).append(tx)
+    transactions_by_category["broken"] = ["not a transaction"] * 6
+    transactions_by_category["tiny"] = transactions_by_category["dining"][:2]
+
+    pool = DetectionPool(kind="thread", max_workers=3, max_pending=8)
+    try:
+        anomalies, category_results = asyncio.run(
+            run_user_detection(pool, transactions_by_category, "pool-user", {}, {})
+        )
+    finally:
+        pool.shutdown()
+
+    assert list(category_results) == list(transactions_by_category)
+    assert category_results["broken"]["method"] == "error"
+    assert category_results["tiny"]["method"] == "skipped"
+    for category in ("groceries", "dining", "utilities", "entertainment"):
+        assert category_results[category]["method"] == "isolation_forest"
+    assert len(anomalies) == sum(result["count"] for result in category_results.values())
+
+def test_process_pool_matches_thread_pool():
+    """Detection jobs survive spawn pickling, and worker metrics are merged back into the parent's registry"""
+    transactions = generate_history(300, 1, seed=3)
+    results, metric_deltas = {}, {}
+    for kind in ("thread", "process"):
+        model_cache.clear()
+        pool = DetectionPool(kind=kind, max_workers=1)
+        before = (MODEL_CACHE_LOOKUPS.value(result="miss"), MODEL_CACHE_LOOKUPS.value(result="hit"),
+                  STAGE_SECONDS.count(stage="score"))
+
+        async def main():
+            return (await pool.run(run_category_detection, "cat0", transactions, "u", {}, {}),
+                    await pool.run(run_category_detection_columns, "cat0", columns_from_arrays(to_columns(transactions)),
+                                   "u", {}, {}))
+
+        try:
+            results[kind] = asyncio.run(main())
+        finally:
+            pool.shutdown()
+        after = (MODEL_CACHE_LOOKUPS.value(result="miss"), MODEL_CACHE_LOOKUPS.value(result="hit"),
+                 STAGE_SECONDS.count(stage="score"))
+        metric_deltas[kind] = tuple(a - b for a, b in zip(after, before))
+
+    assert results["process"] == results["thread"]
+    assert metric_deltas["process"] == metric_deltas["thread"]
+    misses, hits, scored = metric_deltas["process"]
+    assert misses + hits == 2 and scored == 2
@@ -0,0 +1,53 @@
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.anomaly_detection import (
+    extract_feature_columns,
+    preprocess_transactions_for_isolation_forest,
+    ISOLATION_FOREST_FEATURES,
+)
+
+NOW = datetime(2025, 3, 31, 12, 0, 0)
+
+def test_columns_match_row_semantics():
+    """Columnar extraction should give the same values the per-row parser did"""
+    transactions = [
+        {"id": "iso", "amount": -42.5, "date": "2025-03-01"},
+        {"id": "timestamp", "amount": "19.99", "date": "2025-03-30T23:59:00.000Z"},
+        {"id": "other-format", "amount": 10, "date": "03/15/2025"},
+        {"id": "no-date", "amount": 5},
+    ]
+
+    columns = extract_feature_columns(transactions, now=NOW)
+
+    assert columns['valid'].tolist() == [True, True, True, True]
+    np.testing.assert_allclose(columns['amount'], [42.5, 19.99, 10, 5], rtol=1e-6)
+    # 2025-03-01 is a Saturday, 2025-03-30 a Sunday, 2025-03-15 a Saturday
+    assert columns['days_since'].tolist() == [30, 1, 16, 1]
+    assert columns['day_of_week'].tolist() == [5, 6, 5, 0]
+    assert columns['day_of_month'].tolist() == [1, 30, 15, 1]
+    np.testing.assert_allclose(columns['recency_weight'], [0.5, 59 / 60, 44 / 60, 59 / 60], rtol=1e-6)
+    assert all(columns[name].dtype == np.float32 for name in ISOLATION_FOREST_FEATURES)
+
+def test_invalid_rows_are_masked_not_dropped():
+    """Bad amounts or dates flip the validity mask but keep columns aligned with the input"""
+    transactions = [
+        {"id": "good", "amount": 12.0, "date": "2025-03-01"},
+        {"id": "bad-amount", "amount": "twelve", "date": "2025-03-01"},
+        {"id": "bad-date", "amount": 12.0, "date": "not a date"},
+        {"id": "none-amount", "amount": None, "date": "2025-03-01"},
+    ]
+
+    columns = extract_feature_columns(transactions, now=NOW)
+
+    assert len(columns['amount']) == len(transactions)
+    assert columns['valid'].tolist() == [True, False, False, False]
+
+    features = preprocess_transactions_for_isolation_forest(transactions)
+    assert features.shape == (1, len(ISOLATION_FOREST_FEATURES))
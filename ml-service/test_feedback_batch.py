@@ -0,0 +1,59 @@
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import main
+from app.feedback import FeedbackWriter, accepted_range_keys
+from app.preferences import PreferenceCache
+from app.storage import JsonPreferenceStore
+
+def test_batch_feedback_is_applied_in_one_flush(tmp_path, monkeypatch):
+    """Ranges, threshold bumps and new alerts from one batch land together, with per-item results"""
+    store = JsonPreferenceStore(str(tmp_path))
+    store.upsert_alerts("test-user", [{"category": "dining", "threshold": 60, "active": True}])
+    writer = FeedbackWriter(store, PreferenceCache(store), coalesce_seconds=0)
+    monkeypatch.setattr(main, "feedback_writer", writer)
+
+    items = [
+        # Marked normal above the dining alert, so the threshold is raised to 125
+        {"transaction_id": "t1", "user_id": "test-user", "is_normal": True, "anomaly_amount": 121.0, "category": "dining"},
+        {"transaction_id": "t2", "user_id": "test-user", "is_normal": False, "anomaly_amount": 80.0, "category": "travel",
+         "set_alert": True, "alert_threshold": 400.0},
+        {"transaction_id": "t3", "user_id": "test-user", "is_normal": False, "anomaly_amount": 10.0, "category": "rent"},
+    ]
+
+    client = TestClient(main.app)
+    response = client.post("/feedback/batch", json={"items": items}, headers={"Authorization": "Bearer test"})
+
+    assert response.status_code == 200
+    assert response.json()["results"] == [
+        {"transaction_id": "t1", "updated_model": True, "alert_set": False},
+        {"transaction_id": "t2", "updated_model": False, "alert_set": True},
+        {"transaction_id": "t3", "updated_model": False, "alert_set": False},
+    ]
+    assert writer.flushes == 1
+    assert store.load_accepted_ranges("test-user") == {"dining_low": True, "dining_medium_low": True, "dining_medium": True}
+    assert store.load_alerts("test-user") == [
+        {"category": "dining", "threshold": 125, "active": True},
+        {"category": "travel", "threshold": 400.0, "active": True},
+    ]
+
+def test_accepted_ranges_use_usd_bounds():
+    """Marking an amount normal accepts its USD range and every lower one, whatever its size"""
+    assert accepted_range_keys("food", 120.0) == ["food_low", "food_medium_low", "food_medium"]
+    assert accepted_range_keys("food", 49.99) == ["food_low"]
+    assert accepted_range_keys("food", 1500.0) == [
+        "food_low", "food_medium_low", "food_medium", "food_high", "food_very_high", "food_extreme"]
+
+def test_batch_feedback_size_limit(monkeypatch):
+    monkeypatch.setattr(main.config, "FEEDBACK_BATCH_MAX_ITEMS", 1)
+    item = {"transaction_id": "t", "user_id": "test-user", "is_normal": False, "anomaly_amount": 1.0, "category": "x"}
+
+    client = TestClient(main.app)
+    response = client.post("/feedback/batch", json={"items": [item, item]}, headers={"Authorization": "Bearer test"})
+
+    assert response.status_code == 422
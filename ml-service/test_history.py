@@ -0,0 +1,144 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import main
+from app.history import HistoryConflictError, TransactionHistory
+from app.model_cache import model_cache
+from app.result_cache import ResultCache
+from app.workers import DetectionPool
+from benchmark import generate_history, group_by_category
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+def test_append_replaces_edits_and_deletes():
+    history = TransactionHistory()
+    summary = history.apply("u", [
+        {"id": "a", "amount": 10, "date": days_ago(3), "category": "food"},
+        {"id": "b", "amount": 20, "date": days_ago(1), "category": "food"},
+        {"id": "c", "amount": 30, "date": days_ago(2), "category": "fun"},
+    ])
+    assert summary["size"] == 3 and summary["categories"] == {"food": 2, "fun": 1}
+
+    # Editing "a" moves it to another category; "c" was deleted
+    summary = history.apply("u", [{"id": "a", "amount": 15, "date": days_ago(3), "category": "fun"}], ["c"],
+                            generation=summary["generation"])
+    assert summary["categories"] == {"food": 1, "fun": 1}
+
+    generation, version, stored = history.transactions("u")
+    assert generation == summary["generation"]
+    assert stored == {"food": [{"id": "b", "amount": 20, "date": days_ago(1), "category": "food"}],
+                      "fun": [{"id": "a", "amount": 15, "date": days_ago(3), "category": "fun"}]}
+    # Reading doesn't change the version, an empty delta doesn't either
+    history.apply("u", generation=generation)
+    assert history.transactions("u")[1] == version
+
+    with pytest.raises(ValueError):
+        history.apply("u", [{"amount": 1}])
+
+def test_reading_a_missing_history_is_a_conflict():
+    history = TransactionHistory()
+    with pytest.raises(HistoryConflictError):
+        history.transactions("u")
+    # Reading doesn't create a history
+    assert history.summary("u") is None
+    generation = history.apply("u", [{"id": "a", "amount": 1, "category": "food"}])["generation"]
+    assert history.transactions("u", generation=generation)[0] == generation
+    with pytest.raises(HistoryConflictError):
+        history.transactions("u", "food", generation="stale")
+
+def test_sorted_view_is_reused_until_the_category_changes():
+    history = TransactionHistory(max_age_days=30)
+    generation = history.apply("u", [{"id": "a", "amount": 1, "date": days_ago(2), "category": "food"},
+                                     {"id": "b", "amount": 2, "date": days_ago(5), "category": "fun"}])["generation"]
+    _, _, first = history.transactions("u")
+    _, _, again = history.transactions("u")
+    assert again["food"] is first["food"] and again["fun"] is first["fun"]
+
+    history.apply("u", [{"id": "c", "amount": 3, "date": days_ago(9), "category": "food"}], generation=generation)
+    _, _, changed = history.transactions("u")
+    assert [tx["id"] for tx in changed["food"]] == ["c", "a"]
+    assert changed["fun"] is first["fun"]
+
+    # Deletes and expiry rebuild the views they touch
+    history.apply("u", delete=["a"], generation=generation)
+    assert [tx["id"] for tx in history.transactions("u", "food")[2]["food"]] == ["c"]
+    history.max_age_days = 7
+    _, _, expired = history.transactions("u")
+    assert expired == {"fun": [{"id": "b", "amount": 2, "date": days_ago(5), "category": "fun"}]}
+
+def test_bounded_by_count_age_and_users():
+    history = TransactionHistory(max_transactions=3, max_age_days=30, max_users=2)
+    history.apply("u", [{"id": str(day), "amount": day, "date": days_ago(day), "category": "food"} for day in range(6)])
+    history.apply("u", [{"id": "old", "amount": 1, "date": days_ago(40), "category": "fun"},
+                        {"id": "undated", "amount": 1, "category": "fun"}])
+    _, _, stored = history.transactions("u")
+    # The newest three food transactions by date; undated ones never expire
+    assert [tx["id"] for tx in stored["food"]] == ["2", "1", "0"]
+    assert [tx["id"] for tx in stored["fun"]] == ["undated"]
+
+    history.apply("v", [])
+    history.apply("w", [])
+    assert history.summary("u") is None and len(history) == 2
+
+def test_lost_history_is_a_conflict():
+    history = TransactionHistory()
+    generation = history.apply("u", [{"id": "a", "amount": 1, "category": "food"}])["generation"]
+    with pytest.raises(HistoryConflictError):
+        history.apply("u", [], generation="stale")
+    history.clear("u")
+    with pytest.raises(HistoryConflictError):
+        history.apply("u", [], generation=generation)
+    # Re-seeding starts a new generation
+    assert history.apply("u", [], replace=True, generation=generation)["generation"] != generation
+
+def test_detection_over_stored_history(monkeypatch):
+    pool = DetectionPool(kind="thread", max_workers=2)
+    monkeypatch.setattr(main, "detection_pool", pool)
+    # The benchmark histories are dated from a fixed base date, so don't let them expire
+    monkeypatch.setattr(main, "transaction_history", TransactionHistory(max_age_days=36500))
+    monkeypatch.setattr(main, "result_cache", ResultCache())
+    client = TestClient(main.app)
+    headers = {"Authorization": "Bearer test"}
+    transactions = generate_history(300, 3, seed=6)
+    for index, tx in enumerate(transactions):
+        tx["id"] = f"tx{index}"
+    try:
+        model_cache.clear()
+        expected = client.post("/detect-user-anomalies", json={"transactions_by_category": group_by_category(transactions)},
+                               headers=headers).json()
+
+        response = client.post("/history", json={"append": transactions[:200], "replace": True}, headers=headers)
+        assert response.status_code == 200
+        generation = response.json()["generation"]
+        response = client.post("/history", json={"append": transactions[200:], "generation": generation}, headers=headers)
+        assert response.json()["size"] == 300
+        assert client.get("/history", headers=headers).json()["size"] == 300
+
+        model_cache.clear()
+        result = client.post(f"/detect-user-anomalies/history?generation={generation}", headers=headers).json()
+        assert sorted(tx["id"] for tx in result["anomalies"]) == sorted(tx["id"] for tx in expected["anomalies"])
+        response = client.post("/detect-category-anomalies/cat0/history?view=lean", headers=headers)
+        assert response.status_code == 200
+        assert {tx["category"] for tx in response.json()["anomalies"]} <= {"cat0"}
+
+        response = client.post("/detect-user-anomalies/history?generation=stale", headers=headers)
+        assert response.status_code == 409
+        response = client.post("/history", json={"delete": ["tx0"], "generation": "stale"}, headers=headers)
+        assert response.status_code == 409
+        response = client.post("/history", json={"append": [{"amount": 5}]}, headers=headers)
+        assert response.status_code == 422
+        assert client.delete("/history", headers=headers).status_code == 200
+        assert client.get("/history", headers=headers).status_code == 404
+        # A process without the user's history says so instead of finding no anomalies
+        assert client.post("/detect-user-anomalies/history", headers=headers).status_code == 409
+        assert client.post("/detect-category-anomalies/cat0/history", headers=headers).status_code == 409
+    finally:
+        pool.shutdown()
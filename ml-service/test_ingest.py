@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import main
+from app.detection import run_category_detection, run_category_detection_columns
+from app.ingest import JsonArrayParser, NdjsonParser, ingest_transactions
+from app.model_cache import model_cache
+from app.workers import DetectionPool
+from benchmark import generate_history
+
+TRANSACTIONS = [
+    {"id": "a", "amount": -12.5, "date": "2025-03-01", "category": "food", "description": "Café ] {brace}"},
+    {"id": "b", "amount": "7", "date": "2025-03-02T10:00:00Z", "category": "fun", "currency": "EUR"},
+    {"id": "c", "amount": "n/a", "category": "food", "note": "日本"},
+]
+
+def split(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+def parse(parser, chunks):
+    records = []
+    for chunk in chunks:
+        records.extend(parser.feed(chunk))
+    return records + parser.close()
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_parsers_handle_any_chunking(size):
+    """Objects split across chunks (even inside multi-byte characters) come out whole, with their raw JSON"""
+    array_body = json.dumps(TRANSACTIONS, ensure_ascii=False).encode()
+    ndjson_body = "\n".join(json.dumps(tx, ensure_ascii=False) for tx in TRANSACTIONS).encode() + b"\n\n"
+
+    for parser, body in ((JsonArrayParser(), array_body), (NdjsonParser(), ndjson_body)):
+        records = parse(parser, split(body, size))
+        assert [tx for tx, _ in records] == TRANSACTIONS
+        assert [json.loads(raw) for _, raw in records] == TRANSACTIONS
+
+@pytest.mark.parametrize("body", [b'{"id": 1}', b'[{"id": 1}, 5]', b'[{"id": 1}', b'[{"id": 1] ', b'[] []'])
+def test_malformed_arrays_are_rejected(body):
+    with pytest.raises(ValueError):
+        parse(JsonArrayParser(), split(body, 4))
+
+def test_malformed_ndjson_is_rejected():
+    with pytest.raises(ValueError):
+        parse(NdjsonParser(), [b'{"id": 1}\n{"id": \n'])
+
+async def chunks_of(body, size=64):
+    for chunk in split(body, size):
+        yield chunk
+
+def test_columns_and_records():
+    data = asyncio.run(ingest_transactions(chunks_of(json.dumps(TRANSACTIONS).encode()), "application/json"))
+    try:
+        assert len(data) == 3
+        np.testing.assert_allclose(data.amounts[:2], [12.5, 7.0])
+        assert np.isnan(data.amounts[2])
+        assert data.has_date.tolist() == [True, True, False]
+        assert [data.categories[code] for code in data.category_codes] == ["food", "fun", "food"]
+        assert [data.currency(row) for row in range(3)] == [None, "EUR", None]
+
+        # Worker processes get a pickled copy that reads the same spool file
+        copy = pickle.loads(pickle.dumps(data))
+        assert copy.record(1) == TRANSACTIONS[1]
+        copy.release()
+        assert data.record(0) == TRANSACTIONS[0]
+    finally:
+        data.close()
+    assert not os.path.exists(data.spool_path)
+
+def test_same_anomalies_as_the_list_pipeline():
+    transactions = generate_history(600, 1, seed=3)
+    model_cache.clear()
+    expected = run_category_detection("cat0", transactions, "u", {}, {})
+
+    body = "\n".join(json.dumps(tx) for tx in transactions).encode()
+    data = asyncio.run(ingest_transactions(chunks_of(body, 4096), "application/x-ndjson"))
+    try:
+        model_cache.clear()
+        result = run_category_detection_columns("cat0", data, "u", {}, {})
+    finally:
+        data.close()
+
+    assert result["method"] == expected["method"]
+    assert result["anomalies"] == expected["anomalies"]
+
+def test_stream_endpoint(monkeypatch):
+    pool = DetectionPool(kind="thread", max_workers=1)
+    monkeypatch.setattr(main, "detection_pool", pool)
+    client = TestClient(main.app)
+    headers = {"Authorization": "Bearer test", "Content-Type": "application/x-ndjson"}
+    try:
+        body = "\n".join(json.dumps(tx) for tx in generate_history(100, 1, seed=1))
+        response = client.post("/detect-category-anomalies/cat0/stream", content=body, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["count"] == len(response.json()["anomalies"])
+
+        response = client.post("/detect-category-anomalies/cat0/stream", content=b"[1, 2",
+                               headers={"Authorization": "Bearer test", "Content-Type": "application/json"})
+        assert response.status_code == 400
+    finally:
+        pool.shutdown()
+
+def test_stream_endpoint_removes_spool_on_error(monkeypatch, tmp_path):
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+
+    async def fail(user_id):
+        raise RuntimeError("preference store down")
+    monkeypatch.setattr(main.preference_cache, "get_async", fail)
+    client = TestClient(main.app, raise_server_exceptions=False)
+    body = "\n".join(json.dumps(tx) for tx in TRANSACTIONS)
+    response = client.post("/detect-category-anomalies/cat0/stream", content=body,
+                           headers={"Authorization": "Bearer test", "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 500
+    assert list(tmp_path.iterdir()) == []
@@ -19,7 +19,7 @@ logger.info(f"Added app directory to path: {os.path.join(os.path.dirname(__file_
 
 try:
     # Import the anomaly detection function
-    from anomaly_detection import detect_anomalies_isolation_forest
+    from app.anomaly_detection import detect_anomalies_isolation_forest
     logger.info("Successfully imported anomaly_detection module")
 except Exception as e:
     logger.error(f"Error importing anomaly_detection: {str(e)}")
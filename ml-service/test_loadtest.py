@@ -0,0 +1,43 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from loadtest import RequestFactory, asgi_client, parse_mix, percentile, run_load, summarize
+
+def test_parse_mix():
+    assert parse_mix("category=4, feedback=1,alerts") == {"category": 4.0, "feedback": 1.0, "alerts": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("stream=1")
+    with pytest.raises(ValueError):
+        parse_mix("user=0")
+
+def test_percentiles():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([], 50) == 0.0
+
+def test_in_process_load_run(tmp_path):
+    """Concurrent mixed traffic against the in-process app is reported per request kind"""
+    factory = RequestFactory(users=3, transactions=30, categories=2)
+    mix = parse_mix("category=1,feedback=2,alerts=2")
+
+    async def run():
+        async with asgi_client(str(tmp_path / "preferences.db"), timeout=60) as client:
+            return await run_load(client, factory, mix, concurrency=8, total_requests=40)
+
+    samples = asyncio.run(run())
+    report = summarize(samples, elapsed=1.0)
+
+    assert report["overall"]["requests"] == 40
+    assert report["overall"]["errors"] == 0, report["overall"]["status_codes"]
+    assert set(report["by_kind"]) == {"category", "feedback", "alerts"}
+    latency = report["overall"]["latency_ms"]
+    assert latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
@@ -0,0 +1,82 @@
+import logging
+import os
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.logging_setup import MemoryLogHandler
+
+def log(handler, level, message, request_id=None, created=None):
+    record = logging.LogRecord("ml-service", level, __file__, 1, message, None, None)
+    record.request_id = request_id
+    if created is not None:
+        record.created = created
+    handler.emit(record)
+
+def test_ring_buffer_keeps_only_the_newest_records():
+    handler = MemoryLogHandler(capacity=5)
+    for i in range(12):
+        log(handler, logging.INFO, f"line {i}")
+
+    logs, next_cursor, has_more = handler.query()
+    assert [entry["message"] for entry in logs] == [f"line {i}" for i in range(7, 12)]
+    assert next_cursor == 11 and not has_more
+
+def test_capacity_must_be_positive():
+    for capacity in (0, -1):
+        with pytest.raises(ValueError):
+            MemoryLogHandler(capacity=capacity)
+
+def test_filters_and_cursor_pagination():
+    handler = MemoryLogHandler(capacity=100)
+    for i in range(10):
+        log(handler, logging.WARNING if i % 2 else logging.INFO, f"line {i}",
+            request_id="req-a" if i < 6 else "req-b", created=1000.0 + i)
+
+    warnings, _, _ = handler.query(level="warning")
+    assert [entry["message"] for entry in warnings] == ["line 1", "line 3", "line 5", "line 7", "line 9"]
+
+    recent, _, _ = handler.query(since=1007.0)
+    assert [entry["message"] for entry in recent] == ["line 7", "line 8", "line 9"]
+
+    page, cursor, has_more = handler.query(request_id="req-a", limit=4)
+    assert [entry["message"] for entry in page] == ["line 0", "line 1", "line 2", "line 3"]
+    assert has_more
+    page, cursor, has_more = handler.query(request_id="req-a", cursor=cursor, limit=4)
+    assert [entry["message"] for entry in page] == ["line 4", "line 5"]
+    assert not has_more
+
+    # Tailing from the end returns nothing new until more is logged
+    page, cursor, _ = handler.query(cursor=cursor)
+    assert page == [] and cursor == 9
+    log(handler, logging.ERROR, "line 10")
+    page, _, _ = handler.query(cursor=cursor)
+    assert [entry["message"] for entry in page] == ["line 10"]
+
+def test_logs_endpoint_filters_by_request_id():
+    from app.main import app
+
+    client = TestClient(app)
+    response = client.get("/", headers={"X-Request-ID": "trace-me"})
+    assert response.headers["x-request-id"] == "trace-me"
+
+    response = client.post("/stream/transaction", headers={"Authorization": "Bearer test", "X-Request-ID": "trace-me"},
+                           json={"id": "log-test", "amount": 12.5, "date": "2025-03-01", "category": "log-test"})
+    assert response.status_code == 200
+
+    # Records reach the buffer through the background log listener
+    for _ in range(100):
+        body = client.get("/logs", params={"request_id": "trace-me"}).json()
+        if body["logs"]:
+            break
+        time.sleep(0.02)
+    assert body["logs"]
+    assert all(entry["request_id"] == "trace-me" for entry in body["logs"])
+    assert any("log-test" in entry["message"] for entry in body["logs"])
+
+    assert client.get("/logs", params={"level": "LOUD"}).status_code == 422
@@ -0,0 +1,65 @@
+import logging
+import os
+import sys
+import time
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.logging_setup import SAMPLED, SampleFilter, configure_logging, add_handler, parse_logger_levels
+
+def make_record(msg, sampled):
+    record = logging.LogRecord("ml-service", logging.DEBUG, __file__, 1, msg, (1,), None)
+    if sampled:
+        record.sample = True
+    return record
+
+def test_sample_filter_keeps_one_in_n_per_line():
+    sample_filter = SampleFilter(every=10)
+
+    kept_a = sum(sample_filter.filter(make_record("line a %s", True)) for _ in range(100))
+    kept_b = sum(sample_filter.filter(make_record("line b %s", True)) for _ in range(5))
+    kept_unsampled = sum(sample_filter.filter(make_record("line c %s", False)) for _ in range(20))
+
+    assert kept_a == 10
+    assert kept_b == 1  # The first occurrence of a line is always kept
+    assert kept_unsampled == 20
+
+def test_parse_logger_levels():
+    assert parse_logger_levels("") == {}
+    assert parse_logger_levels("anomaly-detection=debug, ml-service=WARNING") == {
+        "anomaly-detection": "DEBUG",
+        "ml-service": "WARNING",
+    }
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def test_records_reach_handlers_through_the_queue():
+    """Per-logger levels apply, sampled debug lines are thinned, and handlers see records via the listener"""
+    configure_logging(level="INFO", logger_levels={"test-logging.verbose": "DEBUG"}, sample_every=5)
+    handler = ListHandler()
+    handler.addFilter(logging.Filter("test-logging"))
+    add_handler(handler)
+
+    quiet = logging.getLogger("test-logging.quiet")
+    verbose = logging.getLogger("test-logging.verbose")
+    quiet.debug("hidden %s", 1)
+    quiet.info("shown %s", 1)
+    for i in range(10):
+        verbose.debug("per transaction %s", i, extra=SAMPLED)
+
+    # The listener thread drains the queue; wait for it by logging a marker
+    verbose.info("done")
+    for _ in range(200):
+        if handler.records and handler.records[-1].getMessage() == "done":
+            break
+        time.sleep(0.01)
+
+    messages = [record.getMessage() for record in handler.records]
+    assert messages == ["shown 1", "per transaction 0", "per transaction 5", "done"]
@@ -0,0 +1,62 @@
+import os
+import sys
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.metrics import MetricsRegistry, collect
+
+def test_prometheus_text_format():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", labels=("endpoint",))
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    registry.gauge("queue_depth", "Queue depth", lambda: 3)
+    registry.counter("fallbacks_total", "Fallbacks")
+
+    requests.inc(endpoint="user")
+    requests.inc(2, endpoint="user")
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{endpoint="user"} 3' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 5.55" in lines
+    assert "latency_seconds_count 3" in lines
+    assert "queue_depth 3" in lines
+    assert "fallbacks_total 0" in lines
+
+def test_collected_updates_are_applied_by_the_parent():
+    """Updates made inside collect() are returned, not applied, so they can cross a process boundary"""
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs_total", "Jobs", labels=("kind",))
+
+    def job():
+        counter.inc(kind="fit")
+        return "done"
+
+    result, updates = collect(job)
+    assert result == "done"
+    assert counter.value(kind="fit") == 0
+
+    registry.apply(updates)
+    assert counter.value(kind="fit") == 1
+
+def test_ready_reflects_detection_queue_depth(monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app, detection_pool
+
+    client = TestClient(app)
+    assert client.get("/ready").status_code == 200
+
+    monkeypatch.setattr(detection_pool, "pending", detection_pool.max_pending)
+    response = client.get("/ready")
+    assert response.status_code == 503
+
+    metrics = client.get("/metrics")
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert f"detection_pool_pending {detection_pool.max_pending}" in metrics.text
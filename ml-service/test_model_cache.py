@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.model_cache import ModelCache, model_cache
+from app.anomaly_detection import detect_anomalies_isolation_forest
+from test_isolation_forest import generate_test_transactions
+
+def test_lru_eviction():
+    """Least recently used entries go first once the cache is full"""
+    cache = ModelCache(max_size=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expiry():
+    """Entries older than the TTL are treated as misses"""
+    cache = ModelCache(max_size=4, ttl_seconds=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["size"] == 0
+
+def test_fingerprint_tracks_data():
+    """Keys change with the feature values, not just the user and category"""
+    features = np.arange(10, dtype=np.float32).reshape(5, 2)
+    key = ModelCache.make_key("user", "dining", features)
+
+    assert key == ModelCache.make_key("user", "dining", features.copy())
+    changed = features.copy()
+    changed[0, 0] = 99
+    assert key != ModelCache.make_key("user", "dining", changed)
+    assert key != ModelCache.make_key("other-user", "dining", features)
+
+def test_repeat_detection_hits_cache():
+    """Detecting on the same history twice should reuse the fitted model and give the same result"""
+    model_cache.clear()
+    transactions = generate_test_transactions()
+
+    first = detect_anomalies_isolation_forest(transactions, user_id="cache-user", category_id="mixed")
+    hits_before = model_cache.stats()["hits"]
+    second = detect_anomalies_isolation_forest(transactions, user_id="cache-user", category_id="mixed")
+
+    assert model_cache.stats()["hits"] == hits_before + 1
+    assert [a["id"] for a in first] == [a["id"] for a in second]
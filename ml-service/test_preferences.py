@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.preferences import PreferenceCache
+from app.storage import JsonPreferenceStore
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+def test_alerts_are_parsed_and_cached(tmp_path):
+    """Active alerts become a {category: threshold} map, and repeat reads come from memory"""
+    store = JsonPreferenceStore(str(tmp_path))
+    write_json(store.accepted_ranges_path("u1"), {"food_low": True})
+    write_json(store.category_alerts_path("u1"), [
+        {"category": "food", "threshold": 50, "active": True},
+        {"category": "travel", "threshold": 300, "active": False},
+        {"category": "rent", "threshold": 1200},
+    ])
+
+    cache = PreferenceCache(store, max_size=10)
+    first = cache.get("u1")
+    second = cache.get("u1")
+
+    assert first.accepted_ranges == {"food_low": True}
+    assert first.alert_thresholds == {"food": 50, "rent": 1200}
+    assert len(first.alerts) == 3
+    assert second is first
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_missing_files_give_empty_preferences(tmp_path):
+    preferences = PreferenceCache(JsonPreferenceStore(str(tmp_path))).get("nobody")
+    assert preferences.accepted_ranges == {}
+    assert preferences.alerts == []
+    assert preferences.alert_thresholds == {}
+
+def test_file_changes_and_invalidate_reload(tmp_path):
+    """Edits made outside the service are picked up, as are explicit invalidations"""
+    store = JsonPreferenceStore(str(tmp_path))
+    alerts_file = store.category_alerts_path("u1")
+    write_json(alerts_file, [{"category": "food", "threshold": 50}])
+
+    cache = PreferenceCache(store)
+    assert cache.get("u1").alert_thresholds == {"food": 50}
+
+    write_json(alerts_file, [{"category": "food", "threshold": 75}])
+    stat = os.stat(alerts_file)
+    os.utime(alerts_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert cache.get("u1").alert_thresholds == {"food": 75}
+
+    write_json(store.accepted_ranges_path("u1"), {"food_low": True})
+    cache.invalidate("u1")
+    assert cache.get("u1").accepted_ranges == {"food_low": True}
+    assert cache.stats()["misses"] == 3
+
+def test_lru_eviction(tmp_path):
+    cache = PreferenceCache(JsonPreferenceStore(str(tmp_path)), max_size=2)
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")  # "b" is now least recently used
+    cache.get("c")
+
+    assert cache.get_cached("a") is not None
+    assert cache.get_cached("b") is None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import main
+from app.responses import ARROW_STREAM, JSON, LEAN_FIELDS, MSGPACK, encode_arrow, encode_json, negotiate, parse_view, project_anomalies
+from app.workers import DetectionPool
+from benchmark import generate_history, group_by_category
+
+HEADERS = {"Authorization": "Bearer test"}
+
+def test_parse_view():
+    assert parse_view(None, None) is None
+    assert parse_view("full", None) is None
+    assert parse_view("lean", None) == LEAN_FIELDS
+    assert parse_view(None, "id, severity,") == ("id", "severity")
+    with pytest.raises(ValueError):
+        parse_view("compact", None)
+
+def test_negotiate():
+    assert negotiate(None) == JSON
+    assert negotiate("application/json, text/plain, */*") == JSON
+    assert negotiate("text/html, */*;q=0.1") == JSON
+    assert negotiate("application/x-msgpack") == MSGPACK
+    assert negotiate("application/msgpack;q=0, application/vnd.apache.arrow.stream") == ARROW_STREAM
+    assert negotiate("text/csv") is None
+
+def test_arrow_encoding():
+    pa = pytest.importorskip("pyarrow")
+    content = {
+        "anomalies": [{"id": "a", "amount": 10.0, "score": np.float64(0.5)}, {"id": "b", "amount": "7", "note": {"x": 1}}],
+        "count": 2,
+        "category_results": {"food": {"anomalies": [{"id": "a"}], "count": 1, "method": "isolation_forest"}},
+    }
+    table = pa.ipc.open_stream(encode_arrow(content)).read_all()
+    assert table.column_names == ["id", "amount", "score", "note"]
+    # Mixed-type columns fall back to strings
+    assert table.column("amount").to_pylist() == ["10.0", "7"]
+    assert table.column("score").to_pylist() == [0.5, None]
+    assert json.loads(table.schema.metadata[b"detection"]) == {
+        "count": 2, "category_results": {"food": {"count": 1, "method": "isolation_forest"}}
+    }
+
+def test_projection_and_encoding():
+    anomalies = [{"id": "a", "amount": 10.0, "description": "x", "severity": "High"}, {"id": "b"}]
+    assert project_anomalies(anomalies, ("id", "severity")) == [{"id": "a", "severity": "High"}, {"id": "b"}]
+    assert json.loads(encode_json({"score": np.float32(0.5), "n": np.int64(3), 1: "key"})) == {"score": 0.5, "n": 3, "1": "key"}
+
+@pytest.fixture
+def client(monkeypatch):
+    pool = DetectionPool(kind="thread", max_workers=1)
+    monkeypatch.setattr(main, "detection_pool", pool)
+    yield TestClient(main.app)
+    pool.shutdown()
+
+def test_lean_user_response_lists_each_anomaly_once(client):
+    payload = {"transactions_by_category": group_by_category(generate_history(300, 3, seed=5))}
+    full = client.post("/detect-user-anomalies", json=payload, headers=HEADERS).json()
+    lean = client.post("/detect-user-anomalies?fields=id,severity,anomalyScore", json=payload, headers=HEADERS).json()
+
+    assert full["count"] > 0
+    assert lean["count"] == full["count"]
+    assert lean["anomalies"] == [
+        {"id": a["id"], "severity": a["severity"], "anomalyScore": pytest.approx(a["anomalyScore"])}
+        for a in full["anomalies"]
+    ]
+    for category_id, result in lean["category_results"].items():
+        assert "anomalies" not in result
+        assert result["count"] == full["category_results"][category_id]["count"]
+
+def test_lean_category_response(client):
+    payload = {"transactions": generate_history(200, 1, seed=2)}
+    response = client.post("/detect-category-anomalies/cat0?view=lean", json=payload, headers=HEADERS)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == len(body["anomalies"]) > 0
+    assert all(set(anomaly) <= set(LEAN_FIELDS) for anomaly in body["anomalies"])
+
+    response = client.post("/detect-category-anomalies/cat0?view=tiny", json=payload, headers=HEADERS)
+    assert response.status_code == 422
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import main
+from app.feedback import FeedbackWriter
+from app.models import AnomalyFeedback
+from app.preferences import PreferenceCache, UserPreferences
+from app.result_cache import ResultCache
+from app.storage import JsonPreferenceStore
+from app.workers import DetectionPool
+from benchmark import generate_history, group_by_category
+
+NO_PREFERENCES = UserPreferences({}, [], {})
+
+def test_key_ignores_dict_key_order():
+    first = [{"id": "a", "amount": 5, "category": "food"}]
+    second = [{"category": "food", "amount": 5, "id": "a"}]
+    assert ResultCache.make_key("u", "user", first) == ResultCache.make_key("u", "user", second)
+    assert ResultCache.make_key("u", "user", first) != ResultCache.make_key("u", "category:food", first)
+    assert ResultCache.make_key("u", "user", first) != ResultCache.make_key("v", "user", first)
+
+def test_preference_change_only_affects_its_categories():
+    cache = ResultCache()
+    food = cache.make_key("u", "category:food", [1])
+    fun = cache.make_key("u", "category:fun", [2])
+    cache.put(food, "food result", {"food"}, NO_PREFERENCES)
+    cache.put(fun, "fun result", {"fun"}, NO_PREFERENCES)
+
+    changed = UserPreferences({"food_low": True}, [], {"food": 40.0})
+    assert cache.get(food, changed) is None
+    assert cache.get(fun, changed) == "fun result"
+    # Preferences for categories nobody detected on don't matter either
+    assert cache.get(fun, UserPreferences({"rent_low": True}, [], {"rent": 900.0})) == "fun result"
+
+def test_ttl_and_memory_bound(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.result_cache.time.monotonic", lambda: now[0])
+    cache = ResultCache(max_bytes=100, ttl_seconds=10)
+    first = cache.make_key("u", "user", 1)
+    cache.put(first, "x" * 40, {"food"}, NO_PREFERENCES)
+    now[0] += 11
+    assert cache.get(first, NO_PREFERENCES) is None
+
+    cache.put(first, "x" * 40, {"food"}, NO_PREFERENCES)
+    cache.put(cache.make_key("u", "user", 2), "y" * 40, {"food"}, NO_PREFERENCES)
+    cache.get(first, NO_PREFERENCES)
+    cache.put(cache.make_key("u", "user", 3), "z" * 40, {"food"}, NO_PREFERENCES)
+    # The least recently used entry made room, and results bigger than the whole cache are never stored
+    assert cache.stats()["size"] == 2 and cache.stats()["bytes"] <= 100
+    assert cache.get(first, NO_PREFERENCES) is not None
+    assert cache.get(cache.make_key("u", "user", 2), NO_PREFERENCES) is None
+    cache.put(cache.make_key("u", "user", 4), "w" * 200, {"food"}, NO_PREFERENCES)
+    assert cache.get(cache.make_key("u", "user", 4), NO_PREFERENCES) is None
+
+def test_feedback_invalidates_touched_categories(tmp_path):
+    store = JsonPreferenceStore(str(tmp_path))
+    cache = ResultCache()
+    writer = FeedbackWriter(store, PreferenceCache(store), coalesce_seconds=0, result_cache=cache)
+    food = cache.make_key("u", "category:food", [1])
+    fun = cache.make_key("u", "category:fun", [2])
+    cache.put(food, "food result", {"food"}, NO_PREFERENCES)
+    cache.put(fun, "fun result", {"fun"}, NO_PREFERENCES)
+
+    feedback = AnomalyFeedback(transaction_id="t", user_id="u", is_normal=False, anomaly_amount=1.0, category="food")
+    asyncio.run(writer.submit("u", feedback))
+
+    assert cache.get(food, NO_PREFERENCES) is None
+    assert cache.get(fun, NO_PREFERENCES) == "fun result"
+
+def test_endpoints_serve_repeat_requests_from_cache(monkeypatch):
+    pool = DetectionPool(kind="thread", max_workers=2)
+    monkeypatch.setattr(main, "detection_pool", pool)
+    monkeypatch.setattr(main, "result_cache", ResultCache())
+    client = TestClient(main.app)
+    headers = {"Authorization": "Bearer test"}
+    history = group_by_category(generate_history(200, 2, seed=4))
+    try:
+        first = client.post("/detect-user-anomalies", json={"transactions_by_category": history}, headers=headers)
+        assert first.status_code == 200
+
+        async def fail(*args, **kwargs):
+            raise AssertionError("detection ran for a cached request")
+        monkeypatch.setattr(main, "run_user_detection", fail)
+        reordered = {category: [dict(reversed(list(tx.items()))) for tx in txs] for category, txs in history.items()}
+        second = client.post("/detect-user-anomalies", json={"transactions_by_category": reordered}, headers=headers)
+        assert second.status_code == 200
+        assert second.json() == first.json()
+        assert main.result_cache.stats()["hits"] == 1
+    finally:
+        pool.shutdown()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app import main
+from app.metrics import DETECTIONS_COALESCED
+from app.result_cache import ResultCache
+from app.single_flight import SingleFlight
+from benchmark import generate_history, group_by_category
+
+def test_concurrent_calls_share_one_computation():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    async def scenario():
+        shared = await asyncio.gather(*(flights.run("a", lambda: compute(1)) for _ in range(5)),
+                                      flights.run("b", lambda: compute(2)))
+        assert len(flights) == 0
+        # Once finished, the next call computes again
+        again = await flights.run("a", lambda: compute(3))
+        return shared, again
+
+    shared, again = asyncio.run(scenario())
+    assert shared == [1, 1, 1, 1, 1, 2]
+    assert again == 3
+    assert calls == [1, 2, 3]
+    assert (flights.started, flights.coalesced) == (3, 4)
+
+def test_errors_are_shared_and_callers_can_leave():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def scenario():
+        results = await asyncio.gather(flights.run("x", fail), flights.run("x", fail), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+        # Cancelling the first caller doesn't cancel the computation the second one waits for
+        first = asyncio.ensure_future(flights.run("y", slow))
+        second = asyncio.ensure_future(flights.run("y", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
+
+def test_identical_concurrent_requests_run_one_detection(monkeypatch):
+    monkeypatch.setattr(main, "result_cache", ResultCache())
+    monkeypatch.setattr(main, "detection_flights", SingleFlight())
+    calls = []
+
+    async def detect(pool, transactions_by_category, *args, **kwargs):
+        calls.append(transactions_by_category)
+        await asyncio.sleep(0.05)
+        return [], {category: {"count": 0, "method": "isolation_forest", "anomalies": []}
+                    for category in transactions_by_category}
+    monkeypatch.setattr(main, "run_user_detection", detect)
+
+    history = group_by_category(generate_history(50, 2, seed=5))
+    before = DETECTIONS_COALESCED.value(endpoint="user")
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            post = lambda body: client.post("/detect-user-anomalies", json={"transactions_by_category": body},
+                                            headers={"Authorization": "Bearer test"})
+            return await asyncio.gather(post(history), post(history), post(history), post({"other": []}))
+
+    responses = asyncio.run(scenario())
+    assert [response.status_code for response in responses] == [200] * 4
+    assert responses[0].json() == responses[1].json() == responses[2].json()
+    assert len(calls) == 2
+    assert DETECTIONS_COALESCED.value(endpoint="user") - before == 2
@@ -0,0 +1,46 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.anomaly_detection import detect_anomalies_sliding_window
+
+BASE_DATE = datetime(2025, 1, 1)
+
+def make_transactions(amounts, category="dining"):
+    return [
+        {
+            "id": f"{category}-{i}",
+            "amount": amount,
+            "date": (BASE_DATE + timedelta(days=i)).strftime("%Y-%m-%d"),
+            "category": category,
+            "categoryName": category.title(),
+            "currency": "USD",
+        }
+        for i, amount in enumerate(amounts)
+    ]
+
+def test_flags_spike_after_context():
+    """A spike after enough history is flagged; identical windows are skipped"""
+    transactions = make_transactions([40, 42, 38, 41, 39, 40, 43, 200, 41])
+    anomalies = detect_anomalies_sliding_window(transactions)
+    assert [a["id"] for a in anomalies] == ["dining-7"]
+    assert anomalies[0]["detectionMethod"] == "sliding_window"
+
+    flat = make_transactions([40] * 8 + [41])
+    assert detect_anomalies_sliding_window(flat) == []
+
+def test_multiple_windows_and_category_partitions():
+    """Windows can be taken per category, and several sizes can be checked at once"""
+    dining = make_transactions([40, 42, 38, 41, 39, 40, 43, 41, 120], "dining")
+    # Rent is always large, which would swamp dining's window if they were mixed
+    rent = make_transactions([1500, 1510, 1490, 1505, 1495, 1500, 1502, 1498, 1501], "rent")
+    transactions = sorted(dining + rent, key=lambda tx: tx["date"])
+
+    mixed = detect_anomalies_sliding_window(transactions)
+    assert "dining-8" not in [a["id"] for a in mixed]
+
+    partitioned = detect_anomalies_sliding_window(transactions, window_sizes=(5, 10), by_category=True)
+    assert [a["id"] for a in partitioned] == ["dining-8"]
@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+
+import pytest
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.migrate_preferences import migrate
+from app.storage import JsonPreferenceStore, PreferenceStore, SqlitePreferenceStore
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "json":
+        yield JsonPreferenceStore(str(tmp_path))
+    else:
+        store = SqlitePreferenceStore(str(tmp_path / "preferences.db"))
+        yield store
+        store.close()
+
+def test_accepted_ranges_round_trip(store):
+    assert store.load_accepted_ranges("u1") == {}
+    store.accept_ranges("u1", ["food_low", "food_medium_low"])
+    store.accept_ranges("u1", ["food_low", "travel_low"])
+    store.accept_ranges("u2", ["rent_high"])
+
+    assert store.load_accepted_ranges("u1") == {"food_low": True, "food_medium_low": True, "travel_low": True}
+    assert store.load_accepted_ranges("u2") == {"rent_high": True}
+
+def test_alert_upserts_replace_by_category_and_keep_order(store):
+    store.upsert_alerts("u1", [
+        {"category": "food", "threshold": 50, "active": True},
+        {"category": "rent", "threshold": 1200, "active": True},
+    ])
+    store.upsert_alerts("u1", [
+        {"category": "food", "threshold": 75, "active": False},
+        {"category": "travel", "threshold": 300, "active": True},
+    ])
+
+    assert store.load_alerts("u1") == [
+        {"category": "food", "threshold": 75, "active": False},
+        {"category": "rent", "threshold": 1200, "active": True},
+        {"category": "travel", "threshold": 300, "active": True},
+    ]
+    assert store.load_alerts("u2") == []
+
+def test_version_changes_on_write(store):
+    before = store.version("u1")
+    store.accept_ranges("u1", ["food_low"])
+    after_ranges = store.version("u1")
+    store.upsert_alerts("u1", [{"category": "food", "threshold": 50, "active": True}])
+
+    assert after_ranges != before
+    assert store.version("u1") != after_ranges
+
+def test_incomplete_backend_fails_when_created():
+    class ReadOnlyStore(PreferenceStore):
+        def version(self, user_id):
+            return 0
+
+        def load_accepted_ranges(self, user_id):
+            return {}
+
+        def load_alerts(self, user_id):
+            return []
+
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
+
+def test_migration_imports_json_layout(tmp_path):
+    """Every user directory ends up in SQLite with identical ranges and alerts"""
+    source = JsonPreferenceStore(str(tmp_path / "data"))
+    for i in range(7):
+        source.accept_ranges(f"user-{i}", ["food_low", f"cat{i}_medium"])
+        if i % 2:
+            source.upsert_alerts(f"user-{i}", [{"category": "food", "threshold": 10.0 * i, "active": True}])
+    # A user with alerts but no feedback directory
+    os.makedirs(tmp_path / "data" / "alerts" / "alerts-only")
+    with open(tmp_path / "data" / "alerts" / "alerts-only" / "category_alerts.json", 'w') as f:
+        json.dump([{"category": "rent", "threshold": 900, "active": False}], f)
+
+    db_path = str(tmp_path / "preferences.db")
+    assert migrate(str(tmp_path / "data"), db_path, batch_size=3) == 8
+
+    target = SqlitePreferenceStore(db_path)
+    try:
+        for user_id in source.iter_users():
+            assert target.load_accepted_ranges(user_id) == source.load_accepted_ranges(user_id)
+            assert target.load_alerts(user_id) == source.load_alerts(user_id)
+    finally:
+        target.close()
+
+def test_migration_replaces_rows_and_skips_bad_users(tmp_path):
+    """A re-run drops ranges gone from the JSON, and one malformed user doesn't roll back the batch"""
+    source = JsonPreferenceStore(str(tmp_path / "data"))
+    source.accept_ranges("good", ["food_low", "food_medium"])
+    db_path = str(tmp_path / "preferences.db")
+    assert migrate(str(tmp_path / "data"), db_path) == 1
+
+    with open(source.accepted_ranges_path("good"), 'w') as f:
+        json.dump({"food_low": True}, f)
+    source.accept_ranges("bad", ["fun_low"])
+    source.upsert_alerts("bad", [{"threshold": 10, "active": True}])
+    assert migrate(str(tmp_path / "data"), db_path) == 1
+
+    target = SqlitePreferenceStore(db_path)
+    try:
+        assert target.load_accepted_ranges("good") == {"food_low": True}
+        assert target.load_accepted_ranges("bad") == {}
+        assert target.load_alerts("bad") == []
+    finally:
+        target.close()
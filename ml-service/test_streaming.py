@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+
+# Add app directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from fastapi.testclient import TestClient
+
+from app import config
+from app.main import app, stream_detector
+from app.streaming import StreamingDetector
+
+def make_tx(i, amount, category="dining"):
+    return {"id": f"{category}-{i}", "amount": amount, "date": f"2025-01-{i + 1:02d}",
+            "category": category, "categoryName": category.title(), "currency": "USD"}
+
+def test_scores_against_history_then_updates():
+    """Each transaction is judged on what came before it; state grows one step at a time"""
+    detector = StreamingDetector(window_size=10, min_window=5)
+    amounts = [40, 42, 38, 41, 39, 40, 43]
+    verdicts = [detector.process("user", make_tx(i, amount)) for i, amount in enumerate(amounts)]
+    assert not any(v["is_anomaly"] for v in verdicts)
+    assert verdicts[4]["window_mean"] is None  # Not enough context yet
+    assert verdicts[5]["window_mean"] == 40
+
+    spike = detector.process("user", make_tx(7, 200))
+    assert spike["is_anomaly"] and spike["anomaly"]["detectionMethod"] == "streaming_window"
+    assert spike["history_count"] == len(amounts)
+
+    # Categories and users have independent state
+    assert detector.process("user", make_tx(8, 200, "rent"))["history_count"] == 0
+    assert detector.process("other-user", make_tx(9, 200))["history_count"] == 0
+
+def test_preferences_override_statistics():
+    """Alert thresholds and accepted ranges take precedence, like in batch detection"""
+    detector = StreamingDetector(window_size=10, min_window=5)
+    for i, amount in enumerate([40, 42, 38, 41, 39, 40]):
+        detector.process("user", make_tx(i, amount))
+
+    accepted = detector.process("user", make_tx(6, 120), user_accepted_ranges={"dining_medium": True})
+    assert not accepted["is_anomaly"]
+    below_threshold = detector.process("user", make_tx(7, 120), category_alerts={"dining": 150})
+    assert not below_threshold["is_anomaly"]
+    above_threshold = detector.process("user", make_tx(8, 160), category_alerts={"dining": 150})
+    assert above_threshold["anomaly"]["detectionMethod"] == "threshold"
+
+def test_snapshot_round_trip(tmp_path):
+    """State restored from a snapshot scores exactly like the original"""
+    detector = StreamingDetector(window_size=10, min_window=5)
+    for i, amount in enumerate([40, 42, 38, 41, 39, 40]):
+        detector.process("user", make_tx(i, amount))
+    path = str(tmp_path / "state.json")
+    detector.save(path)
+
+    restored = StreamingDetector(window_size=10, min_window=5)
+    restored.load(path)
+    assert restored.to_dict() == detector.to_dict()
+    assert restored.process("user", make_tx(6, 90)) == detector.process("user", make_tx(6, 90))
+
+def test_stream_endpoint(tmp_path, monkeypatch):
+    """The endpoint returns a verdict immediately and snapshots on shutdown"""
+    path = str(tmp_path / "state.json")
+    monkeypatch.setattr(config, "STREAM_SNAPSHOT_PATH", path)
+
+    with TestClient(app) as client:
+        for i, amount in enumerate([40, 42, 38, 41, 39, 40]):
+            response = client.post("/stream/transaction", json=make_tx(i, amount, "stream-test"),
+                                   headers={"Authorization": "Bearer test"})
+            assert response.status_code == 200
+            assert response.json()["is_anomaly"] is False
+        response = client.post("/stream/transaction", json=make_tx(6, 400, "stream-test"),
+                               headers={"Authorization": "Bearer test"})
+        assert response.json()["is_anomaly"] is True
+
+    assert os.path.exists(path)
+    assert any(state["category"] == "stream-test" for state in stream_detector.to_dict()["states"])
+
+def test_least_recently_updated_states_are_dropped():
+    detector = StreamingDetector(window_size=10, min_window=5, max_states=2)
+    detector.process("user", make_tx(0, 40, "a"))
+    detector.process("user", make_tx(0, 40, "b"))
+    detector.process("user", make_tx(1, 41, "a"))
+    detector.process("user", make_tx(0, 40, "c"))
+    assert [state["category"] for state in detector.to_dict()["states"]] == ["a", "c"]
+
+def test_snapshots_are_written_in_the_background(tmp_path):
+    """Updates past the threshold are saved by the snapshot task, not by the request that crossed it"""
+    detector = StreamingDetector(window_size=10, min_window=5)
+    path = str(tmp_path / "state.json")
+
+    async def scenario():
+        task = asyncio.create_task(detector.snapshot_periodically(path, every=3, interval_seconds=0.01))
+        for i in range(2):
+            detector.process("user", make_tx(i, 40))
+        await asyncio.sleep(0.05)
+        assert not os.path.exists(path)
+        detector.process("user", make_tx(2, 40))
+        assert not os.path.exists(path)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if os.path.exists(path):
+                break
+        task.cancel()
+
+    asyncio.run(scenario())
+    restored = StreamingDetector(window_size=10, min_window=5)
+    restored.load(path)
+    assert restored.to_dict() == detector.to_dict()
+    assert detector.updates_since_snapshot == 0
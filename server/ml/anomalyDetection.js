@@ -1,10 +1,108 @@
 const { IsolationForest } = require('isolation-forest');
 const { db } = require('../config/firebase-config');
 const axios = require('axios');
+const crypto = require('crypto');
 
 // Configure the ML service URL
 const ML_SERVICE_URL = process.env.ML_SERVICE_URL || 'http://localhost:8000';
 
+// Parallel arrays (one per field, null where a transaction lacks it) for the ML service's columnar endpoints,
+// which skip building an object per transaction on the Python side
+const toColumns = (transactions) => {
+  const columns = {};
+  transactions.forEach((transaction, index) => {
+    Object.keys(transaction).forEach(field => {
+      if (!columns[field]) {
+        columns[field] = new Array(transactions.length).fill(null);
+      }
+      columns[field][index] = transaction[field] === undefined ? null : transaction[field];
+    });
+  });
+  return columns;
+};
+
+// What the ML service's stored history holds per user, as last synced: { generation, rows: Map(id -> row hash) }.
+// Least recently synced users are dropped beyond the limit; their next sync simply re-seeds the service.
+const MAX_SYNCED_HISTORIES = parseInt(process.env.ML_SYNCED_HISTORIES_MAX || '1000', 10);
+const syncedHistories = new Map();
+
+const rowHash = (transaction) => crypto.createHash('sha1').update(JSON.stringify(transaction)).digest('base64');
+
+const rememberSyncedHistory = (userId, synced) => {
+  syncedHistories.delete(userId); // Re-insert so Map order is least recently synced first
+  syncedHistories.set(userId, synced);
+  while (syncedHistories.size > MAX_SYNCED_HISTORIES) {
+    syncedHistories.delete(syncedHistories.keys().next().value);
+  }
+};
+
+const mlRequestConfig = (timeout) => ({
+  headers: {
+    'Authorization': 'Bearer dummy-token', // This will be replaced with actual token in production
+    'Content-Type': 'application/json'
+  },
+  timeout
+});
+
+const isHistoryConflict = (error) => Boolean(error.response && error.response.status === 409);
+
+// Bring the ML service's stored history up to date by sending only new, edited and deleted transactions.
+// The service answers 409 when it no longer holds the history we synced (restart, eviction), so resend everything.
+// Returns the generation to pass to the /history detection endpoints.
+const syncHistory = async (userId, transactions) => {
+  const synced = syncedHistories.get(userId);
+  const rows = new Map(transactions.map(tx => [tx.id, rowHash(tx)]));
+  let response = null;
+  if (synced) {
+    const append = transactions.filter(tx => synced.rows.get(tx.id) !== rows.get(tx.id));
+    const deleted = [...synced.rows.keys()].filter(id => !rows.has(id));
+    try {
+      response = await axios.post(
+        `${ML_SERVICE_URL}/history`,
+        { append, delete: deleted, generation: synced.generation },
+        mlRequestConfig(10000)
+      );
+      console.log(`Synced history for user ${userId}: ${append.length} added, ${deleted.length} deleted`);
+    } catch (error) {
+      if (!isHistoryConflict(error)) {
+        throw error;
+      }
+    }
+  }
+  if (!response) {
+    response = await axios.post(
+      `${ML_SERVICE_URL}/history`,
+      { append: transactions, replace: true },
+      mlRequestConfig(15000)
+    );
+    console.log(`Seeded history for user ${userId} with ${transactions.length} transactions`);
+  }
+  rememberSyncedHistory(userId, { generation: response.data.generation, rows });
+  return response.data.generation;
+};
+
+// Sync the user's history, then detect over it. A 409 means the request reached a process that doesn't hold
+// the history just synced (restart, eviction, another worker), so forget what we synced, re-seed and retry once.
+const detectOverStoredHistory = async (userId, transactions) => {
+  const detect = async () => {
+    const generation = await syncHistory(userId, transactions);
+    return axios.post(
+      `${ML_SERVICE_URL}/detect-user-anomalies/history`,
+      {},
+      { ...mlRequestConfig(15000), params: { generation } } // 15 second timeout for all categories
+    );
+  };
+  try {
+    return await detect();
+  } catch (error) {
+    if (!isHistoryConflict(error)) {
+      throw error;
+    }
+    syncedHistories.delete(userId);
+    return detect();
+  }
+};
+
 // Format transactions for analysis
 const preprocessTransactions = (transactions) => {
   console.log('Preprocessing transactions:', transactions.length);
@@ -185,8 +283,8 @@ const detectAnomaliesForCategory = async (userId, categoryId) => {
       console.log('Calling Python ML service for anomaly detection');
       
       const response = await axios.post(
-        `${ML_SERVICE_URL}/detect-category-anomalies/${categoryId}`,
-        { transactions },
+        `${ML_SERVICE_URL}/detect-category-anomalies/${categoryId}/columns`,
+        { columns: toColumns(transactions) },
         {
           headers: {
             'Authorization': 'Bearer dummy-token', // This will be replaced with actual token in production
@@ -367,17 +465,8 @@ const detectAnomaliesForUser = async (userId) => {
     try {
       console.log('Calling Python ML service for user anomaly detection');
       
-      const response = await axios.post(
-        `${ML_SERVICE_URL}/detect-user-anomalies`,
-        { transactions_by_category: transactionsByCategory },
-        {
-          headers: {
-            'Authorization': 'Bearer dummy-token', // This will be replaced with actual token in production
-            'Content-Type': 'application/json'
-          },
-          timeout: 15000 // 15 second timeout for all categories
-        }
-      );
+      // Only the changes since the last call are sent; detection runs on the history the service keeps
+      const response = await detectOverStoredHistory(userId, transactions);
       
       console.log(`ML service detected ${response.data.anomalies.length} anomalies across all categories`);
       return response.data.anomalies;